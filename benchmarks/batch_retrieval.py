@@ -0,0 +1,152 @@
+"""Benchmark batch retrieval: N questions one at a time vs in one batched call, offline or against a running API."""
+
+import argparse
+import asyncio
+import tempfile
+import time
+import numpy as np
+import requests
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from rich.console import Console
+from rich.table import Table
+from medichat.cache import CachedEmbeddings
+from medichat.local_store import LocalVectorStore
+from medichat.retrieve import abatch_relevant_documents, aget_relevant_documents
+
+console = Console()
+
+
+class SlowFakeEmbedding(DeterministicFakeEmbedding):
+    """
+    Deterministic embeddings with the latency of a remote embedding call, plus a cost per text.
+    """
+
+    latency: float = 0.03
+    per_text: float = 0.0002
+    calls: int = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.calls += 1
+        time.sleep(self.latency + self.per_text * len(texts))
+        return super().embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        self.calls += 1
+        await asyncio.sleep(self.latency + self.per_text)
+        return self.embed_query(text)
+
+
+def questions(count: int) -> list[str]:
+    return [f"What are the symptoms of Condition {i} ?" for i in range(count)]
+
+
+async def aoffline(args: argparse.Namespace) -> Table:
+    """
+    Retrieve the questions from a local store, one at a time and in one batch.
+    """
+    rng = np.random.default_rng(0)
+    table = Table(
+        title=f"{args.questions} questions over {args.documents} documents "
+        f"({args.latency * 1000:.0f} ms per embedding call)"
+    )
+    for column in ["Path", "Seconds", "Questions/s", "Embedding calls"]:
+        table.add_column(column, justify="right")
+    with tempfile.TemporaryDirectory() as directory:
+        LocalVectorStore.build(
+            directory,
+            [
+                Document(page_content=f"Question {i}", metadata={"focus_area": str(i)})
+                for i in range(args.documents)
+            ],
+            rng.standard_normal((args.documents, args.dim), dtype=np.float32),
+        )
+        for name in ["one at a time", "batch"]:
+            embedding = SlowFakeEmbedding(size=args.dim, latency=args.latency)
+            vector_store = LocalVectorStore.load(directory, CachedEmbeddings(embedding))
+            start_time = time.perf_counter()
+            if name == "batch":
+                await abatch_relevant_documents(
+                    questions(args.questions), vector_store, 0.0, 4
+                )
+            else:
+                for question in questions(args.questions):
+                    await aget_relevant_documents(question, vector_store, 0.0, 4)
+            seconds = time.perf_counter() - start_time
+            table.add_row(
+                name,
+                f"{seconds:.2f}",
+                f"{args.questions / seconds:.0f}",
+                str(embedding.calls),
+            )
+    return table
+
+
+def http(args: argparse.Namespace) -> Table:
+    """
+    Retrieve the questions from a running API, one /get_sources request at a time and with /get_sources/batch.
+    """
+    payload = {"similarity_threshold": 0.0, "max_sources": 4}
+    table = Table(title=f"{args.questions} questions against {args.host}")
+    for column in ["Path", "Seconds", "Questions/s", "Requests"]:
+        table.add_column(column, justify="right")
+    with requests.Session() as session:
+        start_time = time.perf_counter()
+        for question in questions(args.questions):
+            session.post(
+                f"{args.host}/get_sources",
+                json={
+                    **payload,
+                    "question": question,
+                    "temperature": 0.2,
+                    "language": "English",
+                },
+                timeout=30,
+            ).raise_for_status()
+        seconds = time.perf_counter() - start_time
+        table.add_row(
+            "/get_sources",
+            f"{seconds:.2f}",
+            f"{args.questions / seconds:.0f}",
+            str(args.questions),
+        )
+
+        batches = [
+            questions(args.questions)[start : start + args.batch_size]
+            for start in range(0, args.questions, args.batch_size)
+        ]
+        start_time = time.perf_counter()
+        for batch in batches:
+            session.post(
+                f"{args.host}/get_sources/batch",
+                json={**payload, "questions": batch},
+                timeout=300,
+            ).raise_for_status()
+        seconds = time.perf_counter() - start_time
+        table.add_row(
+            "/get_sources/batch",
+            f"{seconds:.2f}",
+            f"{args.questions / seconds:.0f}",
+            str(len(batches)),
+        )
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--host",
+        default=None,
+        help="URL of a running API, e.g. http://0.0.0.0:8181. Defaults to an offline local store.",
+    )
+    parser.add_argument("--questions", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--documents", type=int, default=16_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--latency", type=float, default=0.03)
+    args = parser.parse_args()
+    console.print(http(args) if args.host else asyncio.run(aoffline(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Benchmark the end-to-end latency of /get_sources + /answer against /chat and /chat/stream."""
+
+import argparse
+import json
+import time
+from statistics import mean, median, quantiles
+import requests
+from rich.console import Console
+from rich.table import Table
+
+HOST = "http://0.0.0.0:8181"
+QUESTIONS = [
+    "What is Glaucoma ?",
+    "What are the symptoms of diabetes ?",
+    "How to prevent high blood pressure ?",
+    "What causes asthma ?",
+]
+# Generation is not cached, so both paths pay for the same LLM call
+HEADERS = {"Cache-Control": "no-cache"}
+console = Console()
+
+
+def payload(question: str) -> dict:
+    """
+    Build the request body shared by every endpoint.
+
+    Args:
+        question (str): The question to ask the chatbot.
+
+    Returns:
+        dict: The JSON body of the request.
+    """
+    return {
+        "question": question,
+        "temperature": 0.2,
+        "similarity_threshold": 0.75,
+        "max_sources": 4,
+        "language": "English",
+        "previous_context": [],
+    }
+
+
+def two_calls(session: requests.Session, question: str) -> int:
+    """
+    Ask a question through /get_sources then /answer, as clients used to.
+
+    Args:
+        session (requests.Session): The HTTP session to send the requests with.
+        question (str): The question to ask the chatbot.
+
+    Returns:
+        int: The number of bytes sent over the wire.
+    """
+    body = payload(question)
+    sources = session.post(f"{HOST}/get_sources", json=body, timeout=60)
+    sources.raise_for_status()
+    body["documents"] = sources.json()
+    answer = session.post(f"{HOST}/answer", json=body, headers=HEADERS, timeout=60)
+    answer.raise_for_status()
+    return len(json.dumps(payload(question))) + len(json.dumps(body))
+
+
+def one_call(session: requests.Session, question: str) -> int:
+    """
+    Ask a question through /chat.
+
+    Args:
+        session (requests.Session): The HTTP session to send the request with.
+        question (str): The question to ask the chatbot.
+
+    Returns:
+        int: The number of bytes sent over the wire.
+    """
+    body = payload(question)
+    response = session.post(f"{HOST}/chat", json=body, headers=HEADERS, timeout=60)
+    response.raise_for_status()
+    return len(json.dumps(body))
+
+
+def first_token(session: requests.Session, question: str) -> tuple[float, float]:
+    """
+    Ask a question through /chat/stream and time the first token and the whole stream.
+
+    Args:
+        session (requests.Session): The HTTP session to send the request with.
+        question (str): The question to ask the chatbot.
+
+    Returns:
+        tuple[float, float]: The time to first token and the total time, in seconds.
+    """
+    start_time = time.perf_counter()
+    time_to_first_token = None
+    with session.post(
+        f"{HOST}/chat/stream",
+        json=payload(question),
+        headers=HEADERS,
+        stream=True,
+        timeout=60,
+    ) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if line and time_to_first_token is None:
+                if json.loads(line)["type"] == "token":
+                    time_to_first_token = time.perf_counter() - start_time
+    total = time.perf_counter() - start_time
+    return time_to_first_token or total, total
+
+
+def main():
+    """
+    Compare the latency and the uploaded bytes of both paths against a running API.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    table = Table(title=f"End-to-end latency ({args.rounds} rounds)")
+    for column in ["Path", "Mean (s)", "p50 (s)", "p95 (s)", "Uploaded (bytes)"]:
+        table.add_column(column, justify="right")
+
+    session = requests.Session()
+    for name, ask in [("/get_sources + /answer", two_calls), ("/chat", one_call)]:
+        latencies, uploaded = [], []
+        for _ in range(args.rounds):
+            for question in QUESTIONS:
+                start_time = time.perf_counter()
+                uploaded.append(ask(session, question))
+                latencies.append(time.perf_counter() - start_time)
+        table.add_row(
+            name,
+            f"{mean(latencies):.3f}",
+            f"{median(latencies):.3f}",
+            f"{quantiles(latencies, n=20)[-1]:.3f}",
+            f"{mean(uploaded):.0f}",
+        )
+    console.print(table)
+
+    streamed = [
+        first_token(session, question)
+        for _ in range(args.rounds)
+        for question in QUESTIONS
+    ]
+    table = Table(title=f"/chat/stream ({args.rounds} rounds)")
+    for column in ["Metric", "Mean (s)", "p50 (s)", "p95 (s)"]:
+        table.add_column(column, justify="right")
+    for name, values in [
+        ("Time to first token", [ttft for ttft, _ in streamed]),
+        ("Total", [total for _, total in streamed]),
+    ]:
+        table.add_row(
+            name,
+            f"{mean(values):.3f}",
+            f"{median(values):.3f}",
+            f"{quantiles(values, n=20)[-1]:.3f}",
+        )
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Benchmark the throughput of the API under concurrent requests."""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median
+import requests
+from rich.console import Console
+from rich.table import Table
+
+HOST = "http://0.0.0.0:8181"
+QUESTION = "What is Glaucoma ?"
+console = Console()
+
+
+def post(endpoint: str, payload: dict) -> float:
+    """
+    Send one request to the API and measure its latency.
+
+    Args:
+        endpoint (str): The endpoint of the API, e.g. '/get_sources'.
+        payload (dict): The JSON body of the request.
+
+    Returns:
+        float: The latency of the request in seconds.
+
+    Raises:
+        requests.HTTPError: If the API returns an error status code.
+    """
+    start_time = time.perf_counter()
+    response = requests.post(f"{HOST}{endpoint}", json=payload, timeout=120)
+    response.raise_for_status()
+    return time.perf_counter() - start_time
+
+
+def run(endpoint: str, payload: dict, num_requests: int, concurrency: int) -> dict:
+    """
+    Send requests to an endpoint from a pool of concurrent clients.
+
+    Args:
+        endpoint (str): The endpoint of the API.
+        payload (dict): The JSON body of every request.
+        num_requests (int): The total number of requests.
+        concurrency (int): The number of requests in flight at the same time.
+
+    Returns:
+        dict: The throughput in requests per second and the median latency in seconds.
+    """
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(
+            executor.map(lambda _: post(endpoint, payload), range(num_requests))
+        )
+    elapsed = time.perf_counter() - start_time
+    return {"throughput": num_requests / elapsed, "median": median(latencies)}
+
+
+def main():
+    """
+    Measure the throughput of /get_sources and /answer against a running API.
+
+    Start the API with a single worker to compare request paths, e.g.
+    `uvicorn src.medichat.api:app --port 8181 --workers 1`.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 64])
+    args = parser.parse_args()
+
+    payload = {
+        "question": QUESTION,
+        "temperature": 0.2,
+        "similarity_threshold": 0.75,
+        "max_sources": 4,
+        "language": "English",
+        "documents": [],
+        "previous_context": [],
+    }
+    payload["documents"] = requests.post(
+        f"{HOST}/get_sources", json=payload, timeout=120
+    ).json()
+
+    table = Table(title=f"Throughput ({args.requests} requests per run)")
+    for column in ["Endpoint", "Concurrency", "Requests/s", "Median latency (s)"]:
+        table.add_column(column, justify="right")
+    for endpoint in ["/get_sources", "/answer"]:
+        for concurrency in args.concurrency:
+            stats = run(endpoint, payload, args.requests, concurrency)
+            table.add_row(
+                endpoint,
+                str(concurrency),
+                f"{stats['throughput']:.1f}",
+                f"{stats['median']:.3f}",
+            )
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Benchmark the diversity stage of the vector retrieval (offline): CPU time, distinct answers and prompt tokens spent on duplicates."""
+
+import argparse
+import asyncio
+import tempfile
+import time
+from statistics import mean
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from rich.console import Console
+from rich.table import Table
+from medichat.config import DIVERSITY_FETCH_FACTOR
+from medichat.context import estimate_tokens
+from medichat.diversity import diversify
+from medichat.local_store import LocalVectorStore
+from medichat.retrieve import (
+    adiverse_relevant_documents,
+    aget_relevant_documents,
+    format_relevant_documents,
+)
+
+SOURCES = ["GARD", "GHR", "MPlusHealthTopics", "NIDDK", "NINDS", "CancerGov"]
+console = Console()
+
+
+class LookupEmbeddings(Embeddings):
+    """
+    Embeddings returning precomputed query vectors, so that only the search and the selection are timed.
+    """
+
+    def __init__(self, vectors: dict[str, np.ndarray]) -> None:
+        self.vectors = vectors
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.vectors[text].tolist() for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.vectors[text].tolist()
+
+
+def corpus_with_duplicates(
+    topics: int, dim: int, noise: float, rng: np.random.Generator
+) -> tuple[list[Document], np.ndarray]:
+    """
+    Build a MedQuAD-like corpus where a topic is answered by 1 to 4 sources with near-identical rows.
+
+    Returns:
+        tuple[list[Document], np.ndarray]: The documents, with the 'topic' of each in its metadata, and their vectors.
+    """
+    centers = rng.standard_normal((topics, dim), dtype=np.float32)
+    vocabulary = [f"term{i}" for i in range(5000)]
+    documents, vectors = [], []
+    for topic, center in enumerate(centers):
+        answer = " ".join(rng.choice(vocabulary, size=int(rng.integers(60, 400))))
+        for source in rng.choice(SOURCES, size=int(rng.integers(1, 5)), replace=False):
+            documents.append(
+                Document(
+                    page_content=f"What is (are) Topic {topic} ?",
+                    metadata={
+                        "answer": answer,
+                        "source": str(source),
+                        "focus_area": f"Topic {topic}",
+                        "topic": topic,
+                    },
+                )
+            )
+            vectors.append(center + noise * rng.standard_normal(dim, dtype=np.float32))
+    return documents, np.stack(vectors)
+
+
+async def arun(search, questions: list[str]) -> tuple[float, list[list[Document]]]:
+    results = []
+    start_time = time.process_time()
+    for question in questions:
+        results.append(await search(question))
+    return (time.process_time() - start_time) * 1000 / len(questions), results
+
+
+def selection_us(
+    vector_store: LocalVectorStore,
+    queries: dict[str, np.ndarray],
+    max_sources: int,
+    diversity: str,
+) -> float:
+    """
+    Time the selection alone, over the candidates fetched for each query.
+    """
+    seconds = 0.0
+    for vector in queries.values():
+        _, candidates = vector_store.similarity_search_with_vectors_by_vector(
+            vector, max_sources * DIVERSITY_FETCH_FACTOR
+        )
+        start_time = time.perf_counter()
+        diversify(vector, candidates, max_sources, diversity)
+        seconds += time.perf_counter() - start_time
+    return seconds * 1e6 / len(queries)
+
+
+def main():
+    """
+    Retrieve with and without the diversity stage, and count the duplicate answers and the prompt tokens they take.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--topics", type=int, default=6000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--max-sources", type=int, nargs="+", default=[4, 10])
+    parser.add_argument(
+        "--noise",
+        type=float,
+        default=0.1,
+        help="Spread of the rows of a topic around its center (0.1: cosine about 0.99).",
+    )
+    parser.add_argument(
+        "--query-noise",
+        type=float,
+        default=0.6,
+        help="Spread of the questions around their topic (0.6: cosine about 0.85).",
+    )
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    documents, vectors = corpus_with_duplicates(args.topics, args.dim, args.noise, rng)
+    picks = rng.integers(0, args.topics, size=args.queries)
+    # Questions close to a topic but not exactly on it
+    queries = {
+        f"Question {i} about Topic {topic}": vectors[
+            next(j for j, doc in enumerate(documents) if doc.metadata["topic"] == topic)
+        ]
+        + args.query_noise * rng.standard_normal(args.dim, dtype=np.float32)
+        for i, topic in enumerate(picks)
+    }
+    questions = list(queries)
+
+    with tempfile.TemporaryDirectory() as directory:
+        LocalVectorStore.build(directory, documents, vectors)
+        vector_store = LocalVectorStore.load(directory, LookupEmbeddings(queries))
+
+        table = Table(
+            title=f"Diversity over {len(documents)} rows of {args.topics} topics "
+            f"({len(documents) / args.topics:.1f} rows per topic, {args.queries} queries)"
+        )
+        for column in [
+            "Max sources",
+            "Diversity",
+            "CPU ms per query",
+            "Selection µs",
+            "Distinct topics",
+            "Document tokens",
+            "Tokens on duplicates",
+            "Mean score",
+        ]:
+            table.add_column(column, justify="right")
+        for max_sources in args.max_sources:
+            for diversity in ["none", "mmr", "dedup"]:
+                if diversity == "none":
+                    search = lambda question: aget_relevant_documents(  # noqa: E731
+                        question, vector_store, 0.0, max_sources
+                    )
+                else:
+                    search = lambda question: adiverse_relevant_documents(  # noqa: E731
+                        question, vector_store, 0.0, max_sources, diversity
+                    )
+                asyncio.run(arun(search, questions[:20]))  # warm up
+                cpu_ms, results = asyncio.run(arun(search, questions))
+                distinct, tokens, duplicate_tokens, scores = [], [], [], []
+                for docs in results:
+                    seen = set()
+                    wasted = 0
+                    for doc in docs:
+                        if doc.metadata["topic"] in seen:
+                            wasted += estimate_tokens(format_relevant_documents([doc]))
+                        seen.add(doc.metadata["topic"])
+                    distinct.append(len(seen))
+                    tokens.append(estimate_tokens(format_relevant_documents(docs)))
+                    duplicate_tokens.append(wasted)
+                    scores.extend(doc.metadata["score"] for doc in docs)
+                table.add_row(
+                    str(max_sources),
+                    diversity,
+                    f"{cpu_ms:.2f}",
+                    "-"
+                    if diversity == "none"
+                    else f"{selection_us(vector_store, queries, max_sources, diversity):.0f}",
+                    f"{mean(distinct):.2f}",
+                    f"{mean(tokens):.0f}",
+                    f"{mean(duplicate_tokens):.0f}",
+                    f"{mean(scores):.3f}",
+                )
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Benchmark the token-budgeted packing of the retrieved documents (offline): prompt tokens, question-term coverage and CPU time."""
+
+import argparse
+import csv
+import os
+import time
+from statistics import mean
+from langchain_core.documents import Document
+from rich.console import Console
+from rich.table import Table
+from medichat.context import estimate_tokens
+from medichat.lexical import BM25Index, tokenize
+from medichat.packing import pack_documents
+from medichat.retrieve import format_relevant_documents
+
+MEDQUAD_PATH = "./downloaded_files/medquad.csv"
+FIXTURE_PATH = os.path.join(
+    os.path.dirname(__file__), "loadtest", "medquad_fixture.csv"
+)
+console = Console()
+
+
+def load_documents(path: str) -> list[Document]:
+    with open(path, newline="", encoding="utf-8") as f:
+        return [
+            Document(
+                page_content=row["question"],
+                metadata={
+                    "answer": row["answer"] or "",
+                    "source": row["source"],
+                    "focus_area": row["focus_area"],
+                },
+            )
+            for row in csv.DictReader(f)
+        ]
+
+
+def coverage(question: str, text: str) -> float:
+    """
+    Share of the question terms found in the packed answers, a cheap proxy of what the LLM can ground its answer on.
+    """
+    terms = set(tokenize(question))
+    return len(terms.intersection(tokenize(text))) / len(terms) if terms else 1.0
+
+
+def main():
+    """
+    Retrieve sources with BM25 for sampled questions, then pack them at each token budget and measure the prompt saved.
+
+    The answer similarity of the generated answers, which needs the LLM, is
+    reported by the evaluation (`poetry run python src/medichat/eval.py`) for
+    each budget of PACKING_BUDGETS.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--dataset",
+        default=MEDQUAD_PATH if os.path.exists(MEDQUAD_PATH) else FIXTURE_PATH,
+    )
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--max-sources", type=int, nargs="+", default=[4, 10, 20])
+    parser.add_argument(
+        "--budgets", type=int, nargs="+", default=[0, 4000, 2000, 1000, 500]
+    )
+    args = parser.parse_args()
+
+    documents = load_documents(args.dataset)
+    index = BM25Index(documents)
+    step = max(1, len(documents) // args.questions)
+    questions = [document.page_content for document in documents[::step]][
+        : args.questions
+    ]
+
+    table = Table(
+        title=f"Document packing on {len(questions)} questions of {os.path.basename(args.dataset)}"
+    )
+    for column in [
+        "Max sources",
+        "Token budget",
+        "Document tokens",
+        "Reduction",
+        "Sources kept",
+        "Term coverage",
+        "ms per prompt",
+    ]:
+        table.add_column(column, justify="right")
+    for max_sources in args.max_sources:
+        retrieved = []
+        for question in questions:
+            results = index.search(question, k=max_sources)
+            best = results[0][1] if results else 1.0
+            for document, score in results:
+                document.metadata["score"] = score / best
+            retrieved.append([document for document, _ in results])
+
+        whole = None
+        for budget in args.budgets:
+            tokens, kept, coverages, seconds = [], [], [], 0.0
+            for question, sources in zip(questions, retrieved):
+                start_time = time.perf_counter()
+                packed = pack_documents(sources, question, budget)
+                seconds += time.perf_counter() - start_time
+                formatted = format_relevant_documents(packed)
+                tokens.append(estimate_tokens(formatted))
+                kept.append(len(packed))
+                coverages.append(
+                    coverage(
+                        question,
+                        " ".join(document.metadata["answer"] for document in packed),
+                    )
+                )
+            if whole is None:
+                whole = mean(tokens)
+            table.add_row(
+                str(max_sources),
+                str(budget or "whole"),
+                f"{mean(tokens):.0f}",
+                f"{1 - mean(tokens) / whole:.1%}",
+                f"{mean(kept):.1f}",
+                f"{mean(coverages):.3f}",
+                f"{seconds * 1000 / len(questions):.2f}",
+            )
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Benchmark the evaluation scoring: two encode calls per sample vs one batched, deduplicated and cached stage."""
+
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from rich.console import Console
+from rich.table import Table
+from medichat.eval import CSV_FILE_PATH, model, score_answers
+
+console = Console()
+
+
+def load_samples(count: int, sources: int) -> tuple[list[str], list[list[str]]]:
+    """
+    Build chatbot answers and their source answers from MedQuAD answers.
+
+    Source answers are drawn from a pool smaller than the number of samples,
+    so that they repeat across samples as retrieved documents do.
+    """
+    rng = np.random.default_rng(0)
+    if os.path.exists(CSV_FILE_PATH):
+        pool = pd.read_csv(CSV_FILE_PATH)["answer"].dropna().astype(str).tolist()
+    else:
+        words = [f"word{i}" for i in range(2000)]
+        pool = [" ".join(rng.choice(words, size=150)) for _ in range(count * 2)]
+    pool = pool[: max(count, 1) * 2]
+    answers = [pool[i][:600] for i in rng.integers(0, len(pool), size=count)]
+    source_answers = [
+        [pool[i] for i in rng.integers(0, len(pool) // 2, size=sources)]
+        for _ in range(count)
+    ]
+    return answers, source_answers
+
+
+def per_sample_scores(
+    answers: list[str], source_answers: list[list[str]]
+) -> list[float]:
+    """
+    The former scoring: encode each answer, then its sources, and compare them, one sample at a time.
+    """
+    scores = []
+    for answer, sources in zip(answers, source_answers):
+        answer_embedding = model.encode([answer], normalize_embeddings=True)[0]
+        source_embeddings = model.encode(sources, normalize_embeddings=True)
+        scores.append(float(np.max(source_embeddings @ answer_embedding)))
+    return scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--samples", type=int, default=1000)
+    parser.add_argument("--sources", type=int, default=4)
+    args = parser.parse_args()
+
+    answers, source_answers = load_samples(args.samples, args.sources)
+    distinct = len(set(answers) | {text for s in source_answers for text in s})
+    table = Table(
+        title=f"Scoring {args.samples} samples with {args.sources} sources "
+        f"({distinct} distinct texts out of {args.samples * (args.sources + 1)})"
+    )
+    for column in ["Scoring", "Seconds", "Max score difference"]:
+        table.add_column(column, justify="right")
+
+    start_time = time.perf_counter()
+    reference = np.array(per_sample_scores(answers, source_answers))
+    table.add_row("per sample", f"{time.perf_counter() - start_time:.2f}", "-")
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache_path = os.path.join(directory, "scoring_embeddings.sqlite")
+        for name in ["batched (cold cache)", "batched (warm cache)"]:
+            start_time = time.perf_counter()
+            scores = score_answers(answers, source_answers, cache_path)
+            table.add_row(
+                name,
+                f"{time.perf_counter() - start_time:.2f}",
+                f"{np.abs(scores - reference).max():.1e}",
+            )
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Benchmark the bucket sync offline against an in-process GCS stub: sequential vs parallel, cold vs warm."""
+
+import argparse
+import base64
+import hashlib
+import os
+import tempfile
+import time
+import google_crc32c
+from rich.console import Console
+from rich.table import Table
+from medichat.gcs import BucketListing, sync_bucket
+
+console = Console()
+
+
+class FakeBlob:
+    """
+    In-memory blob with the metadata of a GCS object and a per-request latency.
+    """
+
+    def __init__(self, name: str, data: bytes, latency: float) -> None:
+        self.name = name
+        self.data = data
+        self.latency = latency
+        self.generation = 1
+        self.size = len(data)
+        self.md5_hash = base64.b64encode(hashlib.md5(data).digest()).decode()
+        self.crc32c = base64.b64encode(google_crc32c.Checksum(data).digest()).decode()
+        self.chunk_size = None
+
+    def download_to_filename(self, filename: str, checksum=None) -> None:
+        chunk_size = self.chunk_size or self.size
+        with open(filename, "wb") as f:
+            for start in range(0, self.size, chunk_size):
+                time.sleep(self.latency)
+                f.write(self.data[start : start + chunk_size])
+
+
+class FakeBucket:
+    def __init__(self, blobs: list[FakeBlob], latency: float) -> None:
+        self.blobs = blobs
+        self.latency = latency
+
+    def list_blobs(self, prefix: str = ""):
+        time.sleep(self.latency)
+        return [blob for blob in self.blobs if blob.name.startswith(prefix)]
+
+
+class FakeClient:
+    """
+    Stand-in for storage.Client, serving one bucket.
+    """
+
+    def __init__(self, bucket: FakeBucket) -> None:
+        self._bucket = bucket
+
+    def bucket(self, bucket_name: str) -> FakeBucket:
+        return self._bucket
+
+
+def main():
+    """
+    Compare downloading a bucket directory one blob at a time with the parallel sync, then time the listing cache.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=32)
+    parser.add_argument("--size", type=int, default=4 * 1024 * 1024)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    client = FakeClient(
+        FakeBucket(
+            [
+                FakeBlob(f"data/file_{i}.csv", os.urandom(args.size), args.latency)
+                for i in range(args.files)
+            ],
+            args.latency,
+        )
+    )
+    table = Table(
+        title=f"Download of {args.files} files of {args.size // 1024} KiB "
+        f"({args.latency * 1000:.0f} ms per request)"
+    )
+    for column in ["Path", "Seconds", "Downloaded", "Skipped"]:
+        table.add_column(column, justify="right")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sequential_dir = os.path.join(tmp, "sequential")
+        os.makedirs(sequential_dir)
+        start_time = time.perf_counter()
+        for blob in client.bucket("bucket").list_blobs(prefix="data/"):
+            blob.download_to_filename(
+                os.path.join(sequential_dir, os.path.basename(blob.name))
+            )
+        table.add_row(
+            "One blob at a time",
+            f"{time.perf_counter() - start_time:.2f}",
+            str(args.files),
+            "0",
+        )
+
+        sync_dir = os.path.join(tmp, "sync")
+        for name in ["sync_bucket (cold)", "sync_bucket (warm)"]:
+            start_time = time.perf_counter()
+            report = sync_bucket(client, "bucket", sync_dir)
+            table.add_row(
+                name,
+                f"{time.perf_counter() - start_time:.2f}",
+                str(len(report["downloaded"])),
+                str(len(report["skipped"])),
+            )
+
+        # Without the manifest, the local files are validated by their checksums
+        os.remove(os.path.join(sync_dir, ".gcs_manifest.json"))
+        start_time = time.perf_counter()
+        report = sync_bucket(client, "bucket", sync_dir)
+        table.add_row(
+            "sync_bucket (warm, no manifest)",
+            f"{time.perf_counter() - start_time:.2f}",
+            str(len(report["downloaded"])),
+            str(len(report["skipped"])),
+        )
+    console.print(table)
+
+    listing = BucketListing(client, "bucket")
+    start_time = time.perf_counter()
+    for _ in range(100):
+        client.bucket("bucket").list_blobs(prefix="data/")
+    uncached = (time.perf_counter() - start_time) / 100
+    start_time = time.perf_counter()
+    for _ in range(100):
+        listing.get()
+    cached = (time.perf_counter() - start_time) / 100
+    console.print(
+        f"Bucket listing: {uncached * 1000:.2f} ms per call uncached, "
+        f"{cached * 1000:.3f} ms per call with the TTL cache"
+    )
+
+
+if __name__ == "__main__":
+    main()
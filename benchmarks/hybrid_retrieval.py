@@ -0,0 +1,158 @@
+"""Benchmark the hybrid retrieval (offline): BM25 index build, search latency and the lexical fast path."""
+
+import argparse
+import asyncio
+import tempfile
+import time
+from statistics import mean, median, quantiles
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from rich.console import Console
+from rich.table import Table
+from medichat.lexical import BM25Index
+from medichat.local_store import LocalVectorStore
+from medichat.retrieve import aget_relevant_documents, ahybrid_relevant_documents
+
+console = Console()
+
+QUESTION_TEMPLATES = [
+    "What is (are) {} ?",
+    "What are the symptoms of {} ?",
+    "What causes {} ?",
+    "How to diagnose {} ?",
+    "What are the treatments for {} ?",
+    "Is {} inherited ?",
+]
+
+
+class SlowFakeEmbedding(DeterministicFakeEmbedding):
+    """
+    Deterministic embeddings with the latency of a remote embedding call per query.
+    """
+
+    latency: float = 0.03
+
+    async def aembed_query(self, text: str) -> list[float]:
+        await asyncio.sleep(self.latency)
+        return self.embed_query(text)
+
+
+def medquad_like_documents(count: int, focus_areas: int) -> list[Document]:
+    """
+    Build documents shaped like MedQuAD rows: templated questions about synthetic focus areas.
+    """
+    rng = np.random.default_rng(0)
+    vocabulary = [f"term{i}" for i in range(5000)]
+    return [
+        Document(
+            page_content=QUESTION_TEMPLATES[i % len(QUESTION_TEMPLATES)].format(
+                f"Condition {i % focus_areas}"
+            ),
+            metadata={
+                "answer": " ".join(rng.choice(vocabulary, size=120)),
+                "source": "synthetic",
+                "focus_area": f"Condition {i % focus_areas}",
+            },
+        )
+        for i in range(count)
+    ]
+
+
+async def time_queries(search, queries: list[str]) -> list[float]:
+    durations = []
+    for query in queries:
+        start_time = time.perf_counter()
+        await search(query)
+        durations.append((time.perf_counter() - start_time) * 1000)
+    return durations
+
+
+async def amain(args: argparse.Namespace) -> None:
+    documents = medquad_like_documents(args.documents, args.focus_areas)
+    embedding = SlowFakeEmbedding(size=args.dim, latency=args.latency)
+
+    start_time = time.perf_counter()
+    lexical_index = BM25Index(documents)
+    console.print(
+        f"BM25 index over {len(documents)} documents built in "
+        f"{time.perf_counter() - start_time:.2f} s ({len(lexical_index.postings)} terms)"
+    )
+
+    rng = np.random.default_rng(1)
+    with tempfile.TemporaryDirectory() as directory:
+        LocalVectorStore.build(
+            directory,
+            documents,
+            rng.standard_normal((len(documents), args.dim), dtype=np.float32),
+        )
+        vector_store = LocalVectorStore.load(directory, embedding)
+
+        picks = rng.integers(0, args.focus_areas, size=args.queries)
+        questions = [
+            f"What are the side effects of the treatments of Condition {i} ?"
+            for i in picks
+        ]
+        entity_questions = [f"Condition {i}" for i in picks]
+
+        table = Table(
+            title=f"Retrieval over {len(documents)} documents "
+            f"({args.queries} queries, {args.latency * 1000:.0f} ms per embedding call)"
+        )
+        for column in ["Retrieval", "Mean (ms)", "p50 (ms)", "p95 (ms)"]:
+            table.add_column(column, justify="right")
+        for name, search, queries in [
+            (
+                "BM25 search only",
+                lambda question: asyncio.to_thread(lexical_index.search, question, 20),
+                questions,
+            ),
+            (
+                "vector",
+                lambda question: aget_relevant_documents(
+                    question, vector_store, 0.0, 4
+                ),
+                questions,
+            ),
+            (
+                "hybrid (RRF)",
+                lambda question: ahybrid_relevant_documents(
+                    question, question, vector_store, lexical_index, 0.0, 4
+                ),
+                questions,
+            ),
+            (
+                "hybrid, entity-only query",
+                lambda question: ahybrid_relevant_documents(
+                    question, question, vector_store, lexical_index, 0.0, 4
+                ),
+                entity_questions,
+            ),
+        ]:
+            durations = await time_queries(search, queries)
+            table.add_row(
+                name,
+                f"{mean(durations):.2f}",
+                f"{median(durations):.2f}",
+                f"{quantiles(durations, n=20)[-1]:.2f}",
+            )
+        console.print(table)
+
+
+def main():
+    """
+    Time the BM25 index, and the vector, hybrid and lexical fast path retrievals on a MedQuAD-sized corpus.
+
+    Recall is measured against the real corpus with the evaluation harness (`eval.py`).
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=16_000)
+    parser.add_argument("--focus-areas", type=int, default=3_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.03)
+    asyncio.run(amain(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""Benchmark the bulk ingestion pipeline offline: fake embeddings, SQLite stand-in for Cloud SQL."""
+
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from rich.console import Console
+from rich.table import Table
+from medichat.config import CONTENT_HASH_COLUMN
+from medichat.ingest import aingest_csv, diff_content_hashes, read_content_hashes
+
+console = Console()
+
+
+class SlowFakeEmbedding(DeterministicFakeEmbedding):
+    """
+    Deterministic embeddings with the latency of a remote embedding call per batch.
+    """
+
+    latency: float = 0.05
+    calls: int = 0
+    texts: int = 0
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.calls += 1
+        self.texts += len(texts)
+        await asyncio.sleep(self.latency)
+        return self.embed_documents(texts)
+
+
+class SQLiteBatchWriter:
+    """
+    Writes batches with one multi-row INSERT, like PostgresBatchWriter does on Cloud SQL.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents "
+            "(langchain_id TEXT PRIMARY KEY, content TEXT, embedding BLOB, "
+            "langchain_metadata TEXT, content_hash TEXT)"
+        )
+
+    async def __call__(
+        self, ids: list[str], documents: list[Document], embeddings: list[list[float]]
+    ) -> None:
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO documents VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    id,
+                    document.page_content,
+                    np.asarray(vector, dtype=np.float32).tobytes(),
+                    json.dumps(document.metadata),
+                    document.metadata[CONTENT_HASH_COLUMN],
+                )
+                for id, document, vector in zip(ids, documents, embeddings)
+            ],
+        )
+        self.conn.commit()
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def content_hashes(self) -> dict[str, str]:
+        return dict(
+            self.conn.execute("SELECT langchain_id, content_hash FROM documents")
+        )
+
+    def delete(self, ids: list[str]) -> None:
+        self.conn.executemany(
+            "DELETE FROM documents WHERE langchain_id = ?", [(id,) for id in ids]
+        )
+        self.conn.commit()
+
+
+def write_fixture(path: str, rows: int, first: int = 0, updated: int = 0) -> None:
+    """
+    Write a MedQuAD-shaped CSV.
+
+    Args:
+        path (str): The path of the CSV file.
+        rows (int): The number of question/answer pairs.
+        first (int, optional): The number of the first pair, to simulate removed and added rows. Defaults to 0.
+        updated (int, optional): The number of pairs whose answer is updated. Defaults to 0.
+    """
+    rows = range(first, first + rows)
+    pd.DataFrame(
+        {
+            "question": [f"What are the symptoms of condition {i} ?" for i in rows],
+            "answer": [
+                f"Condition {i} often has no early symptoms. " * 10
+                + ("Updated." if i < first + updated else "")
+                for i in rows
+            ],
+            "source": ["NIHSeniorHealth"] * len(rows),
+            "focus_area": [f"Condition {i}" for i in rows],
+        }
+    ).to_csv(path, index=False)
+
+
+def main():
+    """
+    Compare the ingestion throughput across batch sizes and concurrency levels, then check resuming.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    embedding = SlowFakeEmbedding(size=768, latency=args.latency)
+    table = Table(
+        title=f"Ingestion of {args.rows} rows ({args.latency * 1000:.0f} ms per embedding call)"
+    )
+    for column in ["Batch size", "Concurrency", "Seconds", "Rows/s", "Stored"]:
+        table.add_column(column, justify="right")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "medquad.csv")
+        write_fixture(csv_path, args.rows)
+        for batch_size, concurrency in [(10, 1), (100, 1), (100, 4), (250, 8)]:
+            writer = SQLiteBatchWriter(
+                os.path.join(tmp, f"{batch_size}-{concurrency}.db")
+            )
+            stats = asyncio.run(
+                aingest_csv(
+                    csv_path,
+                    embedding,
+                    writer,
+                    batch_size=batch_size,
+                    concurrency=concurrency,
+                )
+            )
+            table.add_row(
+                str(batch_size),
+                str(concurrency),
+                f"{stats['seconds']:.2f}",
+                f"{stats['rows_per_second']:.0f}",
+                str(writer.count()),
+            )
+        console.print(table)
+
+        # Interrupt a run after a few batches, then resume it from its checkpoint
+        checkpoint_path = os.path.join(tmp, "checkpoint.json")
+        writer = SQLiteBatchWriter(os.path.join(tmp, "resume.db"))
+
+        async def interrupted_run():
+            task = asyncio.create_task(
+                aingest_csv(
+                    csv_path, embedding, writer, checkpoint_path=checkpoint_path
+                )
+            )
+            await asyncio.sleep(args.latency * 3.5)
+            task.cancel()
+
+        asyncio.run(interrupted_run())
+        before = writer.count()
+        start_time = time.perf_counter()
+        stats = asyncio.run(
+            aingest_csv(csv_path, embedding, writer, checkpoint_path=checkpoint_path)
+        )
+        console.print(
+            f"Resumed run: {before} rows stored before the interruption, "
+            f"{stats['rows']} rows embedded on resume in {time.perf_counter() - start_time:.2f}s, "
+            f"{writer.count()} rows stored in total"
+        )
+
+        # Refresh the dataset: 1% of the rows removed, 1% added and 1% updated
+        changed = max(1, args.rows // 100)
+        write_fixture(csv_path, args.rows, first=changed, updated=changed)
+        embedding.calls = embedding.texts = 0
+        start_time = time.perf_counter()
+        removed, unchanged = diff_content_hashes(
+            writer.content_hashes(), read_content_hashes(csv_path)
+        )
+        writer.delete(removed)
+        stats = asyncio.run(
+            aingest_csv(csv_path, embedding, writer, existing_hashes=unchanged)
+        )
+        console.print(
+            f"Incremental refresh: {len(removed)} rows deleted, {stats['rows']} rows "
+            f"embedded in {embedding.calls} calls, {stats['skipped']} unchanged rows "
+            f"skipped, in {time.perf_counter() - start_time:.2f}s "
+            f"({writer.count()} rows stored)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Microbenchmark the per-request setup of the generation chain: rebuilt vs pooled."""
+
+import timeit
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_google_genai import ChatGoogleGenerativeAI
+from rich.console import Console
+from rich.table import Table
+from dotenv import load_dotenv
+from medichat.generate import PROMPT, PROMPT_MESSAGES, get_chain
+from medichat.config import LLM_MODEL
+
+load_dotenv()
+
+NUM_CALLS = 200
+VARIABLES = {
+    "language": "English",
+    "question": "What is Glaucoma ?",
+    "formatted_docs": "SOURCE:NEI\nQUESTION:\nWhat is Glaucoma ?\nANSWER:\n...",
+    "previous_context": [],
+    "last_entity": [],
+}
+console = Console()
+
+
+def rebuilt_setup():
+    """
+    Per-request setup before pooling: new client and template on every request.
+    """
+    llm = ChatGoogleGenerativeAI(
+        model=LLM_MODEL,
+        temperature=0.2,
+        max_tokens=None,
+        timeout=None,
+        max_retries=2,
+    )
+    prompt = ChatPromptTemplate.from_messages(messages=PROMPT_MESSAGES)
+    chain = prompt | llm
+    prompt.format_messages(**VARIABLES)
+    return chain
+
+
+def pooled_setup():
+    """
+    Per-request setup with pooling: shared chain, only the variables are bound.
+    """
+    chain = get_chain(LLM_MODEL, 0.2)
+    PROMPT.format_messages(**VARIABLES)
+    return chain
+
+
+def main():
+    """
+    Time the setup paths, without calling the model.
+    """
+    pooled_setup()  # the pool is warm after the first request
+
+    table = Table(title=f"Per-request generation setup ({NUM_CALLS} calls)")
+    for column in ["Path", "Mean (ms)"]:
+        table.add_column(column, justify="right")
+    durations = {}
+    for name, setup in [("rebuilt", rebuilt_setup), ("pooled", pooled_setup)]:
+        durations[name] = timeit.timeit(setup, number=NUM_CALLS) / NUM_CALLS * 1000
+        table.add_row(name, f"{durations[name]:.3f}")
+    console.print(table)
+    console.print(
+        f"[bold green]Speedup: {durations['rebuilt'] / durations['pooled']:.1f}x[/bold green]"
+    )
+
+
+if __name__ == "__main__":
+    main()
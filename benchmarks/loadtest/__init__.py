@@ -0,0 +1,9 @@
+"""Load test of the API on offline backends.
+
+`fakes.py` holds the stand-ins of the Google Cloud services (deterministic
+embeddings, a local vector store seeded from `medquad_fixture.csv`, and an LLM
+with a configurable time to first token and token rate), `server.py` boots the
+unmodified API on them, and `__main__.py` drives it and reports JSON:
+
+    poetry run python -m benchmarks.loadtest --concurrency 1 16 --requests 200
+"""
@@ -0,0 +1,319 @@
+"""Load test of the API on offline backends: latency percentiles, throughput and errors of /get_sources and /answer."""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from rich.console import Console
+from rich.table import Table
+from benchmarks.loadtest.fakes import load_fixture
+from benchmarks.loadtest.server import add_backend_arguments
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+ENDPOINTS = ["/get_sources", "/answer"]
+console = Console()
+
+
+def start_server(args: argparse.Namespace) -> tuple[subprocess.Popen, str]:
+    """
+    Start the API on the fake backends in a subprocess, and wait until it is ready.
+
+    Returns:
+        tuple[subprocess.Popen, str]: The server process and its URL.
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    command = [sys.executable, "-m", "benchmarks.loadtest.server", "--port", str(port)]
+    for option in [
+        "fixture",
+        "dim",
+        "embedding_latency",
+        "llm_latency",
+        "llm_tokens_per_second",
+        "answer_tokens",
+    ]:
+        command += ["--" + option.replace("_", "-"), str(getattr(args, option))]
+    process = subprocess.Popen(command)
+    host = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("The API exited before being ready")
+        try:
+            if requests.get(f"{host}/readyz", timeout=1).status_code == 200:
+                return process, host
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.05)
+    process.terminate()
+    raise RuntimeError("The API was not ready after 120 s")
+
+
+def payload(question: str, documents: list[dict]) -> dict:
+    return {
+        "question": question,
+        "temperature": 0.2,
+        "similarity_threshold": 0.0,
+        "max_sources": 4,
+        "language": "English",
+        "documents": documents,
+        "previous_context": [],
+    }
+
+
+def run(
+    host: str,
+    endpoint: str,
+    questions: list[str],
+    documents: list[dict],
+    requests_count: int,
+    concurrency: int,
+    rate: Optional[float] = None,
+) -> dict:
+    """
+    Send requests to an endpoint from `concurrency` clients, optionally paced at a fixed arrival rate.
+
+    Every request asks a distinct question, so that it misses the embedding and
+    answer caches and pays for the backends. With a rate, request i is due at
+    `i / rate` seconds and its latency is measured from that time, so the time
+    spent waiting for a free client counts (no coordinated omission).
+
+    Args:
+        host (str): The URL of the API.
+        endpoint (str): '/get_sources' or '/answer'.
+        questions (list[str]): The questions to cycle through.
+        documents (list[dict]): The sources sent to /answer.
+        requests_count (int): The number of requests.
+        concurrency (int): The number of requests in flight at most.
+        rate (float, optional): The arrival rate in requests per second. Defaults to as fast as possible.
+
+    Returns:
+        dict: The latency percentiles and mean in milliseconds, the throughput and the error rate.
+    """
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_maxsize=concurrency))
+    headers = {"Cache-Control": "no-cache"}
+    latencies: list[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def send(i: int) -> None:
+        nonlocal errors
+        due = start_time + i / rate if rate else time.perf_counter()
+        if rate:
+            time.sleep(max(0.0, due - time.perf_counter()))
+        body = payload(f"{questions[i % len(questions)]} (#{i})", documents)
+        try:
+            response = session.post(
+                host + endpoint, json=body, headers=headers, timeout=60
+            )
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        latency = time.perf_counter() - due
+        with lock:
+            if ok:
+                latencies.append(latency)
+            else:
+                errors += 1
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, range(requests_count)))
+    elapsed = time.perf_counter() - start_time
+    session.close()
+
+    p50, p95, p99 = (
+        np.percentile(latencies, [50, 95, 99]) * 1000 if latencies else [None] * 3
+    )
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "rate": rate,
+        "requests": requests_count,
+        "errors": errors,
+        "error_rate": errors / requests_count,
+        "throughput": len(latencies) / elapsed,
+        "mean_ms": float(np.mean(latencies)) * 1000 if latencies else None,
+        "p50_ms": None if p50 is None else float(p50),
+        "p95_ms": None if p95 is None else float(p95),
+        "p99_ms": None if p99 is None else float(p99),
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Find the runs that regressed against a baseline report.
+
+    A run regresses when its p50 or p95 latency grows, or its throughput drops,
+    by more than `tolerance` (relative), or when its error rate grows by more
+    than one point. p99 is reported but not compared, being too noisy on a few
+    hundred requests.
+
+    Args:
+        report (dict): The report of this run.
+        baseline (dict): The baseline report, with the same runs.
+        tolerance (float): The relative tolerance, e.g. 0.25 for 25 %.
+
+    Returns:
+        list[str]: A description of each regression, empty if none.
+    """
+    baseline_runs = {
+        (result["endpoint"], result["concurrency"], result["rate"]): result
+        for result in baseline["results"]
+    }
+    regressions = []
+    for result in report["results"]:
+        before = baseline_runs.get(
+            (result["endpoint"], result["concurrency"], result["rate"])
+        )
+        if before is None:
+            continue
+        name = f"{result['endpoint']} at concurrency {result['concurrency']}"
+        for metric in ["p50_ms", "p95_ms"]:
+            if (
+                before[metric]
+                and result[metric]
+                and result[metric] > before[metric] * (1 + tolerance)
+            ):
+                regressions.append(
+                    f"{name}: {metric} {result[metric]:.1f} vs {before[metric]:.1f}"
+                )
+        if result["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {result['throughput']:.1f} vs {before['throughput']:.1f} req/s"
+            )
+        if result["error_rate"] > before["error_rate"] + 0.01:
+            regressions.append(
+                f"{name}: error rate {result['error_rate']:.1%} vs {before['error_rate']:.1%}"
+            )
+    return regressions
+
+
+def display(report: dict) -> None:
+    table = Table(title="Load test on offline backends")
+    for column in [
+        "Endpoint",
+        "Concurrency",
+        "Req/s",
+        "p50 (ms)",
+        "p95 (ms)",
+        "p99 (ms)",
+        "Errors",
+    ]:
+        table.add_column(column, justify="right")
+    for result in report["results"]:
+        table.add_row(
+            result["endpoint"],
+            str(result["concurrency"]),
+            f"{result['throughput']:.1f}",
+            *[
+                "-" if result[metric] is None else f"{result[metric]:.1f}"
+                for metric in ["p50_ms", "p95_ms", "p99_ms"]
+            ],
+            f"{result['error_rate']:.1%}",
+        )
+    console.print(table)
+
+
+def main():
+    """
+    Boot the API on fake backends, load /get_sources and /answer, and compare the report with the baseline.
+
+    Exits with status 1 when a run regressed against the baseline, so it can
+    gate a CI job. Baselines depend on the machine: regenerate the committed one
+    with `--output benchmarks/loadtest/baseline.json` on the machine running the
+    comparisons.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--endpoints", nargs="+", default=ENDPOINTS)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16])
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=None,
+        help="Arrival rate in requests/s. Defaults to as fast as the clients can go.",
+    )
+    parser.add_argument("--output", default=None, help="Write the JSON report here.")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    add_backend_arguments(parser)
+    args = parser.parse_args()
+
+    documents = load_fixture(args.fixture)
+    questions = [document.page_content for document in documents]
+    process, host = start_server(args)
+    try:
+        sources = requests.post(
+            f"{host}/get_sources", json=payload(questions[0], []), timeout=60
+        ).json()
+        results = [
+            run(
+                host,
+                endpoint,
+                questions,
+                sources,
+                args.requests,
+                concurrency,
+                args.rate,
+            )
+            for endpoint in args.endpoints
+            for concurrency in args.concurrency
+        ]
+    finally:
+        process.terminate()
+        process.wait()
+
+    report = {
+        "config": {
+            key: getattr(args, key)
+            for key in [
+                "requests",
+                "rate",
+                "dim",
+                "embedding_latency",
+                "llm_latency",
+                "llm_tokens_per_second",
+                "answer_tokens",
+            ]
+        },
+        "results": results,
+    }
+    display(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        console.print(f"Report written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline and os.path.exists(args.baseline) and args.output != args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["config"] != report["config"]:
+            console.print(
+                f"Not compared with {args.baseline}: it was run with other settings"
+            )
+            return
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            console.print(f"[red]Regression[/red] {regression}")
+        if regressions:
+            sys.exit(1)
+        console.print(f"No regression against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
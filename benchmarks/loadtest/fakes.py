@@ -0,0 +1,159 @@
+"""Offline stand-ins for the Google Cloud backends of the API: embeddings, vector store and LLM."""
+
+import asyncio
+import csv
+import hashlib
+import re
+import time
+from typing import Any, AsyncIterator, Iterator, Optional
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from medichat.local_store import LocalVectorStore
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic bag-of-words embeddings with the latency of a remote embedding call.
+
+    Each word is mapped to a fixed random vector seeded by its hash, and a text
+    to the normalized sum of its word vectors, so texts sharing words are close
+    and retrieval returns sensible neighbours, identically on every run.
+
+    Example:
+        embeddings = FakeEmbeddings(dim=768, latency=0.02)
+    """
+
+    def __init__(self, dim: int = 768, latency: float = 0.0) -> None:
+        self.dim = dim
+        self.latency = latency
+        self._words: dict[str, np.ndarray] = {}
+
+    def _word(self, word: str) -> np.ndarray:
+        if word not in self._words:
+            seed = int.from_bytes(hashlib.md5(word.encode()).digest()[:8], "little")
+            self._words[word] = np.random.default_rng(seed).standard_normal(
+                self.dim, dtype=np.float32
+            )
+        return self._words[word]
+
+    def _embed(self, text: str) -> list[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"[^\W_]+", text.casefold()):
+            vector += self._word(word)
+        norm = float(np.linalg.norm(vector))
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        await asyncio.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model streaming a fixed-length answer with a configurable time to first token and token rate.
+
+    Example:
+        llm = FakeChatModel(latency=0.1, tokens_per_second=300, answer_tokens=32)
+    """
+
+    latency: float = 0.1
+    tokens_per_second: float = 300.0
+    answer_tokens: int = 32
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming-chat"
+
+    def _tokens(self) -> list[str]:
+        return [f"token{i} " for i in range(self.answer_tokens)]
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self.latency + self.answer_tokens / self.tokens_per_second)
+        message = AIMessage(content="".join(self._tokens()))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        for token in self._tokens():
+            time.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        for token in self._tokens():
+            await asyncio.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+def load_fixture(path: str) -> list[Document]:
+    """
+    Read a MedQuAD-shaped CSV (question, answer, source, focus_area) as vector store documents.
+
+    Args:
+        path (str): The path to the CSV file.
+
+    Returns:
+        list[Document]: The questions as content, the other columns as metadata, as ingested.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        return [
+            Document(
+                page_content=row["question"],
+                metadata={
+                    "answer": row["answer"],
+                    "source": row["source"],
+                    "focus_area": row["focus_area"],
+                },
+            )
+            for row in csv.DictReader(f)
+        ]
+
+
+def build_local_store(
+    directory: str, documents: list[Document], embeddings: FakeEmbeddings
+) -> None:
+    """
+    Embed the documents and write them as a local vector store, as `--export-local` does for the Cloud SQL table.
+
+    Args:
+        directory (str): The directory of the store.
+        documents (list[Document]): The documents to store.
+        embeddings (FakeEmbeddings): The embeddings, also used by the API to embed the questions.
+    """
+    vectors = np.array(
+        [embeddings._embed(document.page_content) for document in documents],
+        dtype=np.float32,
+    )
+    LocalVectorStore.build(directory, documents, vectors)
@@ -0,0 +1,70 @@
+"""Serve the API on the offline backends of `fakes.py`, for the load test."""
+
+import argparse
+import os
+import tempfile
+from benchmarks.loadtest.fakes import (
+    FakeChatModel,
+    FakeEmbeddings,
+    build_local_store,
+    load_fixture,
+)
+
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), "medquad_fixture.csv")
+
+
+def add_backend_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Add the options of the fake backends, shared by the server and the load test driving it.
+    """
+    parser.add_argument("--fixture", default=FIXTURE_PATH)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument(
+        "--embedding-latency",
+        type=float,
+        default=0.02,
+        help="Seconds per embedding call.",
+    )
+    parser.add_argument(
+        "--llm-latency", type=float, default=0.1, help="LLM time to first token."
+    )
+    parser.add_argument("--llm-tokens-per-second", type=float, default=300.0)
+    parser.add_argument("--answer-tokens", type=int, default=32)
+
+
+def serve(args: argparse.Namespace) -> None:
+    """
+    Build a local store from the fixture, swap the clients of the API for the fakes, and run it with uvicorn.
+
+    The API is unchanged: it runs with the 'local' vector backend, and only the
+    factories of its Google Cloud clients are replaced.
+    """
+    import uvicorn
+
+    embeddings = FakeEmbeddings(args.dim, args.embedding_latency)
+    with tempfile.TemporaryDirectory() as directory:
+        build_local_store(directory, load_fixture(args.fixture), embeddings)
+        # Read by medichat.config on import
+        os.environ["MEDICHAT_VECTOR_BACKEND"] = "local"
+        os.environ["MEDICHAT_LOCAL_STORE_PATH"] = directory
+        import medichat.api as api
+
+        llm = FakeChatModel(
+            latency=args.llm_latency,
+            tokens_per_second=args.llm_tokens_per_second,
+            answer_tokens=args.answer_tokens,
+        )
+        api.get_embeddings = lambda: embeddings
+        api.get_chain = lambda model, temperature: api.PROMPT | llm
+        uvicorn.run(api.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8181)
+    add_backend_arguments(parser)
+    serve(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
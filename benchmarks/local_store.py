@@ -0,0 +1,157 @@
+"""Benchmark the in-process vector search (offline): latency, batch queries and mmap sharing between workers."""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from statistics import mean, median, quantiles
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from rich.console import Console
+from rich.table import Table
+from medichat.local_store import EMBEDDINGS_FILE_NAME, LocalVectorStore
+
+console = Console()
+
+
+def mapping_memory(path: str) -> tuple[int, int]:
+    """
+    Read the resident and proportional memory of a file mapping of this process (Linux only).
+
+    Args:
+        path (str): The path of the mapped file.
+
+    Returns:
+        tuple[int, int]: The Rss and Pss of the mapping, in KiB.
+    """
+    rss = pss = 0
+    in_mapping = False
+    with open("/proc/self/smaps", encoding="utf-8") as f:
+        for line in f:
+            if "-" in line.split(" ", 1)[0]:
+                in_mapping = line.rstrip().endswith(path)
+            elif in_mapping and line.startswith("Rss:"):
+                rss += int(line.split()[1])
+            elif in_mapping and line.startswith("Pss:"):
+                pss += int(line.split()[1])
+    return rss, pss
+
+
+def worker(directory: str, barrier, results) -> None:
+    """
+    Load the store like an API worker, search the whole matrix, and report the memory of its mapping.
+    """
+    vector_store = LocalVectorStore.load(directory, DeterministicFakeEmbedding(size=8))
+    vector_store.search(np.ones((1, vector_store.vectors.shape[1])), k=4)
+    barrier.wait()
+    results.put(
+        mapping_memory(os.path.realpath(os.path.join(directory, EMBEDDINGS_FILE_NAME)))
+    )
+    barrier.wait()
+
+
+def main():
+    """
+    Time single and batched searches over a MedQuAD-sized matrix, then measure the memory of several workers.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=16_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as directory:
+        LocalVectorStore.build(
+            directory,
+            [
+                Document(
+                    page_content=f"Question {i}", metadata={"focus_area": str(i % 50)}
+                )
+                for i in range(args.documents)
+            ],
+            rng.standard_normal((args.documents, args.dim), dtype=np.float32),
+        )
+        vector_store = LocalVectorStore.load(
+            directory, DeterministicFakeEmbedding(size=args.dim)
+        )
+        queries = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+
+        table = Table(
+            title=f"Search over {args.documents} x {args.dim} float32 ({args.queries} queries, k=4)"
+        )
+        for column in ["Search", "Mean (ms/query)", "p50 (ms)", "p95 (ms)"]:
+            table.add_column(column, justify="right")
+
+        def time_queries(search) -> list[float]:
+            durations = []
+            for query in queries:
+                start_time = time.perf_counter()
+                search(query)
+                durations.append((time.perf_counter() - start_time) * 1000)
+            return durations
+
+        for name, search in [
+            (
+                "full argsort",
+                lambda query: np.argsort(-(vector_store.vectors @ query))[:4],
+            ),
+            (
+                "argpartition",
+                lambda query: vector_store.similarity_search_with_score_by_vector(
+                    query, k=4
+                ),
+            ),
+            (
+                "argpartition + filter",
+                lambda query: vector_store.similarity_search_with_score_by_vector(
+                    query, k=4, filter={"focus_area": "7"}
+                ),
+            ),
+        ]:
+            durations = time_queries(search)
+            table.add_row(
+                name,
+                f"{mean(durations):.3f}",
+                f"{median(durations):.3f}",
+                f"{quantiles(durations, n=20)[-1]:.3f}",
+            )
+        for batch_size in [16, 64]:
+            start_time = time.perf_counter()
+            for start in range(0, args.queries, batch_size):
+                vector_store.batch_similarity_search_with_score_by_vectors(
+                    queries[start : start + batch_size], k=4
+                )
+            per_query = (time.perf_counter() - start_time) * 1000 / args.queries
+            table.add_row(f"batch of {batch_size}", f"{per_query:.3f}", "-", "-")
+        console.print(table)
+
+        if not os.path.exists("/proc/self/smaps"):
+            return
+        context = multiprocessing.get_context("spawn")
+        barrier = context.Barrier(args.workers)
+        results = context.Queue()
+        processes = [
+            context.Process(target=worker, args=(directory, barrier, results))
+            for _ in range(args.workers)
+        ]
+        for process in processes:
+            process.start()
+        memory = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        size = args.documents * args.dim * 4 // 1024
+        console.print(
+            f"{args.workers} workers mapping the {size} KiB matrix: "
+            f"Rss {mean(rss for rss, _ in memory):.0f} KiB per worker, "
+            f"Pss {mean(pss for _, pss in memory):.0f} KiB per worker "
+            f"({sum(pss for _, pss in memory)} KiB in total, vs "
+            f"{args.workers * size} KiB for private copies)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""Benchmark metadata pre-filtering: latency and precision of filtered vs unfiltered vector search."""
+
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from statistics import mean, quantiles
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from rich.console import Console
+from rich.table import Table
+from medichat.local_store import LocalVectorStore
+from medichat.retrieve import search_kwargs
+
+console = Console()
+
+
+async def run_searches(
+    vector_store, queries: list[tuple[list[float], str]], k: int, filtered: bool
+) -> tuple[list[float], list[float]]:
+    """
+    Search each query vector, optionally filtered on the focus area it is about.
+
+    Args:
+        vector_store (VectorStore): The PostgresVectorStore or LocalVectorStore to search.
+        queries (list[tuple[list[float], str]]): The query vectors and their focus areas.
+        k (int): The number of results per query.
+        filtered (bool): Filter the search on the focus area of the query.
+
+    Returns:
+        tuple[list[float], list[float]]: The latency in milliseconds and the precision of each query,
+        the share of its results about its focus area.
+    """
+    latencies, precisions = [], []
+    for vector, focus_area in queries:
+        kwargs = search_kwargs(
+            vector_store, vector, 0.0, {"focus_area": focus_area} if filtered else None
+        )
+        start_time = time.perf_counter()
+        docs_distances = await vector_store.asimilarity_search_with_score_by_vector(
+            vector, k=k, **kwargs
+        )
+        latencies.append((time.perf_counter() - start_time) * 1000)
+        precisions.append(
+            mean(doc.metadata["focus_area"] == focus_area for doc, _ in docs_distances)
+            if docs_distances
+            else 0.0
+        )
+    return latencies, precisions
+
+
+def report(title: str, results: dict[str, tuple[list[float], list[float]]]) -> None:
+    table = Table(title=title)
+    for column in ["Search", "Precision", "Mean (ms)", "p95 (ms)"]:
+        table.add_column(column, justify="right")
+    for name, (latencies, precisions) in results.items():
+        table.add_row(
+            name,
+            f"{mean(precisions):.3f}",
+            f"{mean(latencies):.2f}",
+            f"{quantiles(latencies, n=20)[-1]:.2f}",
+        )
+    console.print(table)
+
+
+async def alocal(args: argparse.Namespace) -> None:
+    """
+    Search a synthetic corpus whose embeddings cluster by focus area, with overlapping clusters.
+    """
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((args.focus_areas, args.dim), dtype=np.float32)
+    focus = rng.integers(0, args.focus_areas, size=args.documents)
+    vectors = centers[focus] + args.spread * rng.standard_normal(
+        (args.documents, args.dim), dtype=np.float32
+    )
+    documents = [
+        Document(
+            page_content=f"Question {i}",
+            metadata={"focus_area": f"Condition {f}", "source": "synthetic"},
+        )
+        for i, f in enumerate(focus)
+    ]
+    picks = rng.integers(0, args.focus_areas, size=args.queries)
+    query_vectors = centers[picks] + args.spread * rng.standard_normal(
+        (args.queries, args.dim), dtype=np.float32
+    )
+    queries = [
+        (vector.tolist(), f"Condition {f}") for vector, f in zip(query_vectors, picks)
+    ]
+    with tempfile.TemporaryDirectory() as directory:
+        LocalVectorStore.build(directory, documents, vectors)
+        vector_store = LocalVectorStore.load(
+            directory, DeterministicFakeEmbedding(size=args.dim)
+        )
+        report(
+            f"Local store: {args.documents} documents in {args.focus_areas} focus areas "
+            f"({args.queries} queries, k={args.k})",
+            {
+                "unfiltered": await run_searches(vector_store, queries, args.k, False),
+                "focus_area filter": await run_searches(
+                    vector_store, queries, args.k, True
+                ),
+            },
+        )
+
+
+async def apostgres(args: argparse.Namespace) -> None:
+    """
+    Search the Cloud SQL table with stored embeddings as queries, each filtered on its own focus area.
+    """
+    from dotenv import load_dotenv
+    from medichat.config import EMBEDDING_COLUMN, TABLE_NAME, VECTOR_INDEX_TYPE
+    from medichat.ingest import (
+        acreate_cloud_sql_database_connection,
+        aexecute,
+        aget_vector_store,
+        search_options,
+    )
+
+    load_dotenv()
+    engine = await acreate_cloud_sql_database_connection()
+    try:
+        rows = await aexecute(
+            engine,
+            f'SELECT {EMBEDDING_COLUMN}::text AS embedding, focus_area FROM "{TABLE_NAME}" '
+            "WHERE focus_area IS NOT NULL ORDER BY random() LIMIT :n",
+            {"n": args.queries},
+        )
+        queries = [(json.loads(row["embedding"]), row["focus_area"]) for row in rows]
+        vector_store = await aget_vector_store(
+            engine,
+            TABLE_NAME,
+            DeterministicFakeEmbedding(size=768),
+            search_options(VECTOR_INDEX_TYPE),
+        )
+        report(
+            f"Cloud SQL table {TABLE_NAME} ({len(queries)} queries, k={args.k})",
+            {
+                "unfiltered": await run_searches(vector_store, queries, args.k, False),
+                "focus_area filter": await run_searches(
+                    vector_store, queries, args.k, True
+                ),
+            },
+        )
+    finally:
+        await engine.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--postgres",
+        action="store_true",
+        help="Search the configured Cloud SQL table instead of a synthetic local store.",
+    )
+    parser.add_argument("--documents", type=int, default=16_000)
+    parser.add_argument("--focus-areas", type=int, default=500)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument(
+        "--spread",
+        type=float,
+        default=3.0,
+        help="Noise around the focus area centers of the synthetic embeddings.",
+    )
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(apostgres(args) if args.postgres else alocal(args))
+
+
+if __name__ == "__main__":
+    main()
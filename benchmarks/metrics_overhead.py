@@ -0,0 +1,111 @@
+"""Benchmark the overhead of the latency instrumentation (offline): stage timers, histograms and the ASGI middleware."""
+
+import argparse
+import asyncio
+import time
+from fastapi import FastAPI
+from rich.console import Console
+from rich.table import Table
+from medichat.metrics import (
+    STAGE_SECONDS,
+    MetricsMiddleware,
+    render_metrics,
+    stage,
+)
+
+console = Console()
+
+
+def per_call_us(function, calls: int) -> float:
+    start_time = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start_time) * 1e6 / calls
+
+
+async def arequests_us(app, requests: int) -> float:
+    """
+    Serve GET /ping requests straight through the ASGI interface, without any network or HTTP parsing.
+    """
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/ping",
+        "raw_path": b"/ping",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "server": ("test", 80),
+        "client": ("test", 1234),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    start_time = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - start_time) * 1e6 / requests
+
+
+def create_app(instrumented: bool, server_timing: bool = False) -> FastAPI:
+    app = FastAPI()
+    if instrumented:
+        app.add_middleware(MetricsMiddleware, server_timing=server_timing)
+
+    @app.get("/ping")
+    async def ping():
+        if instrumented:
+            with stage("embedding"):
+                pass
+            with stage("search"):
+                pass
+        return {"ok": True}
+
+    return app
+
+
+def main():
+    """
+    Time the instrumentation primitives, then the same endpoint served with and without the middleware.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=200_000)
+    parser.add_argument("--requests", type=int, default=5_000)
+    args = parser.parse_args()
+
+    def timed_stage():
+        with stage("benchmark"):
+            pass
+
+    table = Table(title="Instrumentation overhead")
+    for column in ["Operation", "µs per call"]:
+        table.add_column(column, justify="right")
+    table.add_row(
+        "Histogram.observe",
+        f"{per_call_us(lambda: STAGE_SECONDS.observe(0.03, stage='benchmark'), args.calls):.2f}",
+    )
+    table.add_row("with stage(...)", f"{per_call_us(timed_stage, args.calls):.2f}")
+
+    for name, app in [
+        ("request, no instrumentation", create_app(False)),
+        ("request, metrics", create_app(True)),
+        ("request, metrics + Server-Timing", create_app(True, server_timing=True)),
+    ]:
+        asyncio.run(arequests_us(app, 200))  # warm up
+        table.add_row(name, f"{asyncio.run(arequests_us(app, args.requests)):.1f}")
+    table.add_row(
+        "/metrics rendering",
+        f"{per_call_us(render_metrics, 1_000):.1f}",
+    )
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Benchmark the request body size with the whole transcript vs a server-side session."""
+
+import argparse
+import json
+import uuid
+from rich.console import Console
+from rich.table import Table
+
+# Typical MedQuAD turn: a short question, a paragraph of answer and 4 sources
+QUESTION = "What are the symptoms of Glaucoma ?"
+ANSWER = "Glaucoma often has no early symptoms. " * 20
+SOURCE = {
+    "page_content": "What are the symptoms of Glaucoma ?",
+    "metadata": {
+        "answer": "At first, open-angle glaucoma has no symptoms. " * 40,
+        "source": "NIHSeniorHealth",
+        "focus_area": "Glaucoma",
+        "score": 0.91,
+    },
+}
+console = Console()
+
+
+def request_body(question: str, **conversation) -> dict:
+    """
+    Build the body of a /chat/stream request.
+
+    Args:
+        question (str): The new question.
+        **conversation: Either `previous_context` or `session_id`.
+
+    Returns:
+        dict: The JSON body of the request.
+    """
+    return {
+        "question": question,
+        "temperature": 0.2,
+        "similarity_threshold": 0.75,
+        "max_sources": 4,
+        "language": "English",
+        **conversation,
+    }
+
+
+def main():
+    """
+    Compare the body size of the request sent at each turn of a conversation.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=20)
+    args = parser.parse_args()
+
+    session_id = str(uuid.uuid4())
+    messages = [{"role": "assistant", "content": "Hello! How may I help you?"}]
+    table = Table(title="Request body size (bytes)")
+    for column in ["Turn", "Transcript", "Session id", "Reduction"]:
+        table.add_column(column, justify="right")
+
+    for turn in range(1, args.turns + 1):
+        messages.append({"role": "user", "content": QUESTION})
+        transcript = len(json.dumps(request_body(QUESTION, previous_context=messages)))
+        session = len(json.dumps(request_body(QUESTION, session_id=session_id)))
+        if turn in (1, 5, 10, args.turns):
+            table.add_row(
+                str(turn),
+                str(transcript),
+                str(session),
+                f"{transcript / session:.0f}x",
+            )
+        messages.append(
+            {"role": "assistant", "content": ANSWER, "sources": [SOURCE] * 4}
+        )
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""Benchmark the cold start of the API (offline): import time of `medichat.api`, then time to /healthz and /readyz."""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import requests
+from langchain_core.documents import Document
+from rich.console import Console
+from rich.table import Table
+from medichat.local_store import LocalVectorStore
+
+console = Console()
+
+
+def import_times(top: int) -> tuple[float, list[tuple[str, float]]]:
+    """
+    Import `medichat.api` in a fresh interpreter with `-X importtime`.
+
+    Args:
+        top (int): The number of top-level packages to report.
+
+    Returns:
+        tuple[float, list[tuple[str, float]]]: The cumulative import time of `medichat.api`,
+        and the slowest top-level packages it imports (their first import, with their dependencies), in seconds.
+    """
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import medichat.api"],
+        env={**os.environ, "MEDICHAT_VECTOR_BACKEND": "local"},
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    packages: dict[str, float] = {}
+    total = 0.0
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        if name == "medichat.api":
+            total = int(cumulative) / 1e6
+        elif not name.startswith("medichat"):
+            root = name.split(".")[0]
+            packages[root] = max(packages.get(root, 0.0), int(cumulative) / 1e6)
+    return total, sorted(packages.items(), key=lambda item: -item[1])[:top]
+
+
+def serve(args: argparse.Namespace) -> None:
+    """
+    Run the API on a local store, with a stand-in embedding client slow to create like the Vertex AI one.
+    """
+    import uvicorn
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    import medichat.api as api
+
+    def get_embeddings():
+        time.sleep(args.embedding_latency)
+        return DeterministicFakeEmbedding(size=args.dim)
+
+    api.get_embeddings = get_embeddings
+    uvicorn.run(api.app, port=args.port, log_level="warning")
+
+
+def time_to_ready(args: argparse.Namespace, directory: str) -> dict[str, float]:
+    """
+    Start the API in a subprocess and poll its health checks until it is ready.
+
+    Returns:
+        dict[str, float]: The seconds from the start of the process to the first 200 of each endpoint.
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    host = f"http://127.0.0.1:{port}"
+    env = {
+        **os.environ,
+        "MEDICHAT_VECTOR_BACKEND": "local",
+        "MEDICHAT_LOCAL_STORE_PATH": directory,
+    }
+    start_time = time.perf_counter()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            __file__,
+            "--serve",
+            "--port",
+            str(port),
+            "--dim",
+            str(args.dim),
+            "--embedding-latency",
+            str(args.embedding_latency),
+        ],
+        env=env,
+    )
+    timings: dict[str, float] = {}
+    try:
+        while "/readyz" not in timings:
+            if process.poll() is not None:
+                raise RuntimeError("The API exited before being ready")
+            for path in ["/healthz", "/readyz"]:
+                if path in timings:
+                    continue
+                try:
+                    if requests.get(host + path, timeout=1).status_code == 200:
+                        timings[path] = time.perf_counter() - start_time
+                except requests.ConnectionError:
+                    pass
+            time.sleep(0.01)
+        requests.post(
+            f"{host}/get_sources",
+            json={
+                "question": "What is Condition 1 ?",
+                "temperature": 0.2,
+                "language": "English",
+                "similarity_threshold": 0.0,
+                "max_sources": 4,
+            },
+            timeout=30,
+        ).raise_for_status()
+        timings["first /get_sources"] = time.perf_counter() - start_time
+    finally:
+        process.terminate()
+        process.wait()
+    return timings
+
+
+def main():
+    """
+    Measure what delays the first request of a new API container, against local stand-ins.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=16_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument(
+        "--embedding-latency",
+        type=float,
+        default=1.0,
+        help="Seconds to create the stand-in embedding client (credentials, model lookup).",
+    )
+    parser.add_argument("--top", type=int, default=8)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=8181, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args)
+        return
+
+    total, packages = import_times(args.top)
+    table = Table(title=f"import medichat.api: {total:.2f} s")
+    for column in ["Package", "Cumulative import (s)"]:
+        table.add_column(column, justify="right")
+    for name, seconds in packages:
+        table.add_row(name, f"{seconds:.3f}")
+    console.print(table)
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as directory:
+        LocalVectorStore.build(
+            directory,
+            [
+                Document(
+                    page_content=f"What is Condition {i} ?",
+                    metadata={
+                        "answer": "An answer.",
+                        "source": "synthetic",
+                        "focus_area": f"Condition {i}",
+                    },
+                )
+                for i in range(args.documents)
+            ],
+            rng.standard_normal((args.documents, args.dim), dtype=np.float32),
+        )
+        timings = time_to_ready(args, directory)
+    table = Table(
+        title=f"Cold start on a local store of {args.documents} documents "
+        f"({args.embedding_latency:.1f} s to create the embedding client)"
+    )
+    for column in ["First 200 of", "Seconds since process start"]:
+        table.add_column(column, justify="right")
+    for path, seconds in timings.items():
+        table.add_row(path, f"{seconds:.2f}")
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()
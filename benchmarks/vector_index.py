@@ -0,0 +1,142 @@
+"""Benchmark the vector index: recall@k and latency against exact search, across search breadths."""
+
+import argparse
+import asyncio
+import json
+import time
+from statistics import mean, quantiles
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_google_cloud_sql_pg.indexes import QueryOptions
+from rich.console import Console
+from rich.table import Table
+from dotenv import load_dotenv
+from medichat.cache import document_id
+from medichat.ingest import (
+    acreate_cloud_sql_database_connection,
+    acreate_vector_index,
+    aexecute,
+    aget_vector_store,
+    search_options,
+)
+from medichat.config import TABLE_NAME, EMBEDDING_COLUMN
+
+load_dotenv()
+
+console = Console()
+
+
+class ExactSearch(QueryOptions):
+    """
+    Search options disabling index scans, so that the search is an exact sequential scan.
+    """
+
+    def to_string(self) -> str:
+        return "enable_indexscan = off"
+
+
+async def run_searches(
+    vector_store, queries: list[list[float]], k: int
+) -> tuple[list[list[str]], list[float]]:
+    """
+    Run one similarity search per query vector.
+
+    Args:
+        vector_store (PostgresVectorStore): The vector store to search.
+        queries (list[list[float]]): The query vectors.
+        k (int): The number of results per query.
+
+    Returns:
+        tuple[list[list[str]], list[float]]: The result ids of each query and each latency in milliseconds.
+    """
+    results, latencies = [], []
+    for query in queries:
+        start_time = time.perf_counter()
+        documents = await vector_store.asimilarity_search_by_vector(query, k=k)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+        results.append(
+            [document_id(doc.page_content, doc.metadata) for doc in documents]
+        )
+    return results, latencies
+
+
+async def amain(args: argparse.Namespace) -> None:
+    """
+    Compare index searches at increasing breadth with exact searches on the same queries.
+    """
+    engine = await acreate_cloud_sql_database_connection()
+    # Queries are stored embeddings, so no embedding call is made
+    embedding = DeterministicFakeEmbedding(size=768)
+    try:
+        if args.create:
+            await acreate_vector_index(engine, TABLE_NAME, args.index_type)
+        rows = await aexecute(
+            engine,
+            f'SELECT {EMBEDDING_COLUMN}::text AS embedding FROM "{TABLE_NAME}" '
+            "ORDER BY random() LIMIT :n",
+            {"n": args.queries},
+        )
+        queries = [json.loads(row["embedding"]) for row in rows]
+
+        exact_store = await aget_vector_store(
+            engine, TABLE_NAME, embedding, ExactSearch()
+        )
+        exact, exact_latencies = await run_searches(exact_store, queries, args.k)
+
+        table = Table(
+            title=f"{args.index_type} index vs exact search "
+            f"({len(queries)} queries, k={args.k})"
+        )
+        for column in ["Search", "Recall@k", "Mean (ms)", "p95 (ms)", "Speedup"]:
+            table.add_column(column, justify="right")
+        table.add_row(
+            "exact",
+            "1.000",
+            f"{mean(exact_latencies):.2f}",
+            f"{quantiles(exact_latencies, n=20)[-1]:.2f}",
+            "1.0x",
+        )
+        for breadth in args.breadths:
+            vector_store = await aget_vector_store(
+                engine,
+                TABLE_NAME,
+                embedding,
+                search_options(args.index_type, breadth),
+            )
+            results, latencies = await run_searches(vector_store, queries, args.k)
+            recall = mean(
+                len(set(found) & set(expected)) / len(expected)
+                for found, expected in zip(results, exact)
+                if expected
+            )
+            table.add_row(
+                f"breadth={breadth}",
+                f"{recall:.3f}",
+                f"{mean(latencies):.2f}",
+                f"{quantiles(latencies, n=20)[-1]:.2f}",
+                f"{mean(exact_latencies) / mean(latencies):.1f}x",
+            )
+        console.print(table)
+    finally:
+        await engine.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--index-type", choices=["hnsw", "ivfflat"], default="hnsw")
+    parser.add_argument(
+        "--create", action="store_true", help="Create the index if it is missing."
+    )
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument(
+        "--breadths",
+        type=int,
+        nargs="+",
+        default=[10, 20, 40, 80, 160],
+        help="hnsw.ef_search or ivfflat.probes values to compare.",
+    )
+    asyncio.run(amain(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
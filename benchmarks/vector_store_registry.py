@@ -0,0 +1,70 @@
+"""Benchmark the per-request vector store setup: rebuilt on every call vs registry."""
+
+import time
+from statistics import mean, median
+from rich.console import Console
+from rich.table import Table
+from dotenv import load_dotenv
+from medichat.ingest import (
+    create_cloud_sql_database_connection,
+    get_embeddings,
+    get_vector_store,
+    VectorStoreRegistry,
+)
+from medichat.config import TABLE_NAME
+
+load_dotenv()
+
+NUM_CALLS = 50
+console = Console()
+
+
+def time_calls(fn, num_calls: int = NUM_CALLS) -> list[float]:
+    """
+    Time repeated calls of a function.
+
+    Args:
+        fn (Callable): The function to call without arguments.
+        num_calls (int, optional): The number of calls. Defaults to NUM_CALLS.
+
+    Returns:
+        list[float]: The duration of each call in milliseconds.
+    """
+    durations = []
+    for _ in range(num_calls):
+        start_time = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - start_time) * 1000)
+    return durations
+
+
+def main():
+    """
+    Compare the setup time of the vector store before any similarity search starts.
+    """
+    engine = create_cloud_sql_database_connection()
+    embedding = get_embeddings()
+    registry = VectorStoreRegistry(engine)
+    registry.get(TABLE_NAME, embedding)  # built once at startup by the API
+
+    rebuilt = time_calls(lambda: get_vector_store(engine, TABLE_NAME, embedding))
+    cached = time_calls(lambda: registry.get(TABLE_NAME, embedding))
+
+    table = Table(title=f"Vector store setup per request ({NUM_CALLS} calls)")
+    for column in ["Path", "Mean (ms)", "Median (ms)", "Max (ms)"]:
+        table.add_column(column, justify="right")
+    for name, durations in [("get_vector_store", rebuilt), ("registry", cached)]:
+        table.add_row(
+            name,
+            f"{mean(durations):.3f}",
+            f"{median(durations):.3f}",
+            f"{max(durations):.3f}",
+        )
+    console.print(table)
+    console.print(
+        f"[bold green]Saved per request: {mean(rebuilt) - mean(cached):.3f} ms[/bold green]"
+    )
+
+
+if __name__ == "__main__":
+    main()
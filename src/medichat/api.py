@@ -1,29 +1,226 @@
 """Malek's RAG Medical Chatbot API"""
 
-from typing import List
-from fastapi import FastAPI
-from pydantic import BaseModel
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import ChatPromptTemplate
-from google.cloud import storage
+import asyncio
+import importlib
+import json
+import threading
+import time
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import AsyncIterator, List, Literal, Optional, Union
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field
 from dotenv import load_dotenv
 from medichat.ingest import (
-    create_cloud_sql_database_connection,
+    acreate_cloud_sql_database_connection,
+    afetch_documents,
+    afetch_embeddings,
     get_embeddings,
-    get_vector_store,
-    list_files_in_bucket,
+    search_options,
+    VectorStoreRegistry,
+)
+from medichat.gcs import BucketListing
+from medichat.lexical import BM25Index
+from medichat.local_store import LocalVectorStore
+from medichat.retrieve import (
+    abatch_relevant_documents,
+    adiverse_relevant_documents,
+    aget_relevant_documents,
+    ahybrid_relevant_documents,
+    format_relevant_documents,
+)
+from medichat.cache import AnswerCache, CachedEmbeddings, document_id
+from medichat.context import build_context, estimate_tokens
+from medichat.diversity import DIVERSITY_MODES
+from medichat.generate import PROMPT, get_chain
+from medichat.packing import pack_documents
+from medichat.metrics import (
+    CONTENT_TYPE,
+    PROMPT_TOKENS,
+    RETRIEVED_DOCUMENTS,
+    MetricsMiddleware,
+    record_stage,
+    render_metrics,
+    stage,
+)
+from medichat.session import InMemorySessionStore, SQLSessionStore, compact_turn
+from medichat.config import (
+    TABLE_NAME,
+    BUCKET_NAME,
+    EMBEDDING_CACHE_SIZE,
+    EMBEDDING_CACHE_TTL,
+    EMBEDDING_CACHE_PATH,
+    ANSWER_CACHE_SIZE,
+    ANSWER_CACHE_TTL,
+    ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    ANSWER_CACHE_TEMPERATURE_STEP,
+    LLM_MODEL,
+    SESSION_DB_URL,
+    SESSION_MAX_SESSIONS,
+    SESSION_MAX_TURNS,
+    SESSION_IDLE_TTL,
+    SESSION_PURGE_INTERVAL,
+    VECTOR_INDEX_TYPE,
+    VECTOR_BACKEND,
+    LOCAL_STORE_PATH,
+    RETRIEVAL_MODE,
+    BATCH_MAX_QUESTIONS,
+    DOCUMENT_TOKEN_BUDGET,
+    DIVERSITY_MODE,
 )
-from medichat.retrieve import get_relevant_documents, format_relevant_documents
-from medichat.config import TABLE_NAME, BUCKET_NAME
 
 load_dotenv()
 
-app = FastAPI()
-client = storage.Client()
+# Nothing connects to Google Cloud at import: the bucket listing is created on first use,
+# the embeddings, sessions and vector store by the initialization task of the lifespan
+BUCKET_FILES = None
+BUCKET_FILES_LOCK = threading.Lock()
+EMBEDDING = None
+SESSIONS = None
+STARTUP = None
+ANSWERS = AnswerCache(
+    maxsize=ANSWER_CACHE_SIZE,
+    ttl=ANSWER_CACHE_TTL,
+    similarity_threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    temperature_step=ANSWER_CACHE_TEMPERATURE_STEP,
+)
+NO_SOURCES_MESSAGES = {
+    "English": "I could not find any relevant source to answer this question.",
+    "Francais": "Je n'ai trouvé aucune source pertinente pour répondre à cette question.",
+}
+# Also embeds the question of the answer cache, so that both share the cached vector
+RETRIEVAL_QUERY = "Retrieve information related to: {question}"
+# The async engine is bound to the event loop of the worker, so it is created in the lifespan
+ENGINE = None
+VECTOR_STORES = None
+# With the 'local' backend, searches run in-process on the memory-mapped export instead
+LOCAL_STORE = None
+# The BM25 index of the hybrid retrieval, built from the documents of the vector store on first use
+LEXICAL_INDEX = None
+LEXICAL_INDEX_LOCK = asyncio.Lock()
+
+
+def create_session_store():
+    """
+    Create the session store: in SQL if MEDICHAT_SESSION_DB_URL is set, else in memory.
+
+    Returns:
+        SQLSessionStore | InMemorySessionStore: The session store of the worker.
+    """
+    if SESSION_DB_URL:
+        return SQLSessionStore(
+            SESSION_DB_URL, max_turns=SESSION_MAX_TURNS, idle_ttl=SESSION_IDLE_TTL
+        )
+    return InMemorySessionStore(
+        max_sessions=SESSION_MAX_SESSIONS,
+        max_turns=SESSION_MAX_TURNS,
+        idle_ttl=SESSION_IDLE_TTL,
+    )
+
+
+async def _acreate_embeddings() -> CachedEmbeddings:
+    """
+    Create the Vertex AI embedding client, behind the query embedding cache.
+    """
+    return CachedEmbeddings(
+        await asyncio.to_thread(get_embeddings),
+        maxsize=EMBEDDING_CACHE_SIZE,
+        ttl=EMBEDDING_CACHE_TTL,
+        path=EMBEDDING_CACHE_PATH,
+    )
+
+
+async def _acreate_engine():
+    """
+    Connect to Cloud SQL, unless the vector store is local.
+    """
+    if VECTOR_BACKEND == "local":
+        return None
+    # Imported in a thread, so that the event loop keeps answering health checks
+    await asyncio.to_thread(importlib.import_module, "langchain_google_cloud_sql_pg")
+    return await acreate_cloud_sql_database_connection()
+
+
+async def _ainitialize() -> None:
+    """
+    Create the clients of the worker and load its vector store.
+
+    The embedding client, the session store, the database connection and the
+    import of the Gemini SDK are independent, so they run concurrently; the
+    vector store (and the BM25 index in hybrid mode) are then built on top.
+    """
+    global EMBEDDING, SESSIONS, ENGINE, VECTOR_STORES, LOCAL_STORE
+    EMBEDDING, SESSIONS, ENGINE, _ = await asyncio.gather(
+        _acreate_embeddings(),
+        asyncio.to_thread(create_session_store),
+        _acreate_engine(),
+        asyncio.to_thread(importlib.import_module, "langchain_google_genai"),
+    )
+    if VECTOR_BACKEND == "local":
+        LOCAL_STORE = await asyncio.to_thread(
+            LocalVectorStore.load, LOCAL_STORE_PATH, EMBEDDING
+        )
+    else:
+        VECTOR_STORES = VectorStoreRegistry(ENGINE)
+        await VECTOR_STORES.aget(
+            TABLE_NAME, EMBEDDING, search_options(VECTOR_INDEX_TYPE)
+        )
+    if RETRIEVAL_MODE == "hybrid":
+        await _aget_lexical_index()
+
+
+async def _apurge_sessions() -> None:
+    """
+    Delete the expired SQL sessions every SESSION_PURGE_INTERVAL seconds.
 
-# Initialize once and reuse
-ENGINE = create_cloud_sql_database_connection()
-EMBEDDING = get_embeddings()
+    The in-memory sessions expire in their LRU cache, and a failed purge is
+    retried at the next interval.
+    """
+    try:
+        await STARTUP
+    except Exception:
+        return
+    if not isinstance(SESSIONS, SQLSessionStore):
+        return
+    while True:
+        await asyncio.sleep(SESSION_PURGE_INTERVAL)
+        try:
+            await asyncio.to_thread(SESSIONS.purge_expired)
+        except Exception:
+            continue
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start the initialization of the worker in the background, and close the database engine on shutdown.
+
+    The worker listens, and answers /healthz, as soon as it is imported; the
+    clients are created meanwhile, see /readyz. Requests arriving before the
+    initialization is done wait for it. The expired SQL sessions are purged
+    in the background meanwhile.
+
+    Raises:
+        ValueError: If MEDICHAT_DIVERSITY_MODE is not one of DIVERSITY_MODES, before the worker accepts requests.
+    """
+    global STARTUP
+    if DIVERSITY_MODE not in DIVERSITY_MODES:
+        raise ValueError(
+            f"Unknown MEDICHAT_DIVERSITY_MODE '{DIVERSITY_MODE}', expected one of {DIVERSITY_MODES}"
+        )
+    STARTUP = asyncio.create_task(_ainitialize())
+    purge = asyncio.create_task(_apurge_sessions())
+    yield
+    STARTUP.cancel()
+    purge.cancel()
+    await asyncio.gather(STARTUP, purge, return_exceptions=True)
+    if ENGINE is not None:
+        await ENGINE.close()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
 
 
 class DocumentResponse(BaseModel):
@@ -31,6 +228,23 @@ class DocumentResponse(BaseModel):
     metadata: dict
 
 
+class MetadataFilter(BaseModel):
+    """
+    MetadataFilter restricts the retrieval to the documents with the given metadata.
+
+    Both fields are indexed columns of the vector store table (see FILTER_COLUMNS).
+
+    Attributes:
+        focus_area (str | List[str], optional): The focus area of the documents, or a list of accepted focus areas.
+        source (str | List[str], optional): The source of the documents, or a list of accepted sources.
+    """
+
+    model_config = ConfigDict(extra="forbid")
+
+    focus_area: Optional[Union[str, List[str]]] = None
+    source: Optional[Union[str, List[str]]] = None
+
+
 class UserInput(BaseModel):
     """
     UserInput is a data model representing user input.
@@ -39,16 +253,63 @@ class UserInput(BaseModel):
         question (str): The question of the user.
         temperature (float): The temperature of the user.
         language (str): The language preference of the user.
+        similarity_threshold (float): The minimum relevance score of the retrieved documents, between 0 and 1.
+        max_sources (int): The maximum number of retrieved documents, between 1 and 20.
+        search_breadth (int, optional): The vector index search breadth (hnsw.ef_search or ivfflat.probes), higher is more exact but slower.
+        retrieval_mode (str, optional): 'vector', or 'hybrid' to fuse the vector search with a BM25 search. Defaults to RETRIEVAL_MODE.
+        diversity (str, optional): 'mmr' or 'dedup' to leave out near-duplicate documents of the vector search, 'none' to keep them. Defaults to DIVERSITY_MODE.
+        filter (MetadataFilter, optional): Only retrieve documents with this focus area and/or source.
+        document_token_budget (int, optional): The maximum number of tokens of the documents in the prompt, 0 to send them whole. Defaults to DOCUMENT_TOKEN_BUDGET.
         documents (List[DocumentResponse]): Retrieved documents for context.
+        previous_context (List[dict]): The conversation so far, ignored when `session_id` is set.
+        session_id (str, optional): The id of the server-side session holding the conversation, at most 64 characters.
     """
 
     question: str
     temperature: float
     language: str
-    similarity_threshold: float
-    max_sources: float
-    documents: List[DocumentResponse]
-    previous_context: List[dict]
+    similarity_threshold: float = Field(ge=0.0, le=1.0)
+    max_sources: int = Field(ge=1, le=20)
+    search_breadth: Optional[int] = Field(None, ge=1, le=1000)
+    retrieval_mode: Optional[Literal["vector", "hybrid"]] = None
+    diversity: Optional[Literal["none", "mmr", "dedup"]] = None
+    filter: Optional[MetadataFilter] = None
+    document_token_budget: Optional[int] = Field(None, ge=0)
+    documents: List[DocumentResponse] = []
+    previous_context: List[dict] = []
+    session_id: Optional[str] = Field(None, max_length=64)
+
+
+class BatchInput(BaseModel):
+    """
+    BatchInput is a data model representing many questions retrieved at once.
+
+    Attributes:
+        questions (List[str]): The questions, between 1 and BATCH_MAX_QUESTIONS.
+        similarity_threshold (float): The minimum relevance score of the retrieved documents, between 0 and 1.
+        max_sources (int): The maximum number of retrieved documents per question, between 1 and 20.
+        search_breadth (int, optional): The vector index search breadth (hnsw.ef_search or ivfflat.probes).
+        filter (MetadataFilter, optional): Only retrieve documents with this focus area and/or source.
+    """
+
+    questions: List[str] = Field(min_length=1, max_length=BATCH_MAX_QUESTIONS)
+    similarity_threshold: float = Field(ge=0.0, le=1.0)
+    max_sources: int = Field(ge=1, le=20)
+    search_breadth: Optional[int] = Field(None, ge=1, le=1000)
+    filter: Optional[MetadataFilter] = None
+
+
+class ChatResponse(BaseModel):
+    """
+    ChatResponse is the answer of the chatbot along with the sources it is grounded on.
+
+    Attributes:
+        message (str): The generated answer.
+        sources (List[DocumentResponse]): The retrieved documents used as context.
+    """
+
+    message: str
+    sources: List[DocumentResponse]
 
 
 @app.post("/get_files_names")
@@ -56,34 +317,220 @@ def get_files_names():
     """
     Retrieve the list of available files in the configured Google Cloud Storage bucket.
 
+    The listing is cached for GCS_LISTING_TTL seconds.
+
     Returns:
         dict: A dictionary containing the list of file names under the 'files' key.
     """
-    bucket = client.get_bucket(BUCKET_NAME)
-    files = list_files_in_bucket(client, bucket)
-    return {"files": files}
+    global BUCKET_FILES
+    with BUCKET_FILES_LOCK:
+        if BUCKET_FILES is None:
+            from google.cloud import storage
 
+            BUCKET_FILES = BucketListing(storage.Client(), BUCKET_NAME)
+    return {"files": BUCKET_FILES.get()}
 
-@app.post("/get_sources", response_model=List[DocumentResponse])
-def get_sources(user_input: UserInput) -> List[DocumentResponse]:
+
+@app.get("/healthz")
+async def healthz():
     """
-    Retrieve relevant source documents based on the user's question.
+    Liveness check: the worker is up and its event loop responsive, whatever the state of its dependencies.
+
+    Returns:
+        dict: Always {"ok": True}.
+    """
+    return {"ok": True}
+
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness check: the clients and the vector store of the worker are initialized.
+
+    Use it as the startup probe, so that no traffic is routed to a worker still connecting.
+
+    Returns:
+        JSONResponse: {"ready": True}, or {"ready": False} with status code 503 while
+        initializing, with the error if the initialization failed.
+    """
+    if STARTUP is None or not STARTUP.done():
+        return JSONResponse({"ready": False}, status_code=503)
+    if STARTUP.cancelled() or STARTUP.exception() is not None:
+        error = "cancelled" if STARTUP.cancelled() else repr(STARTUP.exception())
+        return JSONResponse({"ready": False, "error": error}, status_code=503)
+    return {"ready": True}
+
+
+async def _aready() -> None:
+    """
+    Wait for the initialization of the worker.
+
+    Raises:
+        HTTPException: 503 if the initialization failed.
+    """
+    try:
+        await asyncio.shield(STARTUP)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Not ready: {e!r}") from e
+
+
+@app.get("/health")
+async def health():
+    """
+    Check the database connection and the tables of the cached vector stores.
+
+    Returns:
+        JSONResponse: The health report, with status code 503 if the check failed.
+    """
+    await _aready()
+    if LOCAL_STORE is not None:
+        return {"ok": True, "backend": "local", "documents": len(LOCAL_STORE)}
+    report = await VECTOR_STORES.ahealth_check()
+    return JSONResponse(report, status_code=200 if report["ok"] else 503)
+
+
+@app.post("/invalidate_vector_stores")
+def invalidate_vector_stores(table_name: Optional[str] = None):
+    """
+    Drop the cached vector stores (and the BM25 index) so that they are rebuilt on the next request.
+
+    Args:
+        table_name (str, optional): Only drop the stores of this table. Defaults to all tables.
+
+    Returns:
+        dict: The number of dropped vector stores under the 'invalidated' key.
+    """
+    global LEXICAL_INDEX
+    if table_name in (None, TABLE_NAME):
+        LEXICAL_INDEX = None
+    if VECTOR_STORES is None:
+        return {"invalidated": 0}
+    return {"invalidated": VECTOR_STORES.invalidate(table_name)}
+
+
+@app.get("/cache_stats")
+def cache_stats():
+    """
+    Report the hit and miss counters of the caches of this worker.
+
+    Returns:
+        dict: The statistics of the query embedding cache under the 'embeddings' key
+        and of the answer cache under the 'answers' key.
+    """
+    return _cache_stats()
+
+
+def _cache_stats() -> dict:
+    """
+    Collect the statistics of the caches created so far.
+    """
+    stats = {"answers": ANSWERS.stats()}
+    if EMBEDDING is not None:
+        stats["embeddings"] = EMBEDDING.stats()
+    return stats
+
+
+@app.get("/metrics")
+def metrics():
+    """
+    Expose the latency histograms and counters of this worker in the Prometheus text format.
+
+    Request and per-stage durations (embedding, search, lexical_search, prompt,
+    llm_first_token, llm), documents retrieved and prompt tokens per question,
+    and the cache lookups, so that a latency regression can be traced to the
+    embedding service, the database or the LLM.
+
+    Returns:
+        Response: The metrics, in the Prometheus text exposition format.
+    """
+    return Response(
+        render_metrics(_cache_stats()),
+        media_type=CONTENT_TYPE,
+    )
+
+
+async def _aget_lexical_index() -> BM25Index:
+    """
+    Get the BM25 index of the documents of the vector store, building it on first use.
+
+    Returns:
+        BM25Index: The index, shared by the requests of this worker.
+    """
+    global LEXICAL_INDEX
+    async with LEXICAL_INDEX_LOCK:
+        if LEXICAL_INDEX is None:
+            if LOCAL_STORE is not None:
+                documents = LOCAL_STORE.documents
+            else:
+                documents, _ = await afetch_documents(ENGINE, TABLE_NAME)
+            LEXICAL_INDEX = await asyncio.to_thread(BM25Index, documents)
+    return LEXICAL_INDEX
+
+
+async def _aget_vector_store(search_breadth: Optional[int] = None):
+    """
+    Get the vector store to search: the local store, or the cached Cloud SQL store for a search breadth.
+
+    Args:
+        search_breadth (int, optional): The vector index search breadth. Defaults to the configured breadth.
+
+    Returns:
+        VectorStore: The LocalVectorStore or PostgresVectorStore.
+    """
+    await _aready()
+    if LOCAL_STORE is not None:
+        return LOCAL_STORE
+    return await VECTOR_STORES.aget(
+        TABLE_NAME,
+        EMBEDDING,
+        search_options(VECTOR_INDEX_TYPE, search_breadth),
+    )
+
+
+async def _retrieve_sources(user_input: UserInput) -> List[DocumentResponse]:
+    """
+    Retrieve the documents relevant to the user's question.
 
     Args:
         user_input (UserInput): User input containing the question and retrieval parameters.
 
     Returns:
-        List[DocumentResponse]: A list of relevant documents with their content and metadata.
-        Returns empty list if no relevant documents are found.
+        List[DocumentResponse]: The relevant documents, empty if none is found.
     """
-    vector_store = get_vector_store(ENGINE, TABLE_NAME, EMBEDDING)
-    relevants_docs = get_relevant_documents(
-        f"Retrieve information related to: {user_input.question}",
-        vector_store,
-        user_input.similarity_threshold,
-        user_input.max_sources,
+    vector_store = await _aget_vector_store(user_input.search_breadth)
+    filter = (
+        user_input.filter.model_dump(exclude_none=True) if user_input.filter else None
     )
+    if (user_input.retrieval_mode or RETRIEVAL_MODE) == "hybrid":
+        relevants_docs = await ahybrid_relevant_documents(
+            RETRIEVAL_QUERY.format(question=user_input.question),
+            user_input.question,
+            vector_store,
+            await _aget_lexical_index(),
+            user_input.similarity_threshold,
+            user_input.max_sources,
+            filter=filter,
+        )
+    elif (user_input.diversity or DIVERSITY_MODE) != "none":
+        relevants_docs = await adiverse_relevant_documents(
+            RETRIEVAL_QUERY.format(question=user_input.question),
+            vector_store,
+            user_input.similarity_threshold,
+            user_input.max_sources,
+            user_input.diversity or DIVERSITY_MODE,
+            filter=filter,
+            afetch_vectors=partial(afetch_embeddings, ENGINE, TABLE_NAME),
+        )
+    else:
+        relevants_docs = await aget_relevant_documents(
+            RETRIEVAL_QUERY.format(question=user_input.question),
+            vector_store,
+            user_input.similarity_threshold,
+            user_input.max_sources,
+            filter=filter,
+        )
 
+    RETRIEVED_DOCUMENTS.observe(len(relevants_docs))
     if not relevants_docs:
         return []
 
@@ -94,8 +541,183 @@ def get_sources(user_input: UserInput) -> List[DocumentResponse]:
     ]
 
 
+async def _astream_answer(
+    user_input: UserInput,
+    documents: List[DocumentResponse],
+    cache_control: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """
+    Stream the answer to the user's question from the given documents, or yield it at once from the answer cache.
+
+    Args:
+        user_input (UserInput): User input containing the question and generation parameters.
+        documents (List[DocumentResponse]): The documents to ground the answer on.
+        cache_control (str, optional): The Cache-Control header of the request; 'no-cache' bypasses the cache lookup.
+
+    Yields:
+        str: The tokens of the answer as they are generated.
+    """
+    await _aready()
+    history = user_input.previous_context
+    if user_input.session_id:
+        history = await asyncio.to_thread(SESSIONS.get, user_input.session_id)
+    previous_context, last_entity = build_context(history, user_input.question)
+    token_budget = user_input.document_token_budget
+    if token_budget is None:
+        token_budget = DOCUMENT_TOKEN_BUDGET
+
+    source_ids = [document_id(doc.page_content, doc.metadata) for doc in documents]
+    cache_args = (
+        user_input.question,
+        user_input.language,
+        source_ids,
+        user_input.temperature,
+    )
+    # The answer also depends on the conversation and on the budget the documents are packed in
+    prompt_context = "\x00".join([previous_context, last_entity, str(token_budget)])
+    question_embedding = None
+    # Without documents the answer is fixed, so the question is not embedded for the cache
+    if documents and ANSWERS.similarity_threshold:
+        with stage("embedding"):
+            question_embedding = await EMBEDDING.aembed_query(
+                RETRIEVAL_QUERY.format(question=user_input.question)
+            )
+
+    answer = None
+    if not documents:
+        # Nothing above the similarity threshold: do not let the LLM answer ungrounded
+        answer = NO_SOURCES_MESSAGES.get(
+            user_input.language, NO_SOURCES_MESSAGES["English"]
+        )
+        yield answer
+    elif cache_control and "no-cache" in cache_control:
+        ANSWERS.bypasses += 1
+    else:
+        answer = ANSWERS.get(
+            *cache_args,
+            question_embedding=question_embedding,
+            prompt_context=prompt_context,
+        )
+        if answer is not None:
+            yield answer
+
+    if answer is None:
+        with stage("prompt"):
+            inputs = {
+                "language": user_input.language,
+                "question": user_input.question,
+                "formatted_docs": format_relevant_documents(
+                    pack_documents(documents, user_input.question, token_budget)
+                ),
+                "previous_context": previous_context,
+                "last_entity": last_entity,
+            }
+            PROMPT_TOKENS.observe(estimate_tokens(PROMPT.format(**inputs)))
+        start_time = time.perf_counter()
+        chain = get_chain(LLM_MODEL, user_input.temperature)
+        tokens = []
+        async for chunk in chain.astream(inputs):
+            if chunk.content:
+                if not tokens:
+                    record_stage("llm_first_token", time.perf_counter() - start_time)
+                tokens.append(chunk.content)
+                yield chunk.content
+        record_stage("llm", time.perf_counter() - start_time)
+        answer = "".join(tokens)
+        ANSWERS.set(
+            *cache_args,
+            answer=answer,
+            generation_time=time.perf_counter() - start_time,
+            question_embedding=question_embedding,
+            prompt_context=prompt_context,
+        )
+
+    if user_input.session_id:
+        turns = [
+            compact_turn("user", user_input.question),
+            compact_turn("assistant", answer, [doc.model_dump() for doc in documents]),
+        ]
+        await asyncio.to_thread(SESSIONS.append, user_input.session_id, turns)
+
+
+async def _generate_answer(
+    user_input: UserInput,
+    documents: List[DocumentResponse],
+    cache_control: Optional[str] = None,
+) -> str:
+    """
+    Generate the whole answer to the user's question from the given documents.
+
+    Args:
+        user_input (UserInput): User input containing the question and generation parameters.
+        documents (List[DocumentResponse]): The documents to ground the answer on.
+        cache_control (str, optional): The Cache-Control header of the request; 'no-cache' bypasses the cache lookup.
+
+    Returns:
+        str: The generated answer.
+    """
+    return "".join(
+        [token async for token in _astream_answer(user_input, documents, cache_control)]
+    )
+
+
+@app.post("/get_sources", response_model=List[DocumentResponse])
+async def get_sources(user_input: UserInput) -> List[DocumentResponse]:
+    """
+    Retrieve relevant source documents based on the user's question.
+
+    Args:
+        user_input (UserInput): User input containing the question and retrieval parameters.
+
+    Returns:
+        List[DocumentResponse]: A list of relevant documents with their content and metadata.
+        Returns empty list if no relevant documents are found.
+    """
+    return await _retrieve_sources(user_input)
+
+
+@app.post("/get_sources/batch", response_model=List[List[DocumentResponse]])
+async def get_sources_batch(batch_input: BatchInput) -> List[List[DocumentResponse]]:
+    """
+    Retrieve the relevant source documents of many questions in a single request.
+
+    The questions are embedded in one batched call and searched concurrently,
+    which is much faster than one /get_sources request per question for
+    offline consumers (evaluation, QA jobs). Retrieval is vector-only.
+
+    Args:
+        batch_input (BatchInput): The questions and the retrieval parameters shared by all of them.
+
+    Returns:
+        List[List[DocumentResponse]]: The relevant documents of each question, in the order of the questions.
+    """
+    vector_store = await _aget_vector_store(batch_input.search_breadth)
+    filter = (
+        batch_input.filter.model_dump(exclude_none=True) if batch_input.filter else None
+    )
+    results = await abatch_relevant_documents(
+        [
+            RETRIEVAL_QUERY.format(question=question)
+            for question in batch_input.questions
+        ],
+        vector_store,
+        batch_input.similarity_threshold,
+        batch_input.max_sources,
+        filter=filter,
+    )
+    for docs in results:
+        RETRIEVED_DOCUMENTS.observe(len(docs))
+    return [
+        [
+            DocumentResponse(page_content=doc.page_content, metadata=doc.metadata)
+            for doc in docs
+        ]
+        for docs in results
+    ]
+
+
 @app.post("/answer")
-def answer(user_input: UserInput):
+async def answer(user_input: UserInput, cache_control: Optional[str] = Header(None)):
     """
     Generate an answer to a medical question using RAG methodology.
 
@@ -105,6 +727,12 @@ def answer(user_input: UserInput):
     3. Generates a response using Google's Generative AI
     4. Handles multi-language support
 
+    Answers are cached on the question, language, sources and temperature,
+    within the same conversation context and document token budget;
+    send a `Cache-Control: no-cache` header to bypass the cache lookup.
+    Without documents, a fixed "no sources found" message is returned
+    and the LLM is not called.
+
     Args:
         user_input (UserInput): Object containing:
             - question: The medical query
@@ -114,58 +742,99 @@ def answer(user_input: UserInput):
             - previous_context: Previous conversation history
             - similarity_threshold: Minimum similarity score for document retrieval
             - max_sources: Maximum number of sources to consider
+        cache_control (str, optional): The Cache-Control header of the request.
 
     Returns:
         dict: Contains the generated answer under the 'message' key
     """
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-1.5-pro",
-        temperature=user_input.temperature,
-        max_tokens=None,
-        timeout=None,
-        max_retries=2,
-    )
+    return {
+        "message": await _generate_answer(
+            user_input, user_input.documents, cache_control
+        )
+    }
 
-    prompt = ChatPromptTemplate.from_messages(
-        messages=[
-            (
-                "system",
-                """DOCUMENT:
-                {formatted_docs}
-
-                PREVIOUS CONTEXT:
-                {previous_context}
-
-                LAST DISCUSSED ENTITY:
-                {last_entity}
-
-                INSTRUCTIONS:
-                0. You are a knowledgeable medical professional.
-                1. You answer questions using ONLY the provided DOCUMENT.
-                2. If the QUESTION is in an other language, translate it first to english.
-                3. In the DOCUMENT, you can find the ANSWER to the question, the SOURCE of the ANSWER, as well as the FOCUS AREA.
-                4. Answer in {language} the QUESTION using the provided DOCUMENT text above.
-                5. Keep your answer grounded in the facts from the DOCUMENT only.
-                6. Be somewhat concise but retain all relevant information and details.
-                7. If the question refers to "it" or any other ambiguous term, refer to the LAST DISCUSSED ENTITY unless further clarification is provided in the QUESTION.
-                8. Use the PREVIOUS CONTEXT only if it provides additional clarity or information that directly supports answering the QUESTION.
-
-                QUESTION:
-                {question}
-                """,
-            ),
-            ("human", "The query is: {question}"),
-        ]
-    )
 
-    chain = prompt | llm
-    answer = chain.invoke(
-        {
-            "language": user_input.language,
-            "question": user_input.question,
-            "formatted_docs": format_relevant_documents(user_input.documents),
-            "previous_context": user_input.previous_context,
-            "last_entity": user_input.previous_context[-3:-1],
-        }
-    ).content
-    return {"message": answer}
+@app.post("/chat", response_model=ChatResponse)
+async def chat(
+    user_input: UserInput, cache_control: Optional[str] = Header(None)
+) -> ChatResponse:
+    """
+    Retrieve the relevant documents and generate the answer in a single request.
+
+    Equivalent to calling /get_sources then /answer, without sending the
+    retrieved documents back and forth between the client and the API.
+
+    Args:
+        user_input (UserInput): User input containing the question, retrieval and generation parameters.
+            The `documents` field is ignored.
+        cache_control (str, optional): The Cache-Control header of the request.
+
+    Returns:
+        ChatResponse: The generated answer under 'message' and the retrieved documents under 'sources'.
+    """
+    sources = await _retrieve_sources(user_input)
+    message = await _generate_answer(user_input, sources, cache_control)
+    return ChatResponse(message=message, sources=sources)
+
+
+@app.post("/chat/stream")
+async def chat_stream(
+    user_input: UserInput, cache_control: Optional[str] = Header(None)
+) -> StreamingResponse:
+    """
+    Retrieve the relevant documents and stream the answer as newline-delimited JSON.
+
+    The stream is made of one JSON object per line:
+    1. `{"type": "sources", "sources": [...]}` as soon as retrieval is done
+    2. `{"type": "token", "content": "..."}` for each generated token
+    3. `{"type": "metadata", "timings": {...}}` with the retrieval time, the
+       time to first token and the total time, in seconds since the request started
+
+    Retrieval runs before the response starts, so that its errors (e.g. 503
+    while the worker initializes) are returned with their status code rather
+    than as a 200 stream cut short.
+
+    Args:
+        user_input (UserInput): User input containing the question, retrieval and generation parameters.
+            The `documents` field is ignored.
+        cache_control (str, optional): The Cache-Control header of the request.
+
+    Returns:
+        StreamingResponse: The NDJSON stream of the answer.
+    """
+    start_time = time.perf_counter()
+    sources = await _retrieve_sources(user_input)
+    retrieval_time = time.perf_counter() - start_time
+
+    async def frames() -> AsyncIterator[str]:
+        yield (
+            json.dumps(
+                {
+                    "type": "sources",
+                    "sources": [source.model_dump() for source in sources],
+                }
+            )
+            + "\n"
+        )
+
+        time_to_first_token = None
+        async for token in _astream_answer(user_input, sources, cache_control):
+            if time_to_first_token is None:
+                time_to_first_token = time.perf_counter() - start_time
+            yield json.dumps({"type": "token", "content": token}) + "\n"
+
+        yield (
+            json.dumps(
+                {
+                    "type": "metadata",
+                    "timings": {
+                        "retrieval": retrieval_time,
+                        "time_to_first_token": time_to_first_token,
+                        "total": time.perf_counter() - start_time,
+                    },
+                }
+            )
+            + "\n"
+        )
+
+    return StreamingResponse(frames(), media_type="application/x-ndjson")
@@ -1,12 +1,33 @@
 """Streamlit app interface for the medical chatbot."""
 
-from typing import Dict, List
+import json
+import uuid
+from typing import Dict, List, Optional
 import streamlit as st
 import requests
 
 HOST = "http://0.0.0.0:8181/"
 # HOST = "https://malekmak-api-922282143131.europe-west1.run.app"
 
+
+def source_title(source: dict, similarity_threshold: float) -> Optional[str]:
+    """
+    Title of the expander of a source, or None if the source is below the similarity threshold.
+
+    Keyword matches of the hybrid retrieval have a BM25 score instead of a relevance score,
+    and are always shown.
+    """
+    metadata = source["metadata"]
+    score = metadata.get("score")
+    if score is None:
+        relevance = "Keyword match"
+    elif score >= similarity_threshold:
+        relevance = f"Relevance: {score*100:.2f}%"
+    else:
+        return None
+    return f"Source: {metadata["source"]} - Focus Area: {metadata["focus_area"]} - {relevance}"
+
+
 st.title("Malek's RAG Medical Chatbot")
 
 if "files_fetched" not in st.session_state:
@@ -55,6 +76,10 @@ with st.sidebar:
         st.write(file[5:])
 
 
+# The conversation is kept server-side: only its id is sent with each question
+if "session_id" not in st.session_state:
+    st.session_state.session_id = str(uuid.uuid4())
+
 if "messages" not in st.session_state:
     st.session_state["messages"] = [
         {"role": "assistant", "content": "Hello! How may I help you?", "sources": []}
@@ -68,10 +93,8 @@ for n, message in enumerate(st.session_state.messages):
     # Show sources if the message has them
     if "sources" in message and message["sources"]:
         for i, source in enumerate(message["sources"]):
-            if source["metadata"]["score"] >= similarity_threshold:
-                with st.expander(
-                    f"Source: {source["metadata"]["source"]} - Focus Area: {source["metadata"]["focus_area"]} - Relevance: {(source['metadata']['score'])*100:.2f}%"
-                ):
+            if title := source_title(source, similarity_threshold):
+                with st.expander(title):
                     st.write(f"Question: {source["page_content"]}")
                     st.write("Answer:")
                     st.write(source["metadata"]["answer"])
@@ -81,64 +104,53 @@ if question := st.chat_input("Message Malek's Medical Chatbot"):
     st.session_state.messages.append({"role": "user", "content": question})
     st.chat_message("user", avatar="🧑‍💻").write(question)
 
-    documents = requests.post(
-        f"{HOST}/get_sources",
-        json={
-            "question": question,
-            "temperature": temperature,
-            "similarity_threshold": similarity_threshold,
-            "max_sources": max_sources,
-            "language": language,
-            "documents": [],
-            "previous_context": [],
-        },
-        timeout=30,
-    )
-
-    docs = documents.json()
-
-    if not isinstance(docs, list):
-        docs = []
-
     response = requests.post(
-        f"{HOST}/answer",
+        f"{HOST}/chat/stream",
         json={
             "question": question,
             "temperature": temperature,
             "similarity_threshold": similarity_threshold,
             "max_sources": max_sources,
             "language": language,
-            "documents": docs,
-            "previous_context": st.session_state["messages"],
+            "session_id": st.session_state.session_id,
         },
+        stream=True,
         timeout=30,
     )
 
     if response.status_code == 200:
-        answer = response.json()["message"]
+        frames = {}
+
+        def stream_answer():
+            """Yield the answer tokens of the stream, keeping the other frames aside."""
+            try:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    frame = json.loads(line)
+                    if frame["type"] == "token":
+                        yield frame["content"]
+                    else:
+                        frames[frame["type"]] = frame
+            except requests.exceptions.RequestException:
+                # The stream was cut: keep what was received
+                return
+
+        with st.chat_message("assistant", avatar="🤖"):
+            answer = st.write_stream(stream_answer())
+            # The metadata frame ends every complete stream
+            if "metadata" not in frames:
+                st.warning("The answer was interrupted and may be incomplete.")
+        sources: List[Dict[str, str]] = frames.get("sources", {}).get("sources", [])
         st.session_state.messages.append(
-            {"role": "assistant", "content": answer, "sources": []}
+            {"role": "assistant", "content": answer, "sources": sources}
         )
-        st.chat_message("assistant", avatar="🤖").write(answer)
-    else:
-        st.write("Error: Unable to get a response from the API (response)")
-        st.write(f"The error is: {response.text}\nStatus Code: {response.status_code}")
-
-    if documents.status_code == 200:
-        sources: List[Dict[str, str]] = documents.json()
-        st.session_state.messages[-1][
-            "sources"
-        ] = sources  # Attach sources to last answer
         for i, source in enumerate(sources):
-            if source["metadata"]["score"] >= similarity_threshold:
-                with st.expander(
-                    f"Source: {source["metadata"]["source"]} - Focus Area: {source["metadata"]["focus_area"]} - Relevance: {(source['metadata']['score'])*100:.2f}%"
-                ):
+            if title := source_title(source, similarity_threshold):
+                with st.expander(title):
                     st.write(f"Question: {source["page_content"]}")
                     st.write("Answer:")
                     st.write(source["metadata"]["answer"])
     else:
-        st.write("Error: Unable to get a response from the API (documents)")
-        st.write(
-            f"The error is: {documents.text}\nStatus Code: {documents.status_code}"
-        )
+        st.write("Error: Unable to get a response from the API (response)")
+        st.write(f"The error is: {response.text}\nStatus Code: {response.status_code}")
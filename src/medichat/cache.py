@@ -0,0 +1,613 @@
+"""Caches sitting in front of the remote services of the chatbot."""
+
+import asyncio
+import hashlib
+import inspect
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize a text so that case and whitespace variants share the same cache key.
+
+    Args:
+        text (str): The text to normalize.
+
+    Returns:
+        str: The casefolded text with runs of whitespace collapsed to a single space.
+
+    Example:
+        >>> normalize_text("  What is   GLAUCOMA ? ")
+        'what is glaucoma ?'
+    """
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+class LRUCache:
+    """
+    In-memory least-recently-used cache with an optional time to live.
+
+    Example:
+        cache = LRUCache(maxsize=1000, ttl=3600)
+        cache.set("key", "value")
+        cache.get("key")
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Return the value of a key, or None if it is missing or expired.
+
+        Args:
+            key (Hashable): The key to look up.
+
+        Returns:
+            Any: The cached value, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Store a value, evicting the least recently used entry when the cache is full.
+
+        Args:
+            key (Hashable): The key to store the value under.
+            value (Any): The value to store.
+        """
+        expires_at = time.monotonic() + self.ttl if self.ttl else float("inf")
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def items(self) -> list[tuple[Hashable, Any]]:
+        """
+        Return the live entries, from least to most recently used.
+
+        Returns:
+            list[tuple[Hashable, Any]]: The (key, value) pairs that have not expired.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [
+                (key, value)
+                for key, (expires_at, value) in self._entries.items()
+                if expires_at >= now
+            ]
+
+    def clear(self) -> None:
+        """
+        Remove every entry.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteVectorCache:
+    """
+    On-disk cache of float32 vectors stored in a SQLite file.
+
+    The file can be shared by several processes (e.g. uvicorn workers) on the same host.
+
+    Example:
+        cache = SQLiteVectorCache("./embeddings.sqlite", ttl=86400)
+        cache.set("key", [0.1, 0.2])
+        cache.get("key")
+        cache.close()
+    """
+
+    def __init__(self, path: str, ttl: Optional[float] = None) -> None:
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors "
+            "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """
+        Return the vector of a key, or None if it is missing or expired.
+
+        Args:
+            key (str): The key to look up.
+
+        Returns:
+            np.ndarray: The cached float32 vector, or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT vector, created_at FROM vectors WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        vector, created_at = row
+        if self.ttl and created_at + self.ttl < time.time():
+            return None
+        return np.frombuffer(vector, dtype=np.float32)
+
+    def set(self, key: str, vector: list[float]) -> None:
+        """
+        Store a vector as float32.
+
+        Args:
+            key (str): The key to store the vector under.
+            vector (list[float]): The vector to store.
+        """
+        blob = np.asarray(vector, dtype=np.float32).tobytes()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO vectors (key, vector, created_at) VALUES (?, ?, ?)",
+                (key, blob, time.time()),
+            )
+            self._conn.commit()
+
+    def get_many(self, keys: list[str]) -> dict[str, np.ndarray]:
+        """
+        Return the vectors of many keys with a few queries.
+
+        Args:
+            keys (list[str]): The keys to look up.
+
+        Returns:
+            dict[str, np.ndarray]: The cached float32 vector of each key found and not expired.
+        """
+        found = {}
+        # Chunked to stay under the SQLite limit of bound parameters
+        for start in range(0, len(keys), 500):
+            chunk = keys[start : start + 500]
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT key, vector, created_at FROM vectors "
+                    f"WHERE key IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+            for key, vector, created_at in rows:
+                if not self.ttl or created_at + self.ttl >= time.time():
+                    found[key] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def set_many(self, items: dict[str, list[float]]) -> None:
+        """
+        Store many vectors as float32 in one transaction.
+
+        Args:
+            items (dict[str, list[float]]): The vector of each key.
+        """
+        now = time.time()
+        rows = [
+            (key, np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for key, vector in items.items()
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO vectors (key, vector, created_at) VALUES (?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        """Close the SQLite connection."""
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self) -> "SQLiteVectorCache":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper caching vectors in memory and, optionally, on disk.
+
+    Texts are normalized before hashing, so case and whitespace variants of a
+    question share one vector. Keys include the model name and the kind of
+    embedding (query or document), so changing models never returns stale vectors.
+
+    Example:
+        embeddings = CachedEmbeddings(get_embeddings(), maxsize=10000, ttl=86400)
+        embeddings.embed_query("What is Glaucoma ?")
+        embeddings.stats()
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        maxsize: int = 10_000,
+        ttl: Optional[float] = None,
+        path: Optional[str] = None,
+    ) -> None:
+        self.embeddings = embeddings
+        self.model_name = (
+            getattr(embeddings, "model_name", None) or type(embeddings).__name__
+        )
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.disk = SQLiteVectorCache(path, ttl=ttl) if path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, text: str, kind: str = "query") -> str:
+        """
+        Build the cache key of a text.
+
+        Args:
+            text (str): The text to embed.
+            kind (str, optional): 'query' or 'document'. Defaults to 'query'.
+
+        Returns:
+            str: The hex digest of the model name, the kind and the normalized text.
+        """
+        payload = f"{self.model_name}\x00{kind}\x00{normalize_text(text)}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _lookup(self, key: str) -> Optional[list[float]]:
+        vector = self.memory.get(key)
+        if vector is not None:
+            self.hits += 1
+            return vector
+        if self.disk is not None:
+            stored = self.disk.get(key)
+            if stored is not None:
+                vector = stored.tolist()
+                self.memory.set(key, vector)
+                self.hits += 1
+                self.disk_hits += 1
+                return vector
+        self.misses += 1
+        return None
+
+    def _store(self, key: str, vector: list[float]) -> None:
+        self.memory.set(key, vector)
+        if self.disk is not None:
+            self.disk.set(key, vector)
+
+    def embed_query(self, text: str) -> list[float]:
+        key = self.key(text)
+        vector = self._lookup(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self._store(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> list[float]:
+        key = self.key(text)
+        vector = self._lookup(key)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            self._store(key, vector)
+        return vector
+
+    def _split(
+        self, texts: list[str], kind: str = "document"
+    ) -> tuple[list, list[int]]:
+        vectors = [self._lookup(self.key(text, kind)) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        return vectors, missing
+
+    def _fill(
+        self,
+        texts: list[str],
+        vectors: list,
+        missing: list[int],
+        embedded: list,
+        kind: str = "document",
+    ) -> list[list[float]]:
+        for i, vector in zip(missing, embedded):
+            self._store(self.key(texts[i], kind), vector)
+            vectors[i] = vector
+        return vectors
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors, missing = self._split(texts)
+        embedded = (
+            self.embeddings.embed_documents([texts[i] for i in missing])
+            if missing
+            else []
+        )
+        return self._fill(texts, vectors, missing, embedded)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors, missing = self._split(texts)
+        embedded = (
+            await self.embeddings.aembed_documents([texts[i] for i in missing])
+            if missing
+            else []
+        )
+        return self._fill(texts, vectors, missing, embedded)
+
+    def _embed_queries(self, texts: list[str]) -> list[list[float]]:
+        # VertexAIEmbeddings embeds a batch of queries with the query task type
+        if (
+            "embeddings_task_type"
+            in inspect.signature(self.embeddings.embed_documents).parameters
+        ):
+            return self.embeddings.embed_documents(
+                texts, embeddings_task_type="RETRIEVAL_QUERY"
+            )
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_queries(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embed many queries with a single batched `embed_documents` call.
+
+        The vectors are the same as those of :meth:`aembed_query` and share its
+        cache entries, so a question embedded in a batch is a hit when asked alone.
+
+        Args:
+            texts (list[str]): The queries to embed.
+
+        Returns:
+            list[list[float]]: The embedding of each query, in order.
+        """
+        vectors, missing = self._split(texts, "query")
+        embedded = (
+            await asyncio.to_thread(self._embed_queries, [texts[i] for i in missing])
+            if missing
+            else []
+        )
+        return self._fill(texts, vectors, missing, embedded, "query")
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Return the hit and miss counters of the cache.
+
+        Returns:
+            dict[str, Any]: The model name, the counters, the hit rate and the number of entries in memory.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "model_name": self.model_name,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self.memory),
+        }
+
+
+def document_id(page_content: str, metadata: dict) -> str:
+    """
+    Return a stable identifier of a retrieved document.
+
+    Args:
+        page_content (str): The question of the document.
+        metadata (dict): The metadata of the document.
+
+    Returns:
+        str: The 'content_hash' of the metadata if present, else a hash of the source and the question.
+    """
+    if metadata.get("content_hash"):
+        return metadata["content_hash"]
+    payload = f"{metadata.get('source', '')}\x00{page_content}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """
+    Cache of generated answers, keyed on the question, the retrieved sources and the rest of the prompt.
+
+    An exact key hashes the normalized question, the language, the ordered source
+    identifiers, the temperature bucket and the prompt context (whatever else the
+    prompt depends on: the conversation so far and the document token budget), so
+    a follow-up question such as 'what causes it?' is only answered from the cache
+    within the same conversation. When a similarity threshold is set, a miss falls
+    back to the cached question whose embedding is the closest (cosine similarity)
+    among the entries sharing the same language, sources, temperature and prompt context.
+
+    Example:
+        cache = AnswerCache(maxsize=1000, ttl=3600, similarity_threshold=0.97)
+        cache.set("What is Glaucoma ?", "English", ids, 0.2, answer, generation_time=2.3)
+        cache.get("what is glaucoma?", "English", ids, 0.2)
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1000,
+        ttl: Optional[float] = None,
+        similarity_threshold: Optional[float] = None,
+        temperature_step: float = 0.1,
+    ) -> None:
+        self.entries = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.similarity_threshold = similarity_threshold
+        self.temperature_step = temperature_step
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.latency_saved = 0.0
+
+    def context_key(
+        self,
+        language: str,
+        source_ids: list[str],
+        temperature: float,
+        prompt_context: str = "",
+    ) -> str:
+        """
+        Hash everything but the question: answers are only reused within the same context.
+
+        Args:
+            language (str): The language of the answer.
+            source_ids (list[str]): The ordered identifiers of the retrieved documents.
+            temperature (float): The temperature of the generation.
+            prompt_context (str, optional): The rest of the prompt the answer depends on, e.g. the conversation context.
+
+        Returns:
+            str: The hex digest of the context.
+        """
+        bucket = round(temperature / self.temperature_step)
+        payload = "\x00".join(
+            [normalize_text(language), str(bucket), prompt_context, *source_ids]
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def key(
+        self,
+        question: str,
+        language: str,
+        source_ids: list[str],
+        temperature: float,
+        prompt_context: str = "",
+    ) -> str:
+        """
+        Build the exact cache key of an answer.
+
+        Args:
+            question (str): The question of the user.
+            language (str): The language of the answer.
+            source_ids (list[str]): The ordered identifiers of the retrieved documents.
+            temperature (float): The temperature of the generation.
+            prompt_context (str, optional): The rest of the prompt the answer depends on, e.g. the conversation context.
+
+        Returns:
+            str: The hex digest of the normalized question and of its context.
+        """
+        payload = f"{self.context_key(language, source_ids, temperature, prompt_context)}\x00{normalize_text(question)}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(
+        self,
+        question: str,
+        language: str,
+        source_ids: list[str],
+        temperature: float,
+        question_embedding: Optional[list[float]] = None,
+        prompt_context: str = "",
+    ) -> Optional[str]:
+        """
+        Return a cached answer, or None on a miss.
+
+        Args:
+            question (str): The question of the user.
+            language (str): The language of the answer.
+            source_ids (list[str]): The ordered identifiers of the retrieved documents.
+            temperature (float): The temperature of the generation.
+            question_embedding (list[float], optional): Enables the near-duplicate lookup.
+            prompt_context (str, optional): The rest of the prompt the answer depends on, e.g. the conversation context.
+
+        Returns:
+            str: The cached answer, or None.
+        """
+        entry = self.entries.get(
+            self.key(question, language, source_ids, temperature, prompt_context)
+        )
+        if entry is None and self.similarity_threshold and question_embedding:
+            entry = self._nearest(
+                self.context_key(language, source_ids, temperature, prompt_context),
+                question_embedding,
+            )
+            if entry is not None:
+                self.semantic_hits += 1
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.latency_saved += entry["generation_time"]
+        return entry["answer"]
+
+    def _nearest(
+        self, context_key: str, question_embedding: list[float]
+    ) -> Optional[dict]:
+        candidates = [
+            entry
+            for _, entry in self.entries.items()
+            if entry["context_key"] == context_key and entry["embedding"] is not None
+        ]
+        if not candidates:
+            return None
+        query = np.asarray(question_embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        similarities = np.stack([entry["embedding"] for entry in candidates]) @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+        return candidates[best]
+
+    def set(
+        self,
+        question: str,
+        language: str,
+        source_ids: list[str],
+        temperature: float,
+        answer: str,
+        generation_time: float,
+        question_embedding: Optional[list[float]] = None,
+        prompt_context: str = "",
+    ) -> None:
+        """
+        Store a generated answer.
+
+        Args:
+            question (str): The question of the user.
+            language (str): The language of the answer.
+            source_ids (list[str]): The ordered identifiers of the retrieved documents.
+            temperature (float): The temperature of the generation.
+            answer (str): The generated answer.
+            generation_time (float): The time spent generating the answer, in seconds.
+            question_embedding (list[float], optional): Makes the entry available to near-duplicate lookups.
+            prompt_context (str, optional): The rest of the prompt the answer depends on, e.g. the conversation context.
+        """
+        embedding = None
+        if question_embedding:
+            embedding = np.asarray(question_embedding, dtype=np.float32)
+            embedding /= np.linalg.norm(embedding) or 1.0
+        self.entries.set(
+            self.key(question, language, source_ids, temperature, prompt_context),
+            {
+                "answer": answer,
+                "generation_time": generation_time,
+                "context_key": self.context_key(
+                    language, source_ids, temperature, prompt_context
+                ),
+                "embedding": embedding,
+            },
+        )
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Return the hit rate of the cache and the generation time it saved.
+
+        Returns:
+            dict[str, Any]: The counters, the hit rate, the saved latency in seconds and the number of entries.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "bypasses": self.bypasses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "latency_saved": self.latency_saved,
+            "size": len(self.entries),
+        }
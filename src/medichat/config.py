@@ -1,3 +1,5 @@
+import os
+
 PROJECT_ID = "medichat-451909"
 REGION = "europe-west1"
 INSTANCE = "myinstance"
@@ -5,3 +7,87 @@ DATABASE = "db_medichat"
 DB_USER = "postgres"
 TABLE_NAME = "table_medichat"
 BUCKET_NAME = "medichat-bucket"
+
+# Query embedding cache (set MEDICHAT_EMBEDDING_CACHE_PATH to also keep vectors on disk)
+EMBEDDING_CACHE_SIZE = 10_000
+EMBEDDING_CACHE_TTL = 7 * 24 * 3600  # seconds
+EMBEDDING_CACHE_PATH = os.environ.get("MEDICHAT_EMBEDDING_CACHE_PATH")
+
+# Generated answer cache (set the similarity threshold to None to disable near-duplicate lookups)
+ANSWER_CACHE_SIZE = 1000
+ANSWER_CACHE_TTL = 3600  # seconds
+ANSWER_CACHE_SIMILARITY_THRESHOLD = 0.97
+ANSWER_CACHE_TEMPERATURE_STEP = 0.1
+
+# Generation: one long-lived LLM client per (model, temperature), up to LLM_POOL_SIZE
+LLM_MODEL = "gemini-1.5-pro"
+LLM_POOL_SIZE = 64
+
+# Conversation context: the last turns verbatim, older turns summarized, under a token budget
+CONTEXT_TOKEN_BUDGET = 1000
+CONTEXT_WINDOW_TURNS = 6
+
+# Conversation sessions (set MEDICHAT_SESSION_DB_URL, e.g. sqlite:///sessions.db, to share them between workers)
+SESSION_DB_URL = os.environ.get("MEDICHAT_SESSION_DB_URL")
+SESSION_MAX_SESSIONS = 10_000
+SESSION_MAX_TURNS = 50
+SESSION_IDLE_TTL = 2 * 3600  # seconds
+SESSION_PURGE_INTERVAL = 15 * 60  # seconds between deletions of the expired SQL sessions
+
+# Vector column of the table, as created by PostgresEngine.init_vectorstore_table
+EMBEDDING_COLUMN = "embedding"
+
+# Column holding the hash of each row's question, answer, source and focus area, for incremental re-ingestion
+CONTENT_HASH_COLUMN = "content_hash"
+
+# Metadata promoted to indexed columns of the table, the only keys a retrieval filter may use
+FILTER_COLUMNS = ["focus_area", "source"]
+
+# Columns read into the metadata of the vector store results (the JSON metadata does not hold the content hash)
+METADATA_COLUMNS = [CONTENT_HASH_COLUMN, *FILTER_COLUMNS]
+
+# Bucket sync: parallel downloads streamed in chunks, and a TTL-bound listing served by the API
+GCS_DOWNLOAD_WORKERS = 8
+GCS_CHUNK_SIZE = 8 * 1024 * 1024  # bytes, a multiple of 256 KiB
+GCS_LISTING_TTL = 300  # seconds
+
+# Vector index on the embedding column: 'hnsw' or 'ivfflat' (IVFFlat lists default to rows / 1000)
+VECTOR_INDEX_TYPE = "hnsw"
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 64
+IVFFLAT_LISTS = None
+# Default per-query search breadth: hnsw.ef_search (>= max_sources) or ivfflat.probes
+HNSW_EF_SEARCH = 40
+IVFFLAT_PROBES = 10
+
+# Vector search backend: 'postgres' (Cloud SQL) or 'local' (memory-mapped export, see `--export-local`)
+VECTOR_BACKEND = os.environ.get("MEDICHAT_VECTOR_BACKEND", "postgres")
+LOCAL_STORE_PATH = os.environ.get("MEDICHAT_LOCAL_STORE_PATH", "./vector_store")
+
+# Batch retrieval (/get_sources/batch): questions per request, and similarity searches run at once on Cloud SQL
+BATCH_MAX_QUESTIONS = 1000
+BATCH_SEARCH_CONCURRENCY = 8
+
+# Retrieval: 'vector', or 'hybrid' to fuse BM25 and vector rankings with reciprocal rank fusion
+RETRIEVAL_MODE = os.environ.get("MEDICHAT_RETRIEVAL_MODE", "vector")
+HYBRID_CANDIDATES = 20  # documents taken from each ranking before fusion
+RRF_K = 60
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Queries naming only a known focus area (e.g. 'Glaucoma') skip the embedding call
+LEXICAL_FAST_PATH_MAX_TERMS = 3
+
+# Metrics (/metrics): latency histogram buckets in seconds, and the opt-in Server-Timing response header
+METRICS_LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+SERVER_TIMING = os.environ.get("MEDICHAT_SERVER_TIMING", "false").lower() == "true"
+
+# Retrieved documents in the prompt: token budget shared by relevance (0, the default, disables packing), and the smallest answer kept
+DOCUMENT_TOKEN_BUDGET = int(os.environ.get("MEDICHAT_DOCUMENT_TOKEN_BUDGET", "0"))
+PACKING_MIN_DOCUMENT_TOKENS = 50
+
+# Diversity of the vector results: 'none', 'mmr' (maximal marginal relevance) or 'dedup' (drop near-duplicates),
+# selected among max_sources * DIVERSITY_FETCH_FACTOR candidates
+DIVERSITY_MODE = os.environ.get("MEDICHAT_DIVERSITY_MODE", "none")
+DIVERSITY_FETCH_FACTOR = 4
+MMR_LAMBDA = 0.5
+DEDUP_SIMILARITY_THRESHOLD = 0.95
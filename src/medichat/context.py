@@ -0,0 +1,165 @@
+"""Bounded conversation context sent to the LLM along with the retrieved documents."""
+
+import re
+from medichat.config import CONTEXT_TOKEN_BUDGET, CONTEXT_WINDOW_TURNS
+
+# Words never taken as the discussed entity when falling back to the user's questions
+QUESTION_WORDS = {
+    "what", "which", "who", "whom", "whose", "when", "where", "why", "how",
+    "is", "are", "was", "were", "do", "does", "did", "can", "could", "should",
+    "would", "will", "i", "it", "its", "they", "them", "this", "that", "these",
+    "those", "a", "an", "the", "of", "to", "for", "in", "on", "and", "or",
+    "qu", "que", "quoi", "est", "ce", "le", "la", "les", "un", "une", "des",
+    "comment", "pourquoi", "quels", "quelles", "quel", "quelle",
+}  # fmt: skip
+SUMMARY_HEADER = "SUMMARY OF EARLIER TURNS:\n"
+RECENT_HEADER = "RECENT TURNS:\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens of a text without calling a tokenizer.
+
+    Args:
+        text (str): The text to measure.
+
+    Returns:
+        int: The estimated number of tokens, about one per 4 characters.
+
+    Example:
+        >>> estimate_tokens("What is Glaucoma ?")
+        5
+    """
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cut a text so that it fits in a number of tokens.
+
+    Args:
+        text (str): The text to cut.
+        max_tokens (int): The maximum number of tokens.
+
+    Returns:
+        str: The text itself if it fits, else its beginning followed by '...'.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    return text[: max(0, max_tokens * 4 - 3)].rstrip() + "..."
+
+
+def first_sentence(text: str) -> str:
+    """
+    Return the first sentence of a text.
+
+    Args:
+        text (str): The text to summarize.
+
+    Returns:
+        str: The text up to its first sentence-ending punctuation.
+    """
+    match = re.match(r"\s*(.+?[.!?])(\s|$)", text, flags=re.DOTALL)
+    return (match.group(1) if match else text).strip()
+
+
+def extract_last_entity(messages: list[dict]) -> str:
+    """
+    Find the entity (disease, condition, drug...) the conversation is about.
+
+    Walks the conversation from the newest turn and returns the focus area of
+    the best source of the last sourced answer, or else the capitalized terms
+    of the last user question naming one.
+
+    Args:
+        messages (list[dict]): The turns of the conversation, oldest first, with 'role', 'content' and optional 'sources'.
+
+    Returns:
+        str: The last discussed entity, empty if none is found.
+
+    Example:
+        >>> extract_last_entity([{"role": "user", "content": "What is Glaucoma ?"}])
+        'Glaucoma'
+    """
+    for message in reversed(messages):
+        sources = message.get("sources") or []
+        if sources:
+            best = max(sources, key=lambda source: source["metadata"].get("score", 0))
+            if best["metadata"].get("focus_area"):
+                return best["metadata"]["focus_area"]
+        if message.get("role") == "user":
+            terms = [
+                word
+                for word in re.findall(r"[^\W\d_][\w'-]*", message.get("content", ""))
+                if word[0].isupper() and word.lower() not in QUESTION_WORDS
+            ]
+            if terms:
+                return " ".join(terms)
+    return ""
+
+
+def build_context(
+    messages: list[dict],
+    question: str = "",
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+    window: int = CONTEXT_WINDOW_TURNS,
+) -> tuple[str, str]:
+    """
+    Build the conversation context of the prompt under a token budget.
+
+    The last `window` turns are kept verbatim (newest first, each cut to its
+    share of the budget) and the older turns are folded into a rolling summary
+    made of their first sentences, keeping the most recent ones that fit.
+    Sources are stripped from every turn, and the headers and line breaks are
+    counted too, so the context stays within the budget however long the
+    conversation is.
+
+    Args:
+        messages (list[dict]): The turns of the conversation, oldest first, with 'role', 'content' and optional 'sources'.
+        question (str, optional): The current question, dropped if it is the last turn.
+        token_budget (int, optional): The maximum number of tokens of the context. Defaults to CONTEXT_TOKEN_BUDGET.
+        window (int, optional): The number of recent turns kept verbatim. Defaults to CONTEXT_WINDOW_TURNS.
+
+    Returns:
+        tuple[str, str]: The formatted context and the last discussed entity.
+
+    Example:
+        context, last_entity = build_context(user_input.previous_context, user_input.question)
+    """
+    last_entity = extract_last_entity(messages)
+    turns = [message for message in messages if message.get("content")]
+    if turns and turns[-1].get("role") == "user" and turns[-1]["content"] == question:
+        turns = turns[:-1]
+    if not turns:
+        return "", last_entity
+
+    recent, older = turns[-window:], turns[:-window]
+    # The summary gets a quarter of the budget when there are older turns
+    summary_budget = token_budget // 4 if older else 0
+    # Each verbatim turn gets an equal share of the rest after the header, minus the tokens of its role prefix
+    turn_budget = max(
+        1,
+        (token_budget - summary_budget - estimate_tokens(RECENT_HEADER)) // len(recent)
+        - 3,
+    )
+
+    recent_lines = [
+        f"{turn['role']}: {truncate_to_tokens(turn['content'], turn_budget)}"
+        for turn in recent
+    ]
+
+    summary_lines = []
+    # The header, and the blank line before the recent turns
+    used = estimate_tokens(SUMMARY_HEADER + "\n")
+    for turn in reversed(older):
+        line = f"- {turn['role']}: {truncate_to_tokens(first_sentence(turn['content']), 40)}"
+        used += estimate_tokens(line + "\n")
+        if used > summary_budget:
+            break
+        summary_lines.insert(0, line)
+
+    sections = []
+    if summary_lines:
+        sections.append(SUMMARY_HEADER + "\n".join(summary_lines))
+    sections.append(RECENT_HEADER + "\n".join(recent_lines))
+    return "\n\n".join(sections), last_entity
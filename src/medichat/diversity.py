@@ -0,0 +1,146 @@
+"""Redundancy-aware selection of retrieved documents: maximal marginal relevance and near-duplicate removal."""
+
+import numpy as np
+from medichat.config import DEDUP_SIMILARITY_THRESHOLD, MMR_LAMBDA
+
+DIVERSITY_MODES = ["none", "mmr", "dedup"]
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize vectors, so that their dot products are cosine similarities.
+
+    Args:
+        vectors (np.ndarray): A vector, or a matrix with one vector per row.
+
+    Returns:
+        np.ndarray: The float32 normalized vectors, zero vectors left as they are.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def maximal_marginal_relevance(
+    query: np.ndarray,
+    candidates: np.ndarray,
+    k: int,
+    lambda_mult: float = MMR_LAMBDA,
+) -> list[int]:
+    """
+    Select candidates relevant to the query but not to each other, with maximal marginal relevance.
+
+    At each step the candidate maximizing `lambda_mult * similarity to the query
+    - (1 - lambda_mult) * highest similarity to a selected candidate` is taken.
+    The candidate similarities are computed once as one matrix product, and the
+    highest similarity of every candidate to the selection is updated with one
+    `np.maximum` per step, so a selection costs O(n^2 d) for the product and
+    O(n k) after it.
+
+    Args:
+        query (np.ndarray): The query vector.
+        candidates (np.ndarray): The candidate vectors, one per row.
+        k (int): The number of candidates to select.
+        lambda_mult (float, optional): 1 for relevance only, 0 for diversity only. Defaults to MMR_LAMBDA.
+
+    Returns:
+        list[int]: The indices of the selected candidates, in the order of selection.
+
+    Example:
+        >>> maximal_marginal_relevance(np.array([1.0, 0.0]), np.array([[0.9, 0.44], [0.9, 0.45], [0.9, -0.44]]), 2)
+        [0, 2]
+    """
+    candidates = normalize(candidates)
+    k = min(k, len(candidates))
+    if k <= 0:
+        return []
+    relevance = candidates @ normalize(query)
+    similarities = candidates @ candidates.T
+
+    selected = [int(np.argmax(relevance))]
+    redundancy = similarities[selected[0]].copy()
+    available = np.ones(len(candidates), dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < k:
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, similarities[best], out=redundancy)
+    return selected
+
+
+def deduplicate(
+    candidates: np.ndarray,
+    k: int,
+    threshold: float = DEDUP_SIMILARITY_THRESHOLD,
+) -> list[int]:
+    """
+    Keep the best candidates that are not near-duplicates of a better one.
+
+    Candidates are taken in their order (best first), skipping any whose cosine
+    similarity with an already kept candidate reaches the threshold.
+
+    Args:
+        candidates (np.ndarray): The candidate vectors, one per row, best first.
+        k (int): The maximum number of candidates to keep.
+        threshold (float, optional): The cosine similarity from which two candidates are duplicates. Defaults to DEDUP_SIMILARITY_THRESHOLD.
+
+    Returns:
+        list[int]: The indices of the kept candidates, in their order.
+
+    Example:
+        >>> deduplicate(np.array([[1.0, 0.0], [1.0, 0.01], [0.6, 0.8]]), 2)
+        [0, 2]
+    """
+    candidates = normalize(candidates)
+    if k <= 0 or not len(candidates):
+        return []
+    # duplicates[i, j]: candidate i duplicates the better candidate j
+    duplicates = np.tril(candidates @ candidates.T >= threshold, k=-1)
+    kept = np.zeros(len(candidates), dtype=bool)
+    selected = []
+    for i in range(len(candidates)):
+        if not (duplicates[i] & kept).any():
+            kept[i] = True
+            selected.append(i)
+            if len(selected) == k:
+                break
+    return selected
+
+
+def diversify(
+    query: np.ndarray,
+    candidates: np.ndarray,
+    k: int,
+    mode: str,
+    lambda_mult: float = MMR_LAMBDA,
+    threshold: float = DEDUP_SIMILARITY_THRESHOLD,
+) -> list[int]:
+    """
+    Select k candidates with a diversity mode.
+
+    Args:
+        query (np.ndarray): The query vector.
+        candidates (np.ndarray): The candidate vectors, one per row, best first.
+        k (int): The number of candidates to select.
+        mode (str): 'mmr' for :func:`maximal_marginal_relevance`, 'dedup' for :func:`deduplicate`, 'none' for the first k.
+        lambda_mult (float, optional): The relevance weight of 'mmr'. Defaults to MMR_LAMBDA.
+        threshold (float, optional): The duplicate similarity of 'dedup'. Defaults to DEDUP_SIMILARITY_THRESHOLD.
+
+    Returns:
+        list[int]: The indices of the selected candidates.
+
+    Raises:
+        ValueError: If the mode is not one of DIVERSITY_MODES.
+    """
+    if mode == "mmr":
+        return maximal_marginal_relevance(query, candidates, k, lambda_mult)
+    if mode == "dedup":
+        return deduplicate(candidates, k, threshold)
+    if mode == "none":
+        return list(range(min(k, len(candidates))))
+    raise ValueError(
+        f"Unknown diversity mode '{mode}', expected one of {DIVERSITY_MODES}"
+    )
@@ -1,16 +1,25 @@
+import argparse
+import hashlib
 import pandas as pd
 import numpy as np
 import requests
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 import os
-from sklearn.metrics.pairwise import cosine_similarity
+from requests.adapters import HTTPAdapter
 from sentence_transformers import SentenceTransformer
 from rich.console import Console
 from rich.table import Table
 from dotenv import load_dotenv
 import json
+from langchain_core.documents import Document
+from medichat.cache import SQLiteVectorCache
+from medichat.context import estimate_tokens
+from medichat.packing import pack_documents
+from medichat.retrieve import format_relevant_documents
 
 load_dotenv()
 
@@ -22,18 +31,36 @@ EVAL_DIR = "/Users/malmak/Dauphine/M2/Generative AI/mediChat/eval"
 RESULTS_DIR = os.path.join(EVAL_DIR, "results")
 NUM_TEST_SAMPLES = 10
 SAMPLE_SEED = 42
+# Requests in flight at once, requests per second (None for no limit) and retries of a failed request
+EVAL_CONCURRENCY = 4
+EVAL_RATE_LIMIT = None
+EVAL_MAX_RETRIES = 3
+EVAL_RETRY_BACKOFF = 1.0  # seconds, doubled at each retry
+# Completed samples, one JSON line each, so that an interrupted run resumes where it stopped
+CHECKPOINT_FILE = os.path.join(RESULTS_DIR, "evaluation_checkpoint.jsonl")
+# Answers are scored after all the responses are in: encoded in batches, with their embeddings cached on disk
+SCORING_MODEL_NAME = "all-MiniLM-L6-v2"
+SCORING_BATCH_SIZE = 128
+SCORING_CACHE_PATH = os.path.join(RESULTS_DIR, "scoring_embeddings.sqlite")
+# Retrieval modes compared on the sampled questions, see `run_retrieval_comparison`
+RETRIEVAL_MODES = ["vector", "hybrid"]
+# Token budgets of the documents in the prompt compared by the evaluation, 0 sending them whole
+PACKING_BUDGETS = [0, 2000, 1000]
 
 # Initialize sentence transformer for semantic similarity
-model = SentenceTransformer("all-MiniLM-L6-v2")
+model = SentenceTransformer(SCORING_MODEL_NAME)
 console = Console()
 
 
-def load_test_data() -> pd.DataFrame:
+def load_test_data(num_samples: int = NUM_TEST_SAMPLES) -> pd.DataFrame:
     """
     Load and prepare test data from the MedQuAD dataset.
 
+    Args:
+        num_samples (int, optional): The number of sampled rows. Defaults to NUM_TEST_SAMPLES.
+
     Returns:
-        pd.DataFrame: A random sample of the dataset containing NUM_TEST_SAMPLES rows.
+        pd.DataFrame: A random sample of the dataset containing `num_samples` rows.
 
     Raises:
         FileNotFoundError: If the CSV file is not found at CSV_FILE_PATH.
@@ -42,15 +69,109 @@ def load_test_data() -> pd.DataFrame:
         raise FileNotFoundError(f"Dataset not found at {CSV_FILE_PATH}")
 
     df = pd.read_csv(CSV_FILE_PATH)
-    return df.sample(n=NUM_TEST_SAMPLES, random_state=SAMPLE_SEED)
+    return df.sample(n=num_samples, random_state=SAMPLE_SEED)
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter spacing out the requests of all the workers to a maximum rate.
+
+    Example:
+        rate_limiter = RateLimiter(5.0)
+        rate_limiter.acquire()  # blocks until the next request may be sent
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1.0 / rate
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(self.next_time, now) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def create_session(concurrency: int = EVAL_CONCURRENCY) -> requests.Session:
+    """
+    Create an HTTP session shared by the workers, keeping one connection alive per worker.
+
+    Args:
+        concurrency (int, optional): The number of concurrent workers. Defaults to EVAL_CONCURRENCY.
 
+    Returns:
+        requests.Session: The session.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def post_with_retries(
+    session: requests.Session,
+    url: str,
+    payload: Dict,
+    rate_limiter: Optional[RateLimiter] = None,
+    max_retries: int = EVAL_MAX_RETRIES,
+) -> Tuple[requests.Response, float]:
+    """
+    Send a POST request, retrying connection errors, 429 and 5xx responses with exponential backoff.
+
+    The latency is measured around the last attempt only, after waiting for the
+    rate limiter, so it is not inflated by the queueing of concurrent requests.
+
+    Args:
+        session (requests.Session): The shared HTTP session.
+        url (str): The URL to post to.
+        payload (Dict): The JSON body.
+        rate_limiter (RateLimiter, optional): The limiter shared by the workers.
+        max_retries (int, optional): The number of retries. Defaults to EVAL_MAX_RETRIES.
+
+    Returns:
+        Tuple[requests.Response, float]: The response and its latency in seconds.
 
-def get_chatbot_response(question: str) -> Tuple[Dict, float]:
+    Raises:
+        Exception: If the request still fails after the retries.
+    """
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        start_time = time.perf_counter()
+        try:
+            response = session.post(url, json=payload, timeout=30)
+            latency = time.perf_counter() - start_time
+            if response.status_code == 200:
+                return response, latency
+            error = Exception(f"API Error: {response.status_code}")
+            retryable = response.status_code == 429 or response.status_code >= 500
+        except requests.RequestException as e:
+            error, retryable = e, True
+        if not retryable or attempt == max_retries:
+            raise error
+        time.sleep(EVAL_RETRY_BACKOFF * 2**attempt)
+
+
+def get_chatbot_response(
+    question: str,
+    session: Optional[requests.Session] = None,
+    rate_limiter: Optional[RateLimiter] = None,
+    max_retries: int = EVAL_MAX_RETRIES,
+    document_token_budget: Optional[int] = None,
+) -> Tuple[Dict, float]:
     """
     Get response from the chatbot API and measure response time.
 
     Args:
         question (str): The question to ask the chatbot.
+        session (requests.Session, optional): The shared HTTP session. Defaults to a new session.
+        rate_limiter (RateLimiter, optional): The limiter shared by the workers.
+        max_retries (int, optional): The number of retries of a failed request. Defaults to EVAL_MAX_RETRIES.
+        document_token_budget (int, optional): The token budget of the documents in the prompt. Defaults to the one of the API.
 
     Returns:
         Tuple[Dict, float]: A tuple containing:
@@ -60,56 +181,310 @@ def get_chatbot_response(question: str) -> Tuple[Dict, float]:
     Raises:
         Exception: If the API call fails or returns non-200 status code.
     """
-    start_time = time.time()
+    payload = {
+        "question": question,
+        "temperature": 0.2,
+        "similarity_threshold": 0.75,
+        "max_sources": 4,
+        "language": "English",
+        "previous_context": [],
+    }
+    if document_token_budget is not None:
+        payload["document_token_budget"] = document_token_budget
+    try:
+        # Get sources and answer in a single round trip
+        chat_response, response_time = post_with_retries(
+            session or requests.Session(),
+            f"{HOST}/chat",
+            payload,
+            rate_limiter,
+            max_retries,
+        )
+        return chat_response.json(), response_time
+
+    except Exception as e:
+        print(f"Error in API call: {str(e)}")
+        return {"sources": [], "message": ""}, 0.0
+
+
+def get_sources_response(
+    question: str,
+    retrieval_mode: str,
+    session: Optional[requests.Session] = None,
+    rate_limiter: Optional[RateLimiter] = None,
+) -> Tuple[List[Dict], float]:
+    """
+    Get the sources retrieved for a question with a retrieval mode, and measure the response time.
+
+    Args:
+        question (str): The question to retrieve sources for.
+        retrieval_mode (str): 'vector' or 'hybrid'.
+        session (requests.Session, optional): The shared HTTP session. Defaults to a new session.
+        rate_limiter (RateLimiter, optional): The limiter shared by the workers.
 
+    Returns:
+        Tuple[List[Dict], float]: The retrieved sources and the response time in seconds.
+    """
     try:
-        # Get sources
-        sources_response = requests.post(
+        response, response_time = post_with_retries(
+            session or requests.Session(),
             f"{HOST}/get_sources",
-            json={
+            {
                 "question": question,
                 "temperature": 0.2,
                 "similarity_threshold": 0.75,
                 "max_sources": 4,
                 "language": "English",
-                "documents": [],
-                "previous_context": [],
+                "retrieval_mode": retrieval_mode,
             },
-            timeout=30,
+            rate_limiter,
         )
+        return response.json(), response_time
 
-        if sources_response.status_code != 200:
-            raise Exception(f"Sources API Error: {sources_response.status_code}")
+    except Exception as e:
+        print(f"Error in API call: {str(e)}")
+        return [], 0.0
 
-        sources = sources_response.json()
 
-        # Get answer
-        answer_response = requests.post(
-            f"{HOST}/answer",
-            json={
-                "question": question,
-                "temperature": 0.2,
-                "similarity_threshold": 0.75,
-                "max_sources": 4,
-                "language": "English",
-                "documents": sources,
-                "previous_context": [],
-            },
-            timeout=30,
+def run_retrieval_comparison(
+    test_data: pd.DataFrame,
+    concurrency: int = EVAL_CONCURRENCY,
+    rate_limit: Optional[float] = EVAL_RATE_LIMIT,
+) -> pd.DataFrame:
+    """
+    Compare the retrieval modes on the test questions.
+
+    A question is recalled when its own MedQuAD row is among the retrieved
+    sources, and its reciprocal rank is 1 / the rank of that row (0 if missing).
+
+    Args:
+        test_data (pd.DataFrame): The sampled rows, with 'question' and 'focus_area'.
+        concurrency (int, optional): The number of requests in flight at once. Defaults to EVAL_CONCURRENCY.
+        rate_limit (float, optional): The maximum number of requests per second. Defaults to EVAL_RATE_LIMIT.
+
+    Returns:
+        pd.DataFrame: Per retrieval mode, the mean recall, reciprocal rank and response time.
+    """
+    rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+    results = []
+    with (
+        create_session(concurrency) as session,
+        ThreadPoolExecutor(concurrency) as executor,
+    ):
+        responses = {
+            retrieval_mode: list(
+                executor.map(
+                    lambda question: get_sources_response(
+                        question, retrieval_mode, session, rate_limiter
+                    ),
+                    test_data["question"],
+                )
+            )
+            for retrieval_mode in RETRIEVAL_MODES
+        }
+    for retrieval_mode in RETRIEVAL_MODES:
+        recalls, reciprocal_ranks, response_times = [], [], []
+        for (_, row), (sources, response_time) in zip(
+            test_data.iterrows(), responses[retrieval_mode]
+        ):
+            ranks = [
+                rank
+                for rank, source in enumerate(sources, 1)
+                if source["page_content"] == row["question"]
+                and source["metadata"].get("focus_area") == row["focus_area"]
+            ]
+            recalls.append(1.0 if ranks else 0.0)
+            reciprocal_ranks.append(1.0 / ranks[0] if ranks else 0.0)
+            response_times.append(response_time)
+        results.append(
+            {
+                "retrieval_mode": retrieval_mode,
+                "recall": float(np.mean(recalls)),
+                "mrr": float(np.mean(reciprocal_ranks)),
+                "response_time": float(np.mean(response_times)),
+            }
         )
+    return pd.DataFrame(results)
 
-        if answer_response.status_code != 200:
-            raise Exception(f"Answer API Error: {answer_response.status_code}")
 
-        response_time = time.time() - start_time
-        return {
-            "sources": sources,
-            "message": answer_response.json()["message"],
-        }, response_time
+def document_tokens(question: str, sources: List[Dict], token_budget: int) -> int:
+    """
+    Count the tokens of the sources as packed in the prompt by the API for a token budget.
 
-    except Exception as e:
-        print(f"Error in API call: {str(e)}")
-        return {"sources": [], "message": ""}, 0.0
+    Args:
+        question (str): The question of the user.
+        sources (List[Dict]): The sources returned by /chat, with 'page_content' and 'metadata'.
+        token_budget (int): The token budget of the documents, 0 for the whole documents.
+
+    Returns:
+        int: The estimated number of tokens of the formatted documents.
+    """
+    documents = [Document(**source) for source in sources]
+    return estimate_tokens(
+        format_relevant_documents(pack_documents(documents, question, token_budget))
+    )
+
+
+def run_packing_comparison(
+    test_data: pd.DataFrame,
+    concurrency: int = EVAL_CONCURRENCY,
+    rate_limit: Optional[float] = EVAL_RATE_LIMIT,
+    max_retries: int = EVAL_MAX_RETRIES,
+) -> pd.DataFrame:
+    """
+    Compare the token budgets of the documents in the prompt on the test questions.
+
+    Each question is answered once per budget of PACKING_BUDGETS, bypassing the
+    answer cache, and every answer is scored against the whole source answers
+    as in :func:`run_evaluation`, so the similarity shows what packing costs in
+    answer quality while the document tokens show what it saves.
+
+    Args:
+        test_data (pd.DataFrame): The sampled rows, with 'question'.
+        concurrency (int, optional): The number of requests in flight at once. Defaults to EVAL_CONCURRENCY.
+        rate_limit (float, optional): The maximum number of requests per second. Defaults to EVAL_RATE_LIMIT.
+        max_retries (int, optional): The number of retries of a failed request. Defaults to EVAL_MAX_RETRIES.
+
+    Returns:
+        pd.DataFrame: Per token budget, the mean document tokens, their reduction from
+        the whole documents, the answer similarity and the response time.
+    """
+    rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+    questions = list(test_data["question"])
+    with (
+        create_session(concurrency) as session,
+        ThreadPoolExecutor(concurrency) as executor,
+    ):
+        session.headers["Cache-Control"] = "no-cache"
+        responses = {
+            budget: list(
+                executor.map(
+                    lambda question: get_chatbot_response(
+                        question, session, rate_limiter, max_retries, budget
+                    ),
+                    questions,
+                )
+            )
+            for budget in PACKING_BUDGETS
+        }
+
+    results = []
+    for budget in PACKING_BUDGETS:
+        scores = score_answers(
+            [response["message"] for response, _ in responses[budget]],
+            [
+                [source["metadata"]["answer"] for source in response["sources"]]
+                for response, _ in responses[budget]
+            ],
+        )
+        tokens = [
+            document_tokens(question, response["sources"], budget)
+            for question, (response, _) in zip(questions, responses[budget])
+        ]
+        results.append(
+            {
+                "document_token_budget": budget,
+                "document_tokens": float(np.mean(tokens)),
+                "answer_similarity": float(np.mean(scores)),
+                "response_time": float(
+                    np.mean([response_time for _, response_time in responses[budget]])
+                ),
+            }
+        )
+    whole = results[0]["document_tokens"] or 1.0
+    for result in results:
+        result["token_reduction"] = 1.0 - result["document_tokens"] / whole
+    return pd.DataFrame(results)
+
+
+def encode_texts(
+    texts: List[str],
+    cache: Optional[SQLiteVectorCache] = None,
+    batch_size: int = SCORING_BATCH_SIZE,
+) -> np.ndarray:
+    """
+    Encode texts into L2-normalized embeddings, each distinct text once.
+
+    Embeddings found in the cache (keyed by a hash of the model name and the
+    text) are not recomputed, the others are encoded in batches and cached.
+
+    Args:
+        texts (List[str]): The texts to encode, possibly repeated.
+        cache (SQLiteVectorCache, optional): The persistent embedding cache.
+        batch_size (int, optional): The encoding batch size. Defaults to SCORING_BATCH_SIZE.
+
+    Returns:
+        np.ndarray: The embedding of each text, one row per text in order.
+    """
+    distinct = list(dict.fromkeys(texts))
+    keys = [
+        hashlib.sha256(f"{SCORING_MODEL_NAME}\x00{text}".encode("utf-8")).hexdigest()
+        for text in distinct
+    ]
+    cached = cache.get_many(keys) if cache is not None else {}
+    missing = [i for i, key in enumerate(keys) if key not in cached]
+    if missing:
+        encoded = model.encode(
+            [distinct[i] for i in missing],
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        ).astype(np.float32)
+        cached.update({keys[i]: vector for i, vector in zip(missing, encoded)})
+        if cache is not None:
+            cache.set_many({keys[i]: cached[keys[i]] for i in missing})
+
+    vectors = np.stack([cached[key] for key in keys]) if keys else np.zeros((0, 0))
+    rows = {text: i for i, text in enumerate(distinct)}
+    return vectors[[rows[text] for text in texts]]
+
+
+def score_answers(
+    answers: List[str],
+    source_answers: List[List[str]],
+    cache_path: Optional[str] = SCORING_CACHE_PATH,
+) -> np.ndarray:
+    """
+    Calculate the similarity of many chatbot answers with their source answers at once.
+
+    All the texts are encoded together (see :func:`encode_texts`), then every
+    cosine similarity is computed in one NumPy operation over the answers and
+    their (padded) source answers.
+
+    Args:
+        answers (List[str]): The chatbot's generated answers.
+        source_answers (List[List[str]]): The reference answers of each chatbot answer.
+        cache_path (str, optional): The embedding cache file, None to disable it. Defaults to SCORING_CACHE_PATH.
+
+    Returns:
+        np.ndarray: For each answer, the highest similarity score (0-1) with any of its
+        source answers, 0 when the answer or its sources are empty.
+    """
+    width = max((len(sources) for sources in source_answers), default=0)
+    if not answers or width == 0:
+        return np.zeros(len(answers))
+
+    texts = list(answers) + [text for sources in source_answers for text in sources]
+    if cache_path:
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        with SQLiteVectorCache(cache_path) as cache:
+            vectors = encode_texts(texts, cache)
+    else:
+        vectors = encode_texts(texts)
+
+    # Row of each source answer in `vectors`, padded to the largest number of sources
+    index = np.zeros((len(answers), width), dtype=np.int64)
+    mask = np.zeros((len(answers), width), dtype=bool)
+    offset = len(answers)
+    for i, sources in enumerate(source_answers):
+        index[i, : len(sources)] = np.arange(offset, offset + len(sources))
+        mask[i, : len(sources)] = True
+        offset += len(sources)
+
+    similarities = np.einsum("nd,nkd->nk", vectors[: len(answers)], vectors[index])
+    scores = np.where(mask, similarities, -np.inf).max(axis=1)
+    empty = np.array([not answer for answer in answers]) | ~mask.any(axis=1)
+    return np.where(empty, 0.0, scores)
 
 
 def calculate_answer_similarity(answer: str, source_answers: List[str]) -> float:
@@ -117,6 +492,7 @@ def calculate_answer_similarity(answer: str, source_answers: List[str]) -> float
     Calculate semantic similarity between chatbot answer and source answers.
 
     Uses sentence transformers to embed texts and cosine similarity for comparison.
+    To score many answers, use :func:`score_answers` instead.
 
     Args:
         answer (str): The chatbot's generated answer.
@@ -125,18 +501,7 @@ def calculate_answer_similarity(answer: str, source_answers: List[str]) -> float
     Returns:
         float: The highest similarity score (0-1) between the answer and any source answer.
     """
-    if not answer or not source_answers:
-        return 0.0
-
-    # Embed chatbot answer and source answers
-    answer_embedding = model.encode([answer])[0]
-    source_embeddings = model.encode(source_answers)
-
-    # Calculate similarities with each source answer
-    similarities = cosine_similarity([answer_embedding], source_embeddings)[0]
-
-    # Return the highest similarity score
-    return float(np.max(similarities))
+    return float(score_answers([answer], [source_answers])[0])
 
 
 def save_detailed_comparison(
@@ -166,17 +531,73 @@ def save_detailed_comparison(
         f.write(f"\nSimilarity Score: {similarity_score:.3f}\n")
 
 
-def run_evaluation() -> pd.DataFrame:
+def load_checkpoint(checkpoint_path: str) -> Dict[int, Dict]:
+    """
+    Load the samples already evaluated by an interrupted run.
+
+    Args:
+        checkpoint_path (str): The JSONL checkpoint file.
+
+    Returns:
+        Dict[int, Dict]: The result of each evaluated sample, by its row index in the dataset.
+    """
+    if not os.path.exists(checkpoint_path):
+        return {}
+    with open(checkpoint_path, encoding="utf-8") as f:
+        results = [json.loads(line) for line in f if line.strip()]
+    return {result["sample_id"]: result for result in results}
+
+
+def collect_sample(row: pd.Series, response: Dict, response_time: float) -> Dict:
+    """
+    Collect the response of the chatbot to a sample, to be scored with the others.
+
+    Args:
+        row (pd.Series): The sampled row.
+        response (Dict): The response of /chat, with 'sources' and 'message'.
+        response_time (float): The response time in seconds.
+
+    Returns:
+        Dict: The question, answers and response time of the sample.
+    """
+    return {
+        "question": row["question"],
+        "chatbot_answer": response["message"],
+        "source_answers": [
+            source["metadata"]["answer"] for source in response["sources"]
+        ],
+        "response_time": response_time,
+    }
+
+
+def run_evaluation(
+    num_samples: int = NUM_TEST_SAMPLES,
+    concurrency: int = EVAL_CONCURRENCY,
+    rate_limit: Optional[float] = EVAL_RATE_LIMIT,
+    max_retries: int = EVAL_MAX_RETRIES,
+    checkpoint_path: str = CHECKPOINT_FILE,
+) -> pd.DataFrame:
     """
     Run the complete evaluation process for the chatbot.
 
     This function:
     1. Creates necessary directories
-    2. Loads test data
-    3. Tests the chatbot on each question
-    4. Saves detailed comparisons
-    5. Calculates similarity scores
-    6. Measures response times
+    2. Loads test data, and the samples already evaluated from the checkpoint
+    3. Tests the chatbot on the other questions, `concurrency` requests at a time
+    4. Measures response times
+    5. Calculates all the similarity scores at once, see :func:`score_answers`
+    6. Saves detailed comparisons
+
+    Each sample is appended to the checkpoint as soon as its response arrives,
+    so an interrupted run resumes with the samples left. Failed requests are
+    not checkpointed, so they are retried by the next run.
+
+    Args:
+        num_samples (int, optional): The number of sampled questions. Defaults to NUM_TEST_SAMPLES.
+        concurrency (int, optional): The number of requests in flight at once. Defaults to EVAL_CONCURRENCY.
+        rate_limit (float, optional): The maximum number of requests per second. Defaults to EVAL_RATE_LIMIT.
+        max_retries (int, optional): The number of retries of a failed request. Defaults to EVAL_MAX_RETRIES.
+        checkpoint_path (str, optional): The JSONL checkpoint file. Defaults to CHECKPOINT_FILE.
 
     Returns:
         pd.DataFrame: Results containing questions, answers, similarity scores, and response times.
@@ -184,64 +605,94 @@ def run_evaluation() -> pd.DataFrame:
     # Create directories if they don't exist
     os.makedirs(RESULTS_DIR, exist_ok=True)
 
-    test_data = load_test_data()
-    results = []
+    test_data = load_test_data(num_samples)
+    results = {
+        sample_id: result
+        for sample_id, result in load_checkpoint(checkpoint_path).items()
+        if sample_id in test_data.index
+    }
+    pending = test_data[~test_data.index.isin(list(results))]
+    if results:
+        console.print(
+            f"[bold blue]Resuming: {len(results)} samples already evaluated, "
+            f"{len(pending)} left[/bold blue]"
+        )
 
     # Update file path to use results directory
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     detailed_output = os.path.join(RESULTS_DIR, f"detailed_evaluation_{timestamp}.txt")
 
-    for idx, row in test_data.iterrows():
-        console.print(
-            f"\n[bold cyan]Testing sample {idx + 1}/{len(test_data)}[/bold cyan]"
-        )
-        try:
-            response, response_time = get_chatbot_response(row["question"])
-            sources = response["sources"]
-            chatbot_answer = response["message"]
-
-            source_answers = [source["metadata"]["answer"] for source in sources]
-            answer_similarity = calculate_answer_similarity(
-                chatbot_answer, source_answers
-            )
-
-            # Save detailed comparison to file
-            save_detailed_comparison(
-                detailed_output,
+    rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+    with (
+        create_session(concurrency) as session,
+        ThreadPoolExecutor(concurrency) as executor,
+        open(checkpoint_path, "a", encoding="utf-8") as checkpoint,
+    ):
+        futures = {
+            executor.submit(
+                get_chatbot_response,
                 row["question"],
-                chatbot_answer,
-                source_answers,
-                answer_similarity,
-            )
-
-            results.append(
-                {
-                    "question": row["question"],
-                    "chatbot_answer": chatbot_answer,
-                    "source_answers": source_answers,
-                    "answer_similarity": answer_similarity,
-                    "response_time": response_time,
-                }
-            )
-
-        except Exception as e:
+                session,
+                rate_limiter,
+                max_retries,
+            ): (idx, row)
+            for idx, row in pending.iterrows()
+        }
+        for future in as_completed(futures):
+            idx, row = futures[future]
             console.print(
-                f"[bold red]Error processing sample {idx + 1}: {str(e)}[/bold red]"
+                f"\n[bold cyan]Testing sample {len(results) + 1}/{len(test_data)}[/bold cyan]"
             )
-            results.append(
-                {
+            try:
+                response, response_time = future.result()
+                results[idx] = collect_sample(row, response, response_time)
+                if response["message"]:
+                    checkpoint.write(
+                        json.dumps(
+                            {"sample_id": int(idx), **results[idx]},
+                            ensure_ascii=False,
+                        )
+                        + "\n"
+                    )
+                    checkpoint.flush()
+
+            except Exception as e:
+                console.print(
+                    f"[bold red]Error processing sample {idx}: {str(e)}[/bold red]"
+                )
+                results[idx] = {
                     "question": row["question"],
                     "chatbot_answer": "",
                     "source_answers": [],
-                    "answer_similarity": 0.0,
                     "response_time": 0.0,
                 }
-            )
+
+    # Scoring stage, over the answers of this run and of the checkpoint
+    evaluations = [results[idx] for idx in test_data.index]
+    start_time = time.perf_counter()
+    scores = score_answers(
+        [evaluation["chatbot_answer"] for evaluation in evaluations],
+        [evaluation["source_answers"] for evaluation in evaluations],
+    )
+    console.print(
+        f"\n[bold blue]Scored {len(evaluations)} samples in "
+        f"{time.perf_counter() - start_time:.2f} s[/bold blue]"
+    )
+    for evaluation, score in zip(evaluations, scores):
+        evaluation["answer_similarity"] = float(score)
+        # Save detailed comparison to file
+        save_detailed_comparison(
+            detailed_output,
+            evaluation["question"],
+            evaluation["chatbot_answer"],
+            evaluation["source_answers"],
+            evaluation["answer_similarity"],
+        )
 
     console.print(
         f"\n[bold blue]Detailed comparisons saved to: {detailed_output}[/bold blue]"
     )
-    return pd.DataFrame(results)
+    return pd.DataFrame(evaluations)
 
 
 def display_results(results: pd.DataFrame) -> None:
@@ -266,27 +717,132 @@ def display_results(results: pd.DataFrame) -> None:
     console.print(table)
 
 
+def display_retrieval_results(results: pd.DataFrame) -> None:
+    """
+    Display the comparison of the retrieval modes in a formatted table using Rich.
+
+    Args:
+        results (pd.DataFrame): DataFrame returned by `run_retrieval_comparison`.
+    """
+    table = Table(title="Retrieval Comparison")
+    table.add_column("Retrieval Mode")
+    for column in ["Recall@4", "MRR", "Response Time"]:
+        table.add_column(column, justify="right")
+    for _, row in results.iterrows():
+        table.add_row(
+            row["retrieval_mode"],
+            f"{row['recall']:.3f}",
+            f"{row['mrr']:.3f}",
+            f"{row['response_time']:.3f}",
+        )
+    console.print(table)
+
+
+def display_packing_results(results: pd.DataFrame) -> None:
+    """
+    Display the comparison of the document token budgets in a formatted table using Rich.
+
+    Args:
+        results (pd.DataFrame): DataFrame returned by `run_packing_comparison`.
+    """
+    table = Table(title="Document Packing Comparison")
+    for column in [
+        "Token Budget",
+        "Document Tokens",
+        "Reduction",
+        "Answer Similarity",
+        "Response Time",
+    ]:
+        table.add_column(column, justify="right")
+    for _, row in results.iterrows():
+        table.add_row(
+            str(int(row["document_token_budget"]) or "whole"),
+            f"{row['document_tokens']:.0f}",
+            f"{row['token_reduction']:.1%}",
+            f"{row['answer_similarity']:.3f}",
+            f"{row['response_time']:.3f}",
+        )
+    console.print(table)
+
+
 def main():
     """
     Main execution function for the evaluation system.
 
+    The number of samples, the concurrency, the rate limit and the retries
+    are set on the command line; rerun with the same options to resume an
+    interrupted run from its checkpoint.
+
     This function:
     1. Runs the evaluation
     2. Displays results in the terminal
-    3. Saves detailed results to JSON and text files
+    3. Compares the vector and hybrid retrieval modes, with --compare-retrieval
+    4. Compares the token budgets of the documents in the prompt, with --compare-packing
+    5. Saves detailed results to JSON and text files
+
+    The comparisons send every question again, once per mode or budget, so they
+    are off by default.
 
     The results are saved in two formats:
     - A JSON file containing structured results and metadata
     - A text file with detailed comparisons
     """
+    parser = argparse.ArgumentParser(description="Evaluate the chatbot on MedQuAD.")
+    parser.add_argument("--samples", type=int, default=NUM_TEST_SAMPLES)
+    parser.add_argument("--concurrency", type=int, default=EVAL_CONCURRENCY)
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=EVAL_RATE_LIMIT,
+        help="Maximum number of requests per second.",
+    )
+    parser.add_argument("--max-retries", type=int, default=EVAL_MAX_RETRIES)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE)
+    parser.add_argument(
+        "--compare-retrieval",
+        action="store_true",
+        help="Also compare the vector and hybrid retrieval modes.",
+    )
+    parser.add_argument(
+        "--compare-packing",
+        action="store_true",
+        help="Also compare the document token budgets of PACKING_BUDGETS.",
+    )
+    args = parser.parse_args()
+
     console.print("[bold green]Starting chatbot evaluation...[/bold green]")
 
     # Run evaluation
-    results = run_evaluation()
+    results = run_evaluation(
+        args.samples,
+        args.concurrency,
+        args.rate_limit,
+        args.max_retries,
+        args.checkpoint,
+    )
 
     # Display results
     display_results(results)
 
+    # Compare the retrieval modes on the same questions
+    retrieval_results = pd.DataFrame()
+    if args.compare_retrieval:
+        retrieval_results = run_retrieval_comparison(
+            load_test_data(args.samples), args.concurrency, args.rate_limit
+        )
+        display_retrieval_results(retrieval_results)
+
+    # Compare the prompt tokens and the answers across document token budgets
+    packing_results = pd.DataFrame()
+    if args.compare_packing:
+        packing_results = run_packing_comparison(
+            load_test_data(args.samples),
+            args.concurrency,
+            args.rate_limit,
+            args.max_retries,
+        )
+        display_packing_results(packing_results)
+
     # Save detailed results in JSON format with updated path
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     output_file = os.path.join(RESULTS_DIR, f"evaluation_results_{timestamp}.json")
@@ -295,12 +851,15 @@ def main():
     results_dict = {
         "metadata": {
             "timestamp": timestamp,
-            "num_samples": NUM_TEST_SAMPLES,
+            "num_samples": args.samples,
+            "concurrency": args.concurrency,
             "mean_scores": {
                 "answer_similarity": float(results["answer_similarity"].mean()),
                 "response_time": float(results["response_time"].mean()),
             },
         },
+        "retrieval": retrieval_results.to_dict(orient="records"),
+        "packing": packing_results.to_dict(orient="records"),
         "evaluations": [],
     }
 
@@ -0,0 +1,312 @@
+"""Parallel, validated downloads from Google Cloud Storage and a cached bucket listing.
+
+The client honours the STORAGE_EMULATOR_HOST environment variable, so everything
+here also runs against a local fake GCS (e.g. fake-gcs-server).
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import os
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Optional
+from medichat.cache import LRUCache
+from medichat.config import GCS_CHUNK_SIZE, GCS_DOWNLOAD_WORKERS, GCS_LISTING_TTL
+
+# Type hints only: the storage SDK is imported by the callers creating the client
+if TYPE_CHECKING:
+    from google.cloud import storage
+    from google.cloud.storage.blob import Blob
+
+MANIFEST_FILE_NAME = ".gcs_manifest.json"
+
+
+def file_checksums(path: str, chunk_size: int = 1024 * 1024) -> dict[str, str]:
+    """
+    Compute the MD5 and CRC32C of a local file, base64 encoded as in the GCS object metadata.
+
+    The CRC32C needs the google-crc32c package (installed with google-cloud-storage);
+    without it, only the MD5 is computed.
+
+    Args:
+        path (str): The path of the local file.
+        chunk_size (int, optional): The number of bytes read at a time. Defaults to 1 MiB.
+
+    Returns:
+        dict[str, Optional[str]]: The 'md5_hash' and 'crc32c' (None without google-crc32c) of the file.
+    """
+    try:
+        import google_crc32c
+
+        crc32c = google_crc32c.Checksum()
+    except ImportError:
+        crc32c = None
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        while data := f.read(chunk_size):
+            md5.update(data)
+            if crc32c is not None:
+                crc32c.update(data)
+    return {
+        "md5_hash": base64.b64encode(md5.digest()).decode(),
+        "crc32c": base64.b64encode(crc32c.digest()).decode() if crc32c else None,
+    }
+
+
+class DownloadManifest:
+    """
+    Sidecar file recording the generation and checksums of the downloaded blobs.
+
+    Example:
+        manifest = DownloadManifest("./downloaded_files")
+        manifest.record(blob, "./downloaded_files/medquad.csv")
+        manifest.save()
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.path = os.path.join(directory, MANIFEST_FILE_NAME)
+        self.entries: dict[str, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def is_current(self, blob: Blob, local_path: str) -> bool:
+        """
+        Tell whether the local copy of a blob is identical to the blob.
+
+        The recorded generation and size are checked first, which needs no
+        read of the file; otherwise the checksums of the local file are compared
+        with the MD5 of the blob, or its CRC32C for composite objects (which are
+        downloaded again when google-crc32c is not installed).
+
+        Args:
+            blob (Blob): The blob, with its metadata loaded.
+            local_path (str): The path of the local copy.
+
+        Returns:
+            bool: True if the local file can be kept.
+        """
+        if not os.path.exists(local_path):
+            return False
+        entry = self.entries.get(blob.name, {})
+        if (
+            entry.get("generation") == blob.generation
+            and entry.get("size") == os.path.getsize(local_path)
+            and blob.generation is not None
+        ):
+            return True
+        if blob.size is not None and blob.size != os.path.getsize(local_path):
+            return False
+        checksums = file_checksums(local_path)
+        if blob.md5_hash:
+            return checksums["md5_hash"] == blob.md5_hash
+        return bool(blob.crc32c and checksums["crc32c"]) and (
+            checksums["crc32c"] == blob.crc32c
+        )
+
+    def record(self, blob: Blob, local_path: str) -> None:
+        """
+        Record the generation and checksums of a downloaded blob.
+
+        Args:
+            blob (Blob): The downloaded blob.
+            local_path (str): The path of the local copy.
+        """
+        with self._lock:
+            self.entries[blob.name] = {
+                "generation": blob.generation,
+                "size": os.path.getsize(local_path),
+                "md5_hash": blob.md5_hash,
+                "crc32c": blob.crc32c,
+            }
+
+    def save(self) -> None:
+        """
+        Write the manifest atomically.
+        """
+        with self._lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+def download_blob(
+    blob: Blob,
+    download_directory_path: str,
+    manifest: Optional[DownloadManifest] = None,
+    chunk_size: int = GCS_CHUNK_SIZE,
+    local_name: Optional[str] = None,
+) -> tuple[str, bool]:
+    """
+    Download a blob unless an identical copy is already in the directory.
+
+    The blob is streamed in chunks of `chunk_size` bytes to a temporary file,
+    checked against the checksums of the blob, and moved over the local copy
+    once complete, so an interrupted download never leaves a truncated file behind.
+
+    Args:
+        blob (Blob): The blob, with its metadata loaded (e.g. from `list_blobs` or `get_blob`).
+        download_directory_path (str): The local directory to download to.
+        manifest (DownloadManifest, optional): The manifest of the directory, saved by the caller. Defaults to the one on disk, saved after the download.
+        chunk_size (int, optional): The size of the downloaded chunks, in bytes. Defaults to GCS_CHUNK_SIZE.
+        local_name (str, optional): The path of the local file, relative to the directory. Defaults to the basename of the blob.
+
+    Returns:
+        tuple[str, bool]: The local file path, and whether the blob was downloaded.
+
+    Raises:
+        ValueError: If `local_name` is outside of the directory, or the downloaded file does not match the checksums of the blob.
+
+    Example:
+        local_path, downloaded = download_blob(bucket.get_blob("data/medquad.csv"), "./downloaded_files")
+    """
+    if manifest is None:
+        manifest = DownloadManifest(download_directory_path)
+        result = download_blob(
+            blob, download_directory_path, manifest, chunk_size, local_name
+        )
+        manifest.save()
+        return result
+    local_name = os.path.normpath(local_name or os.path.basename(blob.name))
+    if os.path.isabs(local_name) or local_name.split(os.sep)[0] == os.pardir:
+        raise ValueError(f"'{blob.name}' would be written outside of the directory")
+    local_filepath = os.path.join(download_directory_path, local_name)
+    if manifest.is_current(blob, local_filepath):
+        manifest.record(blob, local_filepath)
+        return local_filepath, False
+
+    os.makedirs(os.path.dirname(local_filepath), exist_ok=True)
+    blob.chunk_size = chunk_size
+    tmp_filepath = f"{local_filepath}.part"
+    try:
+        # Chunked downloads are not validated by the client, so check the whole file once
+        blob.download_to_filename(tmp_filepath, checksum=None)
+        checksums = file_checksums(tmp_filepath)
+        if (blob.md5_hash and checksums["md5_hash"] != blob.md5_hash) or (
+            blob.crc32c and checksums["crc32c"] and checksums["crc32c"] != blob.crc32c
+        ):
+            raise ValueError(f"Checksum mismatch for '{blob.name}'")
+    except Exception:
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+        raise
+    os.replace(tmp_filepath, local_filepath)
+    manifest.record(blob, local_filepath)
+    return local_filepath, True
+
+
+def sync_bucket(
+    client: storage.Client,
+    bucket_name: str,
+    download_directory_path: str,
+    directory_name: str = "data/",
+    max_workers: int = GCS_DOWNLOAD_WORKERS,
+    chunk_size: int = GCS_CHUNK_SIZE,
+) -> dict[str, list[str]]:
+    """
+    Download the blobs of a bucket directory concurrently, skipping the ones already up to date.
+
+    Each blob keeps its path relative to the bucket directory, so that blobs with
+    the same name in different subdirectories do not overwrite each other.
+
+    Args:
+        client (storage.Client): The Google Cloud Storage client.
+        bucket_name (str): The name of the bucket.
+        download_directory_path (str): The local directory to download to.
+        directory_name (str, optional): The directory within the bucket. Defaults to 'data/'.
+        max_workers (int, optional): The number of concurrent downloads. Defaults to GCS_DOWNLOAD_WORKERS.
+        chunk_size (int, optional): The size of the downloaded chunks, in bytes. Defaults to GCS_CHUNK_SIZE.
+
+    Returns:
+        dict[str, list[str]]: The blob names 'downloaded', 'skipped' (already up to date) and 'failed'.
+
+    Example:
+        report = sync_bucket(storage.Client(), BUCKET_NAME, "./downloaded_files")
+    """
+    from google.cloud.exceptions import GoogleCloudError
+
+    os.makedirs(download_directory_path, exist_ok=True)
+    manifest = DownloadManifest(download_directory_path)
+    blobs = [
+        blob
+        for blob in client.bucket(bucket_name).list_blobs(prefix=directory_name)
+        if not blob.name.endswith("/")
+    ]
+    report = {"downloaded": [], "skipped": [], "failed": []}
+
+    def _download(blob: Blob) -> None:
+        try:
+            _, downloaded = download_blob(
+                blob,
+                download_directory_path,
+                manifest,
+                chunk_size,
+                posixpath.relpath(blob.name, directory_name or "."),
+            )
+            report["downloaded" if downloaded else "skipped"].append(blob.name)
+        except (GoogleCloudError, ValueError) as e:
+            print(f"Error downloading '{blob.name}': {e}")
+            report["failed"].append(blob.name)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(_download, blobs))
+    manifest.save()
+    return report
+
+
+class BucketListing:
+    """
+    Bucket listing cached for a time to live, so that listing files does not call GCS on every request.
+
+    Example:
+        listing = BucketListing(storage.Client(), BUCKET_NAME)
+        files = listing.get()
+    """
+
+    def __init__(
+        self,
+        client: storage.Client,
+        bucket_name: str,
+        ttl: Optional[float] = GCS_LISTING_TTL,
+    ) -> None:
+        self.client = client
+        self.bucket_name = bucket_name
+        self._listings = LRUCache(maxsize=32, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, directory_name: str = "data/") -> list[str]:
+        """
+        Return the names of the blobs of a bucket directory, listing the bucket when the cached listing expired.
+
+        Args:
+            directory_name (str, optional): The directory within the bucket. Defaults to 'data/'.
+
+        Returns:
+            list[str]: The blob names.
+        """
+        names = self._listings.get(directory_name)
+        if names is None:
+            # One listing call at a time, the other requests wait for its result
+            with self._lock:
+                names = self._listings.get(directory_name)
+                if names is None:
+                    names = [
+                        blob.name
+                        for blob in self.client.bucket(self.bucket_name).list_blobs(
+                            prefix=directory_name
+                        )
+                    ]
+                    self._listings.set(directory_name, names)
+        return list(names)
+
+    def invalidate(self) -> None:
+        """
+        Drop the cached listings, e.g. after uploading files.
+        """
+        self._listings.clear()
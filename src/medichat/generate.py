@@ -0,0 +1,92 @@
+"""Prompt and LLM clients used to generate the answers of the chatbot."""
+
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import TYPE_CHECKING
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable
+from medichat.config import LLM_POOL_SIZE
+
+# The Gemini SDK is imported with the first client (or preloaded by the API lifespan)
+if TYPE_CHECKING:
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+SYSTEM_PROMPT = """DOCUMENT:
+{formatted_docs}
+
+PREVIOUS CONTEXT:
+{previous_context}
+
+LAST DISCUSSED ENTITY:
+{last_entity}
+
+INSTRUCTIONS:
+0. You are a knowledgeable medical professional.
+1. You answer questions using ONLY the provided DOCUMENT.
+2. If the QUESTION is in an other language, translate it first to english.
+3. In the DOCUMENT, you can find the ANSWER to the question, the SOURCE of the ANSWER, as well as the FOCUS AREA.
+4. Answer in {language} the QUESTION using the provided DOCUMENT text above.
+5. Keep your answer grounded in the facts from the DOCUMENT only.
+6. Be somewhat concise but retain all relevant information and details.
+7. If the question refers to "it" or any other ambiguous term, refer to the LAST DISCUSSED ENTITY unless further clarification is provided in the QUESTION.
+8. Use the PREVIOUS CONTEXT only if it provides additional clarity or information that directly supports answering the QUESTION.
+
+QUESTION:
+{question}
+"""
+
+PROMPT_MESSAGES = [
+    ("system", SYSTEM_PROMPT),
+    ("human", "The query is: {question}"),
+]
+
+# Parsed once at import: per request, only the variables are bound
+PROMPT = ChatPromptTemplate.from_messages(messages=PROMPT_MESSAGES)
+
+
+@lru_cache(maxsize=LLM_POOL_SIZE)
+def get_llm(model: str, temperature: float) -> ChatGoogleGenerativeAI:
+    """
+    Return the long-lived LLM client of a model and temperature, creating it on first use.
+
+    Clients keep their HTTP/gRPC connections open, so reusing them across
+    requests avoids a new connection setup on every answer.
+
+    Args:
+        model (str): The name of the Gemini model, e.g. 'gemini-1.5-pro'.
+        temperature (float): The sampling temperature of the model.
+
+    Returns:
+        ChatGoogleGenerativeAI: The shared LLM client.
+
+    Example:
+        llm = get_llm("gemini-1.5-pro", 0.2)
+    """
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(
+        model=model,
+        temperature=temperature,
+        max_tokens=None,
+        timeout=None,
+        max_retries=2,
+    )
+
+
+@lru_cache(maxsize=LLM_POOL_SIZE)
+def get_chain(model: str, temperature: float) -> Runnable:
+    """
+    Return the shared prompt | LLM chain of a model and temperature.
+
+    Args:
+        model (str): The name of the Gemini model, e.g. 'gemini-1.5-pro'.
+        temperature (float): The sampling temperature of the model.
+
+    Returns:
+        Runnable: The chain taking the prompt variables and returning the model message.
+
+    Example:
+        answer = await get_chain("gemini-1.5-pro", 0.2).ainvoke(variables)
+    """
+    return PROMPT | get_llm(model, temperature)
@@ -1,19 +1,61 @@
+"""Ingestion of the MedQuAD dataset into Cloud SQL, and the vector store helpers of the API.
+
+The Cloud SQL, Vertex AI and Cloud Storage SDKs (and pandas) are imported by the
+functions using them, so that importing this module stays fast: the API can
+start serving its health checks while its clients are created.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
 import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Iterator, Optional
 from dotenv import load_dotenv
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from sqlalchemy import text
 from sqlalchemy.exc import ProgrammingError
-from google.cloud import storage
-from google.cloud.storage.bucket import Bucket
-from langchain_google_cloud_sql_pg import PostgresEngine, PostgresVectorStore
-from langchain_google_vertexai import VertexAIEmbeddings
-from google.cloud.exceptions import NotFound
-from google.cloud.exceptions import GoogleCloudError
+
+from medichat.gcs import download_blob, sync_bucket
+from medichat.local_store import LocalVectorStore
 
 # Non sensitive information goes in config
-from medichat.config import PROJECT_ID, REGION, INSTANCE, DATABASE, DB_USER
+from medichat.config import (
+    PROJECT_ID,
+    REGION,
+    INSTANCE,
+    DATABASE,
+    DB_USER,
+    TABLE_NAME,
+    BUCKET_NAME,
+    EMBEDDING_COLUMN,
+    CONTENT_HASH_COLUMN,
+    FILTER_COLUMNS,
+    METADATA_COLUMNS,
+    VECTOR_INDEX_TYPE,
+    HNSW_M,
+    HNSW_EF_CONSTRUCTION,
+    IVFFLAT_LISTS,
+    HNSW_EF_SEARCH,
+    IVFFLAT_PROBES,
+)
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from google.cloud import storage
+    from google.cloud.storage.bucket import Bucket
+    from langchain_google_cloud_sql_pg import PostgresEngine, PostgresVectorStore
+    from langchain_google_cloud_sql_pg.indexes import BaseIndex, QueryOptions
+    from langchain_google_vertexai import VertexAIEmbeddings
 
 load_dotenv()
-# Sensitive information goes in .env
-DB_PASSWORD = os.environ["DB_PASSWORD"]
 
 DOWNLOADED_LOCAL_DIRECTORY = "./downloaded_files"
 
@@ -43,6 +85,9 @@ def download_file_from_bucket(
     """
     Downloads a file from a Google Cloud Storage bucket to a local directory.
 
+    The download is skipped when the local copy is identical to the blob (same
+    generation, or same MD5/CRC32C), see :func:`medichat.gcs.download_blob`.
+
     Args:
         bucket (Bucket): The Google Cloud Storage bucket object.
         file_path (str): The path to the file within the bucket.
@@ -58,20 +103,43 @@ def download_file_from_bucket(
     Example:
         local_path = download_file_from_bucket(bucket, 'path/to/file.txt', '/local/download/directory')
     """
+    from google.cloud.exceptions import GoogleCloudError, NotFound
+
     try:
-        blob = bucket.blob(file_path)
+        blob = bucket.get_blob(file_path)
+        if blob is None:
+            raise NotFound(file_path)
         local_file_name = os.path.basename(file_path)
-        local_filepath = os.path.join(download_directory_path, local_file_name)
         try:
-            blob.download_to_filename(local_filepath)
-            print(f"Downloaded '{file_path}' to '{local_file_name}'")
+            local_filepath, downloaded = download_blob(blob, download_directory_path)
+            if downloaded:
+                print(f"Downloaded '{file_path}' to '{local_file_name}'")
+            else:
+                print(f"'{local_file_name}' is up to date")
             return local_filepath
-        except GoogleCloudError:
+        except (GoogleCloudError, ValueError):
             print("Error during download process")
     except NotFound:
         print("Error: File does not exist in the bucket")
 
 
+def get_db_password() -> str:
+    """
+    Read the database password from the environment (or the .env file).
+
+    It is read when a connection is opened rather than at import, so that the
+    module can be imported, and the API can start, without it.
+
+    Returns:
+        str: The DB_PASSWORD environment variable.
+
+    Raises:
+        KeyError: If DB_PASSWORD is not set.
+    """
+    # Sensitive information goes in .env
+    return os.environ["DB_PASSWORD"]
+
+
 def create_cloud_sql_database_connection() -> PostgresEngine:
     """
     Establishes a connection to a Cloud SQL PostgreSQL database instance.
@@ -85,6 +153,7 @@ def create_cloud_sql_database_connection() -> PostgresEngine:
     Example:
         connection = create_cloud_sql_database_connection()
     """
+    from langchain_google_cloud_sql_pg import PostgresEngine
 
     engine = PostgresEngine.from_instance(
         project_id=PROJECT_ID,
@@ -92,7 +161,34 @@ def create_cloud_sql_database_connection() -> PostgresEngine:
         region=REGION,
         database=DATABASE,
         user=DB_USER,
-        password=DB_PASSWORD,
+        password=get_db_password(),
+    )
+
+    return engine
+
+
+async def acreate_cloud_sql_database_connection() -> PostgresEngine:
+    """
+    Establishes an async connection to a Cloud SQL PostgreSQL database instance.
+
+    The engine runs on the caller's event loop instead of a background thread,
+    so it must be created from the loop that will use it (e.g. the API lifespan).
+
+    Returns:
+        PostgresEngine: An instance of PostgresEngine connected to the specified Cloud SQL database.
+
+    Example:
+        engine = await acreate_cloud_sql_database_connection()
+    """
+    from langchain_google_cloud_sql_pg import PostgresEngine
+
+    engine = await PostgresEngine.afrom_instance(
+        project_id=PROJECT_ID,
+        instance=INSTANCE,
+        region=REGION,
+        database=DATABASE,
+        user=DB_USER,
+        password=get_db_password(),
     )
 
     return engine
@@ -106,6 +202,10 @@ async def create_table_if_not_exists(table_name: str, engine: PostgresEngine) ->
     table name and a vector size of 768, which is suitable for the VertexAI model
     (textembedding-gecko@latest). If the table already exists, it catches the
     ProgrammingError and prints a message indicating that the table is already created.
+    In both cases, the indexed content hash column used by incremental re-ingestion
+    and the indexed metadata columns used by retrieval filters (FILTER_COLUMNS) are
+    added if they are missing, and the metadata columns are backfilled from the
+    JSON metadata of existing rows.
 
     Args:
         table_name (str): The name of the table to be created.
@@ -114,13 +214,32 @@ async def create_table_if_not_exists(table_name: str, engine: PostgresEngine) ->
     Raises:
         ProgrammingError: If the table already exists.
     """
+    from langchain_google_cloud_sql_pg import Column
+
     try:
-        await engine.init_vectorstore_table(
+        await engine.ainit_vectorstore_table(
             table_name=table_name,
             vector_size=768,
+            metadata_columns=[Column(column, "TEXT") for column in METADATA_COLUMNS],
         )
     except ProgrammingError:
         print("Table already created")
+    for column in METADATA_COLUMNS:
+        await aexecute(
+            engine,
+            f'ALTER TABLE "{table_name}" ADD COLUMN IF NOT EXISTS {column} TEXT',
+        )
+        if column in FILTER_COLUMNS:
+            await aexecute(
+                engine,
+                f"UPDATE \"{table_name}\" SET {column} = langchain_metadata->>'{column}' "
+                f"WHERE {column} IS NULL AND langchain_metadata->>'{column}' IS NOT NULL",
+            )
+        await aexecute(
+            engine,
+            f'CREATE INDEX IF NOT EXISTS "{table_name}_{column}_idx" '
+            f'ON "{table_name}" ({column})',
+        )
 
 
 def get_embeddings() -> VertexAIEmbeddings:
@@ -133,6 +252,8 @@ def get_embeddings() -> VertexAIEmbeddings:
     Example:
         embeddings = get_embeddings()
     """
+    from langchain_google_vertexai import VertexAIEmbeddings
+
     embeddings = VertexAIEmbeddings(
         model_name="textembedding-gecko@latest", project=PROJECT_ID
     )
@@ -140,15 +261,22 @@ def get_embeddings() -> VertexAIEmbeddings:
 
 
 def get_vector_store(
-    engine: PostgresEngine, table_name: str, embedding: VertexAIEmbeddings
+    engine: PostgresEngine,
+    table_name: str,
+    embedding: VertexAIEmbeddings,
+    query_options: Optional[QueryOptions] = None,
 ) -> PostgresVectorStore:
     """
     Retrieves the vector store from the specified database engine.
 
+    The METADATA_COLUMNS are read into the metadata of the results, so that
+    their stored embeddings can be looked up by content hash.
+
     Args:
         engine (PostgresEngine): The database engine to retrieve the vector store from.
         table_name (str): The name of the table to retrieve the vector store from.
         embedding (VertexAIEmbeddings): The VertexAIEmbeddings instance to use for the vector store.
+        query_options (QueryOptions, optional): The index search parameters set before each search, see :func:`search_options`.
 
     Returns:
         VectorStore: The vector store object.
@@ -156,9 +284,1064 @@ def get_vector_store(
     Example:
         vector_store = get_vector_store(engine, 'my_table', embedding)
     """
+    from langchain_google_cloud_sql_pg import PostgresVectorStore
+
     vector_store = PostgresVectorStore.create_sync(  # Use .create() to initialize an async vector store
         engine=engine,
         table_name=table_name,
         embedding_service=embedding,
+        metadata_columns=METADATA_COLUMNS,
+        index_query_options=query_options,
+    )
+    return vector_store
+
+
+async def aget_vector_store(
+    engine: PostgresEngine,
+    table_name: str,
+    embedding: VertexAIEmbeddings,
+    query_options: Optional[QueryOptions] = None,
+) -> PostgresVectorStore:
+    """
+    Async version of :func:`get_vector_store`.
+
+    Args:
+        engine (PostgresEngine): The database engine to retrieve the vector store from.
+        table_name (str): The name of the table to retrieve the vector store from.
+        embedding (VertexAIEmbeddings): The VertexAIEmbeddings instance to use for the vector store.
+        query_options (QueryOptions, optional): The index search parameters set before each search, see :func:`search_options`.
+
+    Returns:
+        VectorStore: The vector store object.
+
+    Example:
+        vector_store = await aget_vector_store(engine, 'my_table', embedding)
+    """
+    from langchain_google_cloud_sql_pg import PostgresVectorStore
+
+    vector_store = await PostgresVectorStore.create(
+        engine=engine,
+        table_name=table_name,
+        embedding_service=embedding,
+        metadata_columns=METADATA_COLUMNS,
+        index_query_options=query_options,
     )
     return vector_store
+
+
+async def aexecute(
+    engine: PostgresEngine,
+    query: str,
+    params: Optional[dict] = None,
+    autocommit: bool = False,
+) -> list[dict[str, Any]]:
+    """
+    Run a raw SQL statement on the engine's connection pool.
+
+    Args:
+        engine (PostgresEngine): The database engine to run the statement on.
+        query (str): The SQL statement, with `:name` style bind parameters.
+        params (dict, optional): The bind parameters of the statement.
+        autocommit (bool, optional): Run outside a transaction, as needed by CREATE INDEX CONCURRENTLY. Defaults to False.
+
+    Returns:
+        list[dict[str, Any]]: The returned rows as dictionaries, empty if the statement returns no rows.
+
+    Example:
+        rows = await aexecute(engine, "SELECT to_regclass(:table) AS oid", {"table": "my_table"})
+    """
+
+    async def _run() -> list[dict[str, Any]]:
+        async with engine._pool.connect() as conn:
+            if autocommit:
+                conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            result = await conn.execute(text(query), params or {})
+            rows = (
+                [dict(row) for row in result.mappings()] if result.returns_rows else []
+            )
+            await conn.commit()
+        return rows
+
+    return await engine._run_as_async(_run())
+
+
+@dataclass
+class IVFFlatProbes:
+    """
+    IVFFlat search parameters, setting `ivfflat.probes` (the upstream IVFFlatQueryOptions misspells the setting).
+
+    The vector store only calls `to_string`, so this does not subclass
+    QueryOptions and does not import the Cloud SQL SDK with this module.
+    """
+
+    probes: int = IVFFLAT_PROBES
+
+    def to_string(self) -> str:
+        return f"ivfflat.probes = {self.probes}"
+
+
+def vector_index(
+    index_type: str = VECTOR_INDEX_TYPE,
+    m: int = HNSW_M,
+    ef_construction: int = HNSW_EF_CONSTRUCTION,
+    lists: int = 100,
+) -> BaseIndex:
+    """
+    Describe an approximate nearest neighbor index on the embedding column, for cosine distance.
+
+    Args:
+        index_type (str, optional): 'hnsw' or 'ivfflat'. Defaults to VECTOR_INDEX_TYPE.
+        m (int, optional): HNSW: the number of links per node. Defaults to HNSW_M.
+        ef_construction (int, optional): HNSW: the candidate list size while building. Defaults to HNSW_EF_CONSTRUCTION.
+        lists (int, optional): IVFFlat: the number of clusters. Defaults to 100.
+
+    Returns:
+        BaseIndex: The index definition.
+
+    Raises:
+        ValueError: If the index type is unknown.
+    """
+    from langchain_google_cloud_sql_pg.indexes import HNSWIndex, IVFFlatIndex
+
+    if index_type == "hnsw":
+        return HNSWIndex(m=m, ef_construction=ef_construction)
+    if index_type == "ivfflat":
+        return IVFFlatIndex(lists=lists)
+    raise ValueError(f"Unknown vector index type: {index_type}")
+
+
+def search_options(
+    index_type: str = VECTOR_INDEX_TYPE, breadth: Optional[int] = None
+) -> QueryOptions:
+    """
+    Build the per-query search parameters of an index.
+
+    Args:
+        index_type (str, optional): 'hnsw' or 'ivfflat'. Defaults to VECTOR_INDEX_TYPE.
+        breadth (int, optional): hnsw.ef_search or ivfflat.probes. Defaults to HNSW_EF_SEARCH or IVFFLAT_PROBES.
+
+    Returns:
+        QueryOptions: The options set with SET LOCAL before each search.
+
+    Raises:
+        ValueError: If the index type is unknown.
+
+    Example:
+        vector_store = await registry.aget(TABLE_NAME, embedding, search_options("hnsw", 100))
+    """
+    from langchain_google_cloud_sql_pg.indexes import HNSWQueryOptions
+
+    if index_type == "hnsw":
+        return HNSWQueryOptions(ef_search=breadth or HNSW_EF_SEARCH)
+    if index_type == "ivfflat":
+        return IVFFlatProbes(probes=breadth or IVFFLAT_PROBES)
+    raise ValueError(f"Unknown vector index type: {index_type}")
+
+
+def vector_index_name(table_name: str) -> str:
+    """
+    Name of the vector index of a table, as expected by PostgresVectorStore.
+
+    Args:
+        table_name (str): The name of the vector store table.
+
+    Returns:
+        str: The index name.
+    """
+    from langchain_google_cloud_sql_pg.indexes import DEFAULT_INDEX_NAME_SUFFIX
+
+    return table_name + DEFAULT_INDEX_NAME_SUFFIX
+
+
+async def acreate_vector_index(
+    engine: PostgresEngine,
+    table_name: str,
+    index_type: str = VECTOR_INDEX_TYPE,
+    m: int = HNSW_M,
+    ef_construction: int = HNSW_EF_CONSTRUCTION,
+    lists: Optional[int] = IVFFLAT_LISTS,
+    concurrently: bool = True,
+) -> bool:
+    """
+    Create the vector index of a table, unless it already exists.
+
+    IVFFlat clusters are computed from the rows present when the index is
+    built, so build it after ingestion, and rebuild it after large changes.
+
+    Args:
+        engine (PostgresEngine): The database engine.
+        table_name (str): The name of the vector store table.
+        index_type (str, optional): 'hnsw' or 'ivfflat'. Defaults to VECTOR_INDEX_TYPE.
+        m (int, optional): HNSW: the number of links per node. Defaults to HNSW_M.
+        ef_construction (int, optional): HNSW: the candidate list size while building. Defaults to HNSW_EF_CONSTRUCTION.
+        lists (int, optional): IVFFlat: the number of clusters. Defaults to one per 1000 rows.
+        concurrently (bool, optional): Build without locking writes to the table. Defaults to True.
+
+    Returns:
+        bool: True if the index was created, False if it already existed.
+
+    Example:
+        await acreate_vector_index(engine, TABLE_NAME, "hnsw", m=16, ef_construction=64)
+    """
+    name = vector_index_name(table_name)
+    rows = await aexecute(
+        engine, "SELECT to_regclass(:name) IS NOT NULL AS present", {"name": name}
+    )
+    if rows[0]["present"]:
+        print("Vector index already created")
+        return False
+    if index_type == "ivfflat" and lists is None:
+        rows = await aexecute(engine, f'SELECT COUNT(*) AS count FROM "{table_name}"')
+        lists = max(1, rows[0]["count"] // 1000)
+    index = vector_index(index_type, m, ef_construction, lists or 100)
+    await aexecute(
+        engine,
+        f"CREATE INDEX {'CONCURRENTLY' if concurrently else ''} IF NOT EXISTS {name} "
+        f'ON "{table_name}" USING {index.index_type} '
+        f"({EMBEDDING_COLUMN} {index.distance_strategy.index_function}) "
+        f"WITH {index.index_options()}",
+        autocommit=True,
+    )
+    return True
+
+
+async def arebuild_vector_index(
+    engine: PostgresEngine, table_name: str, concurrently: bool = True
+) -> None:
+    """
+    Rebuild the vector index of a table, e.g. to recompute IVFFlat clusters after a large ingestion.
+
+    Args:
+        engine (PostgresEngine): The database engine.
+        table_name (str): The name of the vector store table.
+        concurrently (bool, optional): Rebuild without locking writes to the table. Defaults to True.
+    """
+    await aexecute(
+        engine,
+        f"REINDEX INDEX {'CONCURRENTLY' if concurrently else ''} {vector_index_name(table_name)}",
+        autocommit=True,
+    )
+
+
+async def adrop_vector_index(
+    engine: PostgresEngine, table_name: str, concurrently: bool = True
+) -> None:
+    """
+    Drop the vector index of a table, so that searches are exact again.
+
+    Args:
+        engine (PostgresEngine): The database engine.
+        table_name (str): The name of the vector store table.
+        concurrently (bool, optional): Drop without locking the table. Defaults to True.
+    """
+    await aexecute(
+        engine,
+        f"DROP INDEX {'CONCURRENTLY' if concurrently else ''} IF EXISTS {vector_index_name(table_name)}",
+        autocommit=True,
+    )
+
+
+class VectorStoreRegistry:
+    """
+    Per-worker cache of vector stores, keyed by table name, embedding model and index search parameters.
+
+    Building a PostgresVectorStore checks the table and its columns against Cloud SQL,
+    so each store is built once (at API startup) and then shared by every request.
+
+    Example:
+        registry = VectorStoreRegistry(engine)
+        vector_store = registry.get("my_table", embedding)
+    """
+
+    def __init__(self, engine: PostgresEngine) -> None:
+        self.engine = engine
+        self._stores: dict[tuple[str, str, str], PostgresVectorStore] = {}
+        self._lock = threading.Lock()
+        self._alock = asyncio.Lock()
+
+    @staticmethod
+    def key(
+        table_name: str,
+        embedding: VertexAIEmbeddings,
+        query_options: Optional[QueryOptions] = None,
+    ) -> tuple[str, str, str]:
+        """
+        Build the registry key of a vector store.
+
+        Args:
+            table_name (str): The name of the table backing the vector store.
+            embedding (VertexAIEmbeddings): The embedding service of the vector store.
+            query_options (QueryOptions, optional): The index search parameters of the vector store.
+
+        Returns:
+            tuple[str, str, str]: The table name, the embedding model name and the search parameters.
+        """
+        model_name = getattr(embedding, "model_name", None) or type(embedding).__name__
+        options = query_options.to_string() if query_options else ""
+        return table_name, model_name, options
+
+    def get(
+        self,
+        table_name: str,
+        embedding: VertexAIEmbeddings,
+        query_options: Optional[QueryOptions] = None,
+    ) -> PostgresVectorStore:
+        """
+        Return the cached vector store for a table and embedding model, building it on first use.
+
+        Args:
+            table_name (str): The name of the table backing the vector store.
+            embedding (VertexAIEmbeddings): The embedding service of the vector store.
+            query_options (QueryOptions, optional): The index search parameters, see :func:`search_options`.
+
+        Returns:
+            PostgresVectorStore: The cached vector store.
+        """
+        key = self.key(table_name, embedding, query_options)
+        vector_store = self._stores.get(key)
+        if vector_store is None:
+            with self._lock:
+                vector_store = self._stores.get(key)
+                if vector_store is None:
+                    vector_store = get_vector_store(
+                        self.engine, table_name, embedding, query_options
+                    )
+                    self._stores[key] = vector_store
+        return vector_store
+
+    async def aget(
+        self,
+        table_name: str,
+        embedding: VertexAIEmbeddings,
+        query_options: Optional[QueryOptions] = None,
+    ) -> PostgresVectorStore:
+        """
+        Async version of :meth:`get`, for engines created with :func:`acreate_cloud_sql_database_connection`.
+
+        Args:
+            table_name (str): The name of the table backing the vector store.
+            embedding (VertexAIEmbeddings): The embedding service of the vector store.
+            query_options (QueryOptions, optional): The index search parameters, see :func:`search_options`.
+
+        Returns:
+            PostgresVectorStore: The cached vector store.
+        """
+        key = self.key(table_name, embedding, query_options)
+        vector_store = self._stores.get(key)
+        if vector_store is None:
+            async with self._alock:
+                vector_store = self._stores.get(key)
+                if vector_store is None:
+                    vector_store = await aget_vector_store(
+                        self.engine, table_name, embedding, query_options
+                    )
+                    self._stores[key] = vector_store
+        return vector_store
+
+    def invalidate(self, table_name: Optional[str] = None) -> int:
+        """
+        Drop cached vector stores so that they are rebuilt on next use.
+
+        Call this after a table has been recreated or migrated.
+
+        Args:
+            table_name (str, optional): Only drop the stores of this table. Defaults to all tables.
+
+        Returns:
+            int: The number of dropped vector stores.
+        """
+        with self._lock:
+            keys = [
+                key
+                for key in self._stores
+                if table_name is None or key[0] == table_name
+            ]
+            for key in keys:
+                del self._stores[key]
+        return len(keys)
+
+    async def ahealth_check(self) -> dict[str, Any]:
+        """
+        Check that the database answers and that every cached table still exists.
+
+        Returns:
+            dict[str, Any]: The overall status under 'ok' and the status of each cached table under 'tables'.
+        """
+        tables: dict[str, bool] = {}
+        try:
+            await aexecute(self.engine, "SELECT 1")
+            for table_name in {key[0] for key in list(self._stores)}:
+                rows = await aexecute(
+                    self.engine,
+                    "SELECT to_regclass(:table_name) IS NOT NULL AS present",
+                    {"table_name": table_name},
+                )
+                tables[table_name] = bool(rows and rows[0]["present"])
+        except Exception as e:
+            return {"ok": False, "error": str(e), "tables": tables}
+        return {"ok": all(tables.values()), "tables": tables}
+
+
+def content_hash(question: str, answer: str, source: str, focus_area: str) -> str:
+    """
+    Compute the stable hash identifying the content of a MedQuAD row.
+
+    Args:
+        question (str): The question of the row.
+        answer (str): The answer of the row.
+        source (str): The source of the answer.
+        focus_area (str): The focus area of the row.
+
+    Returns:
+        str: The SHA-256 hex digest of the four fields.
+
+    Example:
+        >>> content_hash("What is Glaucoma ?", "Glaucoma is...", "NIHSeniorHealth", "Glaucoma")[:12]
+        '6d721dda2ee1'
+    """
+    fields = "\x1f".join([question, answer, source, focus_area])
+    return hashlib.sha256(fields.encode("utf-8")).hexdigest()
+
+
+def document_uuid(row_hash: str) -> str:
+    """
+    Derive the vector store id of a row from its content hash.
+
+    Identical rows share an id, so they are stored once, and a changed row gets a new id.
+
+    Args:
+        row_hash (str): The content hash of the row.
+
+    Returns:
+        str: The UUID (version 5) of the row.
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"medichat:{row_hash}"))
+
+
+def read_medquad_chunks(csv_path: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """
+    Stream the MedQuAD CSV in chunks, with missing values filled as in the ingestion notebook.
+
+    Args:
+        csv_path (str): The path to the MedQuAD CSV file.
+        chunk_size (int): The number of rows of each chunk.
+
+    Yields:
+        pd.DataFrame: The next rows of the file, indexed by their row number in the file,
+        with their content hash in a 'content_hash' column.
+    """
+    import pandas as pd
+
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_size):
+        chunk["answer"] = chunk["answer"].fillna("No answer provided")
+        chunk["source"] = chunk["source"].fillna("Unknown source")
+        chunk["focus_area"] = chunk["focus_area"].fillna("Not specified")
+        chunk = chunk.dropna(subset=["question"])
+        chunk[CONTENT_HASH_COLUMN] = [
+            content_hash(*map(str, values))
+            for values in chunk[
+                ["question", "answer", "source", "focus_area"]
+            ].itertuples(index=False)
+        ]
+        yield chunk
+
+
+def read_content_hashes(csv_path: str, chunk_size: int = 10_000) -> set[str]:
+    """
+    Compute the content hashes of every row of the MedQuAD CSV.
+
+    Args:
+        csv_path (str): The path to the MedQuAD CSV file.
+        chunk_size (int, optional): The number of rows read at a time. Defaults to 10000.
+
+    Returns:
+        set[str]: The content hashes of the rows.
+    """
+    return {
+        row_hash
+        for chunk in read_medquad_chunks(csv_path, chunk_size)
+        for row_hash in chunk[CONTENT_HASH_COLUMN]
+    }
+
+
+def row_to_document(row: pd.Series) -> Document:
+    """
+    Convert a MedQuAD row to the Document stored in the vector store.
+
+    Args:
+        row (pd.Series): A row with 'question', 'answer', 'source', 'focus_area' and 'content_hash'.
+
+    Returns:
+        Document: The question as content, and the answer, source, focus area and content hash as metadata.
+    """
+    return Document(
+        page_content=row["question"],
+        metadata={
+            "answer": row["answer"],
+            "source": row["source"],
+            "focus_area": row["focus_area"],
+            CONTENT_HASH_COLUMN: row[CONTENT_HASH_COLUMN],
+        },
+    )
+
+
+async def aembed_with_retry(
+    embedding: Embeddings,
+    texts: list[str],
+    max_retries: int = 5,
+    base_delay: float = 1.0,
+) -> list[list[float]]:
+    """
+    Embed texts in one call, retrying with exponential backoff on failure.
+
+    Args:
+        embedding (Embeddings): The embedding service.
+        texts (list[str]): The texts to embed.
+        max_retries (int, optional): The number of retries before giving up. Defaults to 5.
+        base_delay (float, optional): The delay before the first retry, in seconds, doubled at each retry. Defaults to 1.0.
+
+    Returns:
+        list[list[float]]: The embeddings of the texts.
+
+    Raises:
+        Exception: The error of the last attempt, once every retry has failed.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return await embedding.aembed_documents(texts)
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = base_delay * 2**attempt
+            print(f"Embedding failed ({e}), retrying in {delay:.0f}s")
+            await asyncio.sleep(delay)
+
+
+class PostgresBatchWriter:
+    """
+    Writes a batch of embedded documents with a single multi-row INSERT.
+
+    The content hash of each document goes to its own indexed column, the
+    filterable metadata (FILTER_COLUMNS) is also copied to its columns, and rows
+    already present (same id) are skipped, so writing a batch twice is harmless.
+
+    Example:
+        writer = PostgresBatchWriter(engine, "my_table")
+        await writer(ids, documents, embeddings)
+    """
+
+    def __init__(self, engine: PostgresEngine, table_name: str) -> None:
+        self.engine = engine
+        self.table_name = table_name
+
+    async def __call__(
+        self, ids: list[str], documents: list[Document], embeddings: list[list[float]]
+    ) -> None:
+        filter_columns = "".join(f", {column}" for column in FILTER_COLUMNS)
+        filter_values = "".join(f", :{column}" for column in FILTER_COLUMNS)
+        query = (
+            f'INSERT INTO "{self.table_name}" '
+            f"(langchain_id, content, {EMBEDDING_COLUMN}, langchain_metadata, "
+            f"{CONTENT_HASH_COLUMN}{filter_columns}) "
+            "VALUES (CAST(:id AS UUID), :content, CAST(:embedding AS vector), "
+            f"CAST(:metadata AS JSON), :content_hash{filter_values}) "
+            "ON CONFLICT (langchain_id) DO NOTHING"
+        )
+        rows = self.rows(ids, documents, embeddings)
+
+        async def _run() -> None:
+            async with self.engine._pool.connect() as conn:
+                await conn.execute(text(query), rows)
+                await conn.commit()
+
+        await self.engine._run_as_async(_run())
+
+    @staticmethod
+    def rows(
+        ids: list[str], documents: list[Document], embeddings: list[list[float]]
+    ) -> list[dict[str, Any]]:
+        """
+        Build the bind parameters of the INSERT, one dictionary per row.
+
+        Args:
+            ids (list[str]): The row ids.
+            documents (list[Document]): The documents, with their content hash in the metadata.
+            embeddings (list[list[float]]): The embeddings of the documents.
+
+        Returns:
+            list[dict[str, Any]]: The id, content, embedding, JSON metadata (without the content hash),
+            content hash and filter column values of each row.
+        """
+        return [
+            {
+                "id": id,
+                "content": document.page_content,
+                "embedding": str(vector),
+                "metadata": json.dumps(
+                    {
+                        key: value
+                        for key, value in document.metadata.items()
+                        if key != CONTENT_HASH_COLUMN
+                    }
+                ),
+                "content_hash": document.metadata.get(CONTENT_HASH_COLUMN),
+                **{column: document.metadata.get(column) for column in FILTER_COLUMNS},
+            }
+            for id, document, vector in zip(ids, documents, embeddings)
+        ]
+
+
+class IngestionCheckpoint:
+    """
+    Records the batches already written, so that an interrupted ingestion resumes where it stopped.
+
+    Example:
+        checkpoint = IngestionCheckpoint("./ingest_checkpoint.json", "medquad.csv")
+        if not checkpoint.is_done(0):
+            ...
+            checkpoint.mark_done(0)
+    """
+
+    def __init__(self, path: Optional[str], csv_path: str) -> None:
+        self.path = path
+        self.csv_path = os.path.abspath(csv_path)
+        self.done: set[int] = set()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("csv_path") == self.csv_path:
+                self.done = set(state["done"])
+
+    def is_done(self, batch_start: int) -> bool:
+        """
+        Tell whether the batch starting at a row has been written.
+
+        Args:
+            batch_start (int): The row number of the first row of the batch.
+
+        Returns:
+            bool: True if the batch has already been written.
+        """
+        return batch_start in self.done
+
+    def mark_done(self, batch_start: int) -> None:
+        """
+        Record a written batch and save the checkpoint file atomically.
+
+        Args:
+            batch_start (int): The row number of the first row of the batch.
+        """
+        self.done.add(batch_start)
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"csv_path": self.csv_path, "done": sorted(self.done)}, f)
+        os.replace(tmp_path, self.path)
+
+
+async def aingest_csv(
+    csv_path: str,
+    embedding: Embeddings,
+    writer: PostgresBatchWriter,
+    batch_size: int = 100,
+    concurrency: int = 4,
+    checkpoint_path: Optional[str] = None,
+    existing_hashes: Optional[set[str]] = None,
+) -> dict[str, float]:
+    """
+    Embed and store the MedQuAD CSV in batches, with bounded concurrency and resume support.
+
+    Rows are streamed from the file, embedded `batch_size` at a time with at most
+    `concurrency` embedding calls in flight, and each batch is written as soon as
+    it is embedded. Written batches are recorded in the checkpoint file, and are
+    skipped when the ingestion is run again. Rows whose content hash is in
+    `existing_hashes` are already stored, and are neither embedded nor written.
+    The first batch failing (once its retries are exhausted) cancels the others,
+    and its error is raised.
+
+    Args:
+        csv_path (str): The path to the MedQuAD CSV file.
+        embedding (Embeddings): The embedding service.
+        writer (PostgresBatchWriter): The async callable writing (ids, documents, embeddings).
+        batch_size (int, optional): The number of rows per embedding call and per INSERT. Defaults to 100.
+        concurrency (int, optional): The number of batches processed at the same time. Defaults to 4.
+        checkpoint_path (str, optional): The checkpoint file. Defaults to no checkpoint.
+        existing_hashes (set[str], optional): The content hashes of the rows already stored. Defaults to none.
+
+    Returns:
+        dict[str, float]: The number of rows written and skipped, the elapsed seconds and the rows per second.
+
+    Example:
+        stats = await aingest_csv("medquad.csv", get_embeddings(), PostgresBatchWriter(engine, TABLE_NAME))
+    """
+    import pandas as pd
+
+    checkpoint = IngestionCheckpoint(checkpoint_path, csv_path)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    written = skipped = 0
+    start_time = time.perf_counter()
+
+    async def worker() -> None:
+        nonlocal written
+        while (batch := await queue.get()) is not None:
+            batch_start, chunk = batch
+            documents = [row_to_document(row) for _, row in chunk.iterrows()]
+            ids = [document_uuid(row_hash) for row_hash in chunk[CONTENT_HASH_COLUMN]]
+            embeddings = await aembed_with_retry(
+                embedding, [document.page_content for document in documents]
+            )
+            await writer(ids, documents, embeddings)
+            checkpoint.mark_done(batch_start)
+            written += len(documents)
+            elapsed = time.perf_counter() - start_time
+            print(f"Wrote {written} rows ({written / elapsed:.1f} rows/s)")
+
+    pending = []
+    try:
+        # A failing worker cancels the other workers and this task, even while it waits on a full queue
+        async with asyncio.TaskGroup() as workers:
+            for _ in range(concurrency):
+                workers.create_task(worker())
+            for chunk in read_medquad_chunks(csv_path, batch_size):
+                if existing_hashes:
+                    new_rows = ~chunk[CONTENT_HASH_COLUMN].isin(existing_hashes)
+                    skipped += len(chunk) - int(new_rows.sum())
+                    chunk = chunk[new_rows]
+                pending.append(chunk)
+                # Rows left after skipping are regrouped into full batches
+                rows = pd.concat(pending)
+                while len(rows) >= batch_size:
+                    batch, rows = rows.iloc[:batch_size], rows.iloc[batch_size:]
+                    if not checkpoint.is_done(int(batch.index[0])):
+                        await queue.put((int(batch.index[0]), batch))
+                pending = [rows]
+            rows = pd.concat(pending)
+            if len(rows) and not checkpoint.is_done(int(rows.index[0])):
+                await queue.put((int(rows.index[0]), rows))
+            for _ in range(concurrency):
+                await queue.put(None)
+    except ExceptionGroup as error:
+        raise error.exceptions[0]
+
+    elapsed = time.perf_counter() - start_time
+    return {
+        "rows": written,
+        "skipped": skipped,
+        "seconds": elapsed,
+        "rows_per_second": written / elapsed if elapsed else 0.0,
+    }
+
+
+async def afetch_content_hashes(
+    engine: PostgresEngine, table_name: str
+) -> dict[str, Optional[str]]:
+    """
+    Read the id and content hash of every stored row.
+
+    Args:
+        engine (PostgresEngine): The database engine.
+        table_name (str): The name of the vector store table.
+
+    Returns:
+        dict[str, Optional[str]]: The content hash of each row id, None for rows stored before content hashes.
+    """
+    rows = await aexecute(
+        engine,
+        f'SELECT langchain_id::text AS id, {CONTENT_HASH_COLUMN} AS content_hash FROM "{table_name}"',
+    )
+    return {row["id"]: row["content_hash"] for row in rows}
+
+
+def diff_content_hashes(
+    stored: dict[str, Optional[str]], current: set[str]
+) -> tuple[list[str], set[str]]:
+    """
+    Compare the stored rows with the rows of the dataset.
+
+    Args:
+        stored (dict[str, Optional[str]]): The content hash of each stored row id.
+        current (set[str]): The content hashes of the rows of the dataset.
+
+    Returns:
+        tuple[list[str], set[str]]: The ids of the stored rows to delete (removed,
+        changed, or without a content hash), and the content hashes already stored.
+
+    Example:
+        >>> diff_content_hashes({"id-1": "a", "id-2": "b", "id-3": None}, {"a", "c"})
+        (['id-2', 'id-3'], {'a'})
+    """
+    removed = [id for id, row_hash in stored.items() if row_hash not in current]
+    unchanged = {row_hash for row_hash in stored.values() if row_hash in current}
+    return removed, unchanged
+
+
+async def adelete_documents(
+    engine: PostgresEngine, table_name: str, ids: list[str], batch_size: int = 1000
+) -> int:
+    """
+    Delete rows of the vector store table by id.
+
+    Args:
+        engine (PostgresEngine): The database engine.
+        table_name (str): The name of the vector store table.
+        ids (list[str]): The ids of the rows to delete.
+        batch_size (int, optional): The number of ids per DELETE statement. Defaults to 1000.
+
+    Returns:
+        int: The number of ids deleted.
+    """
+    for start in range(0, len(ids), batch_size):
+        await aexecute(
+            engine,
+            f'DELETE FROM "{table_name}" WHERE langchain_id = ANY(CAST(:ids AS UUID[]))',
+            {"ids": ids[start : start + batch_size]},
+        )
+    return len(ids)
+
+
+async def areingest_csv(
+    csv_path: str,
+    embedding: Embeddings,
+    engine: PostgresEngine,
+    table_name: str,
+    batch_size: int = 100,
+    concurrency: int = 4,
+) -> dict[str, float]:
+    """
+    Refresh the vector store from an updated MedQuAD CSV, embedding only what changed.
+
+    The content hashes of the file are compared with the stored ones: rows that
+    were removed or changed are deleted, new or changed rows are embedded and
+    written, and unchanged rows are left untouched. Running it again after an
+    interruption picks up the rows that are still missing.
+
+    Args:
+        csv_path (str): The path to the MedQuAD CSV file.
+        embedding (Embeddings): The embedding service.
+        engine (PostgresEngine): The database engine.
+        table_name (str): The name of the vector store table.
+        batch_size (int, optional): The number of rows per embedding call and per INSERT. Defaults to 100.
+        concurrency (int, optional): The number of batches processed at the same time. Defaults to 4.
+
+    Returns:
+        dict[str, float]: The number of rows written, skipped and deleted, the elapsed seconds and the rows per second.
+
+    Example:
+        stats = await areingest_csv("medquad.csv", get_embeddings(), engine, TABLE_NAME)
+    """
+    stored = await afetch_content_hashes(engine, table_name)
+    removed, unchanged = diff_content_hashes(stored, read_content_hashes(csv_path))
+    deleted = await adelete_documents(engine, table_name, removed)
+    stats = await aingest_csv(
+        csv_path,
+        embedding,
+        PostgresBatchWriter(engine, table_name),
+        batch_size=batch_size,
+        concurrency=concurrency,
+        existing_hashes=unchanged,
+    )
+    stats["deleted"] = deleted
+    return stats
+
+
+async def afetch_documents(
+    engine: PostgresEngine, table_name: str, with_embeddings: bool = False
+) -> tuple[list[Document], list[list[float]]]:
+    """
+    Read every document of the vector store table, e.g. to build an in-process index.
+
+    Args:
+        engine (PostgresEngine): The database engine.
+        table_name (str): The name of the vector store table.
+        with_embeddings (bool, optional): Also read the embeddings. Defaults to False.
+
+    Returns:
+        tuple[list[Document], list[list[float]]]: The documents, with their content
+        hash in the metadata, and their embeddings (empty without `with_embeddings`).
+    """
+    embedding_column = (
+        f"{EMBEDDING_COLUMN}::text AS embedding, " if with_embeddings else ""
+    )
+    rows = await aexecute(
+        engine,
+        f"SELECT content, {embedding_column}langchain_metadata, "
+        f'{CONTENT_HASH_COLUMN} AS content_hash FROM "{table_name}" ORDER BY langchain_id',
+    )
+    documents, vectors = [], []
+    for row in rows:
+        metadata = row["langchain_metadata"] or {}
+        if isinstance(metadata, str):
+            metadata = json.loads(metadata)
+        if row["content_hash"]:
+            metadata[CONTENT_HASH_COLUMN] = row["content_hash"]
+        documents.append(Document(page_content=row["content"], metadata=metadata))
+        if with_embeddings:
+            vectors.append(json.loads(row["embedding"]))
+    return documents, vectors
+
+
+async def afetch_embeddings(
+    engine: PostgresEngine, table_name: str, content_hashes: list[str]
+) -> dict[str, list[float]]:
+    """
+    Read the stored embeddings of rows, by content hash.
+
+    Args:
+        engine (PostgresEngine): The database engine.
+        table_name (str): The name of the vector store table.
+        content_hashes (list[str]): The content hashes of the rows, e.g. of the results of a search.
+
+    Returns:
+        dict[str, list[float]]: The embedding of each content hash found in the table.
+
+    Example:
+        vectors = await afetch_embeddings(engine, TABLE_NAME, [doc.metadata["content_hash"] for doc in docs])
+    """
+    if not content_hashes:
+        return {}
+    rows = await aexecute(
+        engine,
+        f"SELECT {CONTENT_HASH_COLUMN} AS content_hash, {EMBEDDING_COLUMN}::text AS embedding "
+        f'FROM "{table_name}" WHERE {CONTENT_HASH_COLUMN} = ANY(:content_hashes)',
+        {"content_hashes": list(set(content_hashes))},
+    )
+    return {row["content_hash"]: json.loads(row["embedding"]) for row in rows}
+
+
+async def aexport_local_store(
+    engine: PostgresEngine, table_name: str, directory: str
+) -> int:
+    """
+    Export the vector store table to a directory loadable by :class:`LocalVectorStore`.
+
+    Args:
+        engine (PostgresEngine): The database engine.
+        table_name (str): The name of the vector store table.
+        directory (str): The directory to write the memory-mapped store to.
+
+    Returns:
+        int: The number of exported documents.
+
+    Example:
+        await aexport_local_store(engine, TABLE_NAME, LOCAL_STORE_PATH)
+    """
+    documents, vectors = await afetch_documents(
+        engine, table_name, with_embeddings=True
+    )
+    await asyncio.to_thread(LocalVectorStore.build, directory, documents, vectors)
+    return len(documents)
+
+
+async def amain(args: argparse.Namespace) -> None:
+    """
+    Run the ingestion command line against Cloud SQL.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+    """
+    if args.sync:
+        from google.cloud import storage
+
+        report = await asyncio.to_thread(
+            sync_bucket, storage.Client(), BUCKET_NAME, os.path.dirname(args.csv) or "."
+        )
+        print(
+            f"Downloaded {len(report['downloaded'])} files, "
+            f"{len(report['skipped'])} already up to date"
+        )
+    engine = await acreate_cloud_sql_database_connection()
+    try:
+        if not args.skip_ingest:
+            await create_table_if_not_exists(args.table, engine)
+            if args.incremental:
+                stats = await areingest_csv(
+                    args.csv,
+                    get_embeddings(),
+                    engine,
+                    args.table,
+                    batch_size=args.batch_size,
+                    concurrency=args.concurrency,
+                )
+                print(f"Deleted {stats['deleted']} removed or changed rows")
+            else:
+                stats = await aingest_csv(
+                    args.csv,
+                    get_embeddings(),
+                    PostgresBatchWriter(engine, args.table),
+                    batch_size=args.batch_size,
+                    concurrency=args.concurrency,
+                    checkpoint_path=args.checkpoint,
+                )
+            print(
+                f"Ingested {stats['rows']} rows in {stats['seconds']:.1f}s "
+                f"({stats['rows_per_second']:.1f} rows/s), "
+                f"{stats['skipped']} unchanged rows skipped"
+            )
+        if args.index in ("hnsw", "ivfflat"):
+            await acreate_vector_index(
+                engine,
+                args.table,
+                args.index,
+                m=args.m,
+                ef_construction=args.ef_construction,
+                lists=args.lists,
+            )
+        elif args.index == "rebuild":
+            await arebuild_vector_index(engine, args.table)
+        elif args.index == "drop":
+            await adrop_vector_index(engine, args.table)
+        if args.export_local:
+            count = await aexport_local_store(engine, args.table, args.export_local)
+            print(f"Exported {count} documents to '{args.export_local}'")
+    finally:
+        await engine.close()
+
+
+def main():
+    """
+    Command line entry point: `python -m medichat.ingest --csv ./downloaded_files/medquad.csv`.
+    """
+    parser = argparse.ArgumentParser(
+        description="Embed the MedQuAD CSV and store it in the Cloud SQL vector store."
+    )
+    parser.add_argument(
+        "--csv", default=os.path.join(DOWNLOADED_LOCAL_DIRECTORY, "medquad.csv")
+    )
+    parser.add_argument("--table", default=TABLE_NAME)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--checkpoint", default="./ingest_checkpoint.json")
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Download the bucket files that changed before ingesting.",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only embed new or changed rows and delete removed ones.",
+    )
+    parser.add_argument(
+        "--index",
+        choices=["hnsw", "ivfflat", "rebuild", "drop"],
+        help="Create, rebuild or drop the vector index after ingesting.",
+    )
+    parser.add_argument(
+        "--skip-ingest",
+        action="store_true",
+        help="Only manage the index or export the table.",
+    )
+    parser.add_argument("--m", type=int, default=HNSW_M)
+    parser.add_argument("--ef-construction", type=int, default=HNSW_EF_CONSTRUCTION)
+    parser.add_argument("--lists", type=int, default=IVFFLAT_LISTS)
+    parser.add_argument(
+        "--export-local",
+        metavar="DIRECTORY",
+        help="Export the table for the local vector search backend.",
+    )
+    asyncio.run(amain(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
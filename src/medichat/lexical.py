@@ -0,0 +1,176 @@
+"""BM25 lexical index and reciprocal rank fusion, for hybrid lexical + vector retrieval."""
+
+import re
+from typing import Hashable, Optional
+import numpy as np
+from langchain_core.documents import Document
+from medichat.config import BM25_B, BM25_K1, RRF_K
+from medichat.context import QUESTION_WORDS
+
+# Metadata fields indexed along with the question, and their weights (repetitions of the field)
+INDEXED_FIELDS = {"answer": 1, "focus_area": 3}
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Split a text into lowercase terms, without question words and stop words.
+
+    Args:
+        text (str): The text to split.
+
+    Returns:
+        list[str]: The terms of the text, in order.
+
+    Example:
+        >>> tokenize("What are the symptoms of Glaucoma ?")
+        ['symptoms', 'glaucoma']
+    """
+    return [
+        term
+        for term in re.findall(r"[^\W_]+", text.casefold())
+        if term not in QUESTION_WORDS
+    ]
+
+
+class BM25Index:
+    """
+    Compact in-memory BM25 inverted index over questions, answers and focus areas.
+
+    The BM25 weight of every (term, document) pair is computed when the index is
+    built, and each posting list is stored as two NumPy arrays (document ids and
+    weights), so scoring a query only adds a few arrays together.
+
+    Example:
+        index = BM25Index(vector_store.documents)
+        for document, score in index.search("glaucoma symptoms", k=10):
+            ...
+    """
+
+    def __init__(
+        self, documents: list[Document], k1: float = BM25_K1, b: float = BM25_B
+    ) -> None:
+        self.documents = documents
+        term_frequencies: list[dict[str, int]] = []
+        for document in documents:
+            terms = tokenize(document.page_content)
+            for field, weight in INDEXED_FIELDS.items():
+                terms += tokenize(str(document.metadata.get(field) or "")) * weight
+            frequencies: dict[str, int] = {}
+            for term in terms:
+                frequencies[term] = frequencies.get(term, 0) + 1
+            term_frequencies.append(frequencies)
+
+        lengths = np.array(
+            [sum(frequencies.values()) for frequencies in term_frequencies],
+            dtype=np.float32,
+        )
+        length_norm = k1 * (1 - b + b * lengths / max(float(lengths.mean()), 1.0))
+
+        postings: dict[str, tuple[list[int], list[int]]] = {}
+        for doc_id, frequencies in enumerate(term_frequencies):
+            for term, frequency in frequencies.items():
+                ids, tfs = postings.setdefault(term, ([], []))
+                ids.append(doc_id)
+                tfs.append(frequency)
+
+        self.postings: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        for term, (ids, tfs) in postings.items():
+            ids = np.array(ids, dtype=np.int32)
+            tfs = np.array(tfs, dtype=np.float32)
+            idf = np.log(1 + (len(documents) - len(ids) + 0.5) / (len(ids) + 0.5))
+            weights = idf * tfs * (k1 + 1) / (tfs + length_norm[ids])
+            self.postings[term] = ids, weights.astype(np.float32)
+
+        self.focus_areas = {
+            " ".join(tokenize(str(document.metadata.get("focus_area") or "")))
+            for document in documents
+        } - {""}
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def is_entity_query(self, query: str, max_terms: int) -> bool:
+        """
+        Tell whether a query only names a known focus area, e.g. 'Glaucoma' or 'What is Glaucoma ?'.
+
+        Args:
+            query (str): The question of the user.
+            max_terms (int): The maximum number of terms of an entity-only query.
+
+        Returns:
+            bool: True if the terms of the query are exactly those of a focus area.
+        """
+        terms = tokenize(query)
+        return 0 < len(terms) <= max_terms and " ".join(terms) in self.focus_areas
+
+    def search(
+        self, query: str, k: int = 10, filter: Optional[dict] = None
+    ) -> list[tuple[Document, float]]:
+        """
+        Return the documents with the highest BM25 score for a query.
+
+        Args:
+            query (str): The query text.
+            k (int, optional): The number of results. Defaults to 10.
+            filter (dict, optional): Metadata values the results must match, a list of values matching any of them.
+
+        Returns:
+            list[tuple[Document, float]]: Copies of the documents and their BM25 scores, best first, without zero scores.
+        """
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term in self.postings:
+                ids, weights = self.postings[term]
+                scores[ids] += weights
+        if filter:
+            for key, value in filter.items():
+                accepted = value if isinstance(value, (list, tuple, set)) else [value]
+                rejected = np.fromiter(
+                    (doc.metadata.get(key) not in accepted for doc in self.documents),
+                    dtype=bool,
+                    count=len(self.documents),
+                )
+                scores[rejected] = 0
+        k = min(k, int(np.count_nonzero(scores)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (
+                Document(
+                    page_content=self.documents[i].page_content,
+                    metadata=dict(self.documents[i].metadata),
+                ),
+                float(scores[i]),
+            )
+            for i in top
+        ]
+
+
+def reciprocal_rank_fusion(
+    rankings: list[list[Hashable]], k: int = RRF_K
+) -> list[tuple[Hashable, float]]:
+    """
+    Fuse several rankings of the same items with reciprocal rank fusion.
+
+    Each item scores the sum of `1 / (k + rank)` over the rankings it appears
+    in, so items ranked well by several retrievers come first without having
+    to compare their raw scores.
+
+    Args:
+        rankings (list[list[Hashable]]): The item keys of each ranking, best first.
+        k (int, optional): The rank offset damping the top ranks. Defaults to RRF_K.
+
+    Returns:
+        list[tuple[Hashable, float]]: The items and their fused scores, best first.
+
+    Example:
+        >>> reciprocal_rank_fusion([["a", "b"], ["b", "c"]], k=60)[0][0]
+        'b'
+    """
+    scores: dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,370 @@
+"""In-process vector store over a memory-mapped float32 matrix, a drop-in for the Cloud SQL vector store."""
+
+import asyncio
+import json
+import os
+from typing import Any, Callable, Iterable, Optional
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+EMBEDDINGS_FILE_NAME = "embeddings.f32"
+DOCUMENTS_FILE_NAME = "documents.jsonl"
+MANIFEST_FILE_NAME = "manifest.json"
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Read-only vector store searching normalized embeddings with NumPy.
+
+    The embeddings are memory-mapped read-only from a raw float32 file, so every
+    worker process loading the same directory shares the pages of the OS page
+    cache instead of holding a private copy. Vectors are L2-normalized when the
+    directory is built, so the cosine similarity of a query with every document
+    is a single matrix-vector product, and the top k are selected with
+    `argpartition` without sorting the whole corpus.
+
+    Distances are cosine distances, as with the Cloud SQL vector store, so the
+    relevance score of a result is `1 - distance`.
+
+    Example:
+        LocalVectorStore.build("./vector_store", documents, vectors)
+        vector_store = LocalVectorStore.load("./vector_store", get_embeddings())
+        docs_and_distances = vector_store.similarity_search_with_score_by_vector(vector, k=4)
+    """
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        vectors: np.ndarray,
+        documents: list[Document],
+    ) -> None:
+        if len(vectors) != len(documents):
+            raise ValueError(
+                f"{len(vectors)} embeddings for {len(documents)} documents"
+            )
+        self.embedding = embedding
+        self.vectors = vectors
+        self.documents = documents
+        # Per metadata key: the code of each document's value, and the code of each value
+        self._metadata_codes: dict[str, tuple[np.ndarray, dict[Any, int]]] = {}
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    @staticmethod
+    def build(
+        directory: str,
+        documents: list[Document],
+        vectors: Iterable[Iterable[float]],
+    ) -> None:
+        """
+        Write a vector store directory: the normalized embeddings, the documents and a manifest.
+
+        Args:
+            directory (str): The directory to write to, created if missing.
+            documents (list[Document]): The documents, in the order of their embeddings.
+            vectors (Iterable[Iterable[float]]): The embedding of each document.
+        """
+        os.makedirs(directory, exist_ok=True)
+        matrix = np.asarray(list(vectors), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+
+        # Written next to the final files then moved, so readers never see a partial store
+        embeddings_path = os.path.join(directory, EMBEDDINGS_FILE_NAME)
+        matrix.tofile(f"{embeddings_path}.tmp")
+        documents_path = os.path.join(directory, DOCUMENTS_FILE_NAME)
+        with open(f"{documents_path}.tmp", "w", encoding="utf-8") as f:
+            for document in documents:
+                f.write(
+                    json.dumps(
+                        {
+                            "page_content": document.page_content,
+                            "metadata": document.metadata,
+                        }
+                    )
+                    + "\n"
+                )
+        manifest_path = os.path.join(directory, MANIFEST_FILE_NAME)
+        with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"count": len(matrix), "dim": matrix.shape[1]}, f)
+        for path in [embeddings_path, documents_path, manifest_path]:
+            os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, directory: str, embedding: Embeddings) -> "LocalVectorStore":
+        """
+        Open a vector store directory written by :meth:`build`.
+
+        Args:
+            directory (str): The vector store directory.
+            embedding (Embeddings): The embedding service used to embed the queries.
+
+        Returns:
+            LocalVectorStore: The vector store, with its embeddings memory-mapped.
+        """
+        with open(os.path.join(directory, MANIFEST_FILE_NAME), encoding="utf-8") as f:
+            manifest = json.load(f)
+        vectors = np.memmap(
+            os.path.join(directory, EMBEDDINGS_FILE_NAME),
+            dtype=np.float32,
+            mode="r",
+            shape=(manifest["count"], manifest["dim"]),
+        )
+        with open(os.path.join(directory, DOCUMENTS_FILE_NAME), encoding="utf-8") as f:
+            documents = [Document(**json.loads(line)) for line in f]
+        return cls(embedding, vectors, documents)
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: list[str],
+        embedding: Embeddings,
+        metadatas: Optional[list[dict]] = None,
+        *,
+        directory: str,
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        """
+        Embed texts, write them to a vector store directory and open it.
+
+        Args:
+            texts (list[str]): The page contents of the documents.
+            embedding (Embeddings): The embedding service.
+            metadatas (list[dict], optional): The metadata of each document.
+            directory (str): The directory to write to.
+
+        Returns:
+            LocalVectorStore: The vector store.
+        """
+        metadatas = metadatas or [{} for _ in texts]
+        documents = [
+            Document(page_content=text, metadata=metadata)
+            for text, metadata in zip(texts, metadatas)
+        ]
+        cls.build(directory, documents, embedding.embed_documents(texts))
+        return cls.load(directory, embedding)
+
+    def add_texts(self, texts: Iterable[str], metadatas=None, **kwargs: Any):
+        raise NotImplementedError(
+            "LocalVectorStore is read-only, rebuild it with LocalVectorStore.build"
+        )
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        return lambda distance: 1.0 - distance
+
+    def _filter_mask(self, filter: Optional[dict]) -> Optional[np.ndarray]:
+        """
+        Build the mask of the documents whose metadata matches a filter.
+
+        Args:
+            filter (dict, optional): Metadata values to match, a list of values matching any of them.
+
+        Returns:
+            np.ndarray: A boolean mask over the documents, None without filter.
+        """
+        if not filter:
+            return None
+        mask = np.ones(len(self.documents), dtype=bool)
+        for key, value in filter.items():
+            if key not in self._metadata_codes:
+                value_codes: dict[Any, int] = {}
+                codes = np.fromiter(
+                    (
+                        value_codes.setdefault(
+                            document.metadata.get(key), len(value_codes)
+                        )
+                        for document in self.documents
+                    ),
+                    dtype=np.int32,
+                    count=len(self.documents),
+                )
+                self._metadata_codes[key] = codes, value_codes
+            codes, value_codes = self._metadata_codes[key]
+            accepted = value if isinstance(value, (list, tuple, set)) else [value]
+            mask &= np.isin(
+                codes, [value_codes[item] for item in accepted if item in value_codes]
+            )
+        return mask
+
+    def search(
+        self,
+        queries: np.ndarray,
+        k: int = 4,
+        score_threshold: Optional[float] = None,
+        filter: Optional[dict] = None,
+    ) -> list[list[tuple[int, float]]]:
+        """
+        Find the k most similar documents of a batch of query vectors.
+
+        Args:
+            queries (np.ndarray): The query vectors, of shape (number of queries, dimension).
+            k (int, optional): The number of results per query. Defaults to 4.
+            score_threshold (float, optional): The minimum cosine similarity of the results.
+            filter (dict, optional): Metadata values the results must match.
+
+        Returns:
+            list[list[tuple[int, float]]]: For each query, the document indices and cosine similarities, best first.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+
+        mask = self._filter_mask(filter)
+        if mask is None:
+            candidates = None
+            scores = queries @ self.vectors.T
+        else:
+            # Pre-filtering: only the rows matching the filter are scored
+            candidates = np.flatnonzero(mask)
+            scores = queries @ self.vectors[candidates].T
+        k = min(k, scores.shape[1])
+        if k <= 0:
+            return [[] for _ in queries]
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        if candidates is not None:
+            top = candidates[top]
+
+        minimum = -np.inf if score_threshold is None else score_threshold
+        return [
+            [
+                (int(index), float(score))
+                for index, score in zip(indices, row_scores)
+                if score >= minimum
+            ]
+            for indices, row_scores in zip(top, top_scores)
+        ]
+
+    def _document(self, index: int) -> Document:
+        # A copy, so that callers can annotate the metadata (e.g. with the score)
+        document = self.documents[index]
+        return Document(
+            page_content=document.page_content, metadata=dict(document.metadata)
+        )
+
+    def batch_similarity_search_with_score_by_vectors(
+        self,
+        embeddings: list[list[float]],
+        k: int = 4,
+        score_threshold: Optional[float] = None,
+        filter: Optional[dict] = None,
+    ) -> list[list[tuple[Document, float]]]:
+        """
+        Search many query vectors with one matrix product.
+
+        Args:
+            embeddings (list[list[float]]): The query vectors.
+            k (int, optional): The number of results per query. Defaults to 4.
+            score_threshold (float, optional): The minimum cosine similarity of the results.
+            filter (dict, optional): Metadata values the results must match.
+
+        Returns:
+            list[list[tuple[Document, float]]]: For each query, the documents and their cosine distances, best first.
+        """
+        return [
+            [(self._document(index), 1.0 - score) for index, score in results]
+            for results in self.search(
+                np.asarray(embeddings), k, score_threshold, filter
+            )
+        ]
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: list[float],
+        k: int = 4,
+        filter: Optional[dict] = None,
+        score_threshold: Optional[float] = None,
+        **kwargs: Any,
+    ) -> list[tuple[Document, float]]:
+        """
+        Return the documents most similar to a query vector, with their cosine distances.
+
+        Args:
+            embedding (list[float]): The query vector.
+            k (int, optional): The number of results. Defaults to 4.
+            filter (dict, optional): Metadata values the results must match.
+            score_threshold (float, optional): The minimum cosine similarity of the results.
+
+        Returns:
+            list[tuple[Document, float]]: The documents and their cosine distances, best first.
+        """
+        return self.batch_similarity_search_with_score_by_vectors(
+            [embedding], k, score_threshold, filter
+        )[0]
+
+    def similarity_search_with_vectors_by_vector(
+        self,
+        embedding: list[float],
+        k: int = 4,
+        score_threshold: Optional[float] = None,
+        filter: Optional[dict] = None,
+    ) -> tuple[list[tuple[Document, float]], np.ndarray]:
+        """
+        Return the documents most similar to a query vector, with their cosine distances and their embeddings.
+
+        Args:
+            embedding (list[float]): The query vector.
+            k (int, optional): The number of results. Defaults to 4.
+            score_threshold (float, optional): The minimum cosine similarity of the results.
+            filter (dict, optional): Metadata values the results must match.
+
+        Returns:
+            tuple[list[tuple[Document, float]], np.ndarray]: The documents and their cosine distances, best first,
+            and their normalized embeddings, one per row.
+        """
+        results = self.search(np.asarray([embedding]), k, score_threshold, filter)[0]
+        indices = [index for index, _ in results]
+        return (
+            [(self._document(index), 1.0 - score) for index, score in results],
+            np.asarray(self.vectors[indices]),
+        )
+
+    async def asimilarity_search_with_score_by_vector(
+        self,
+        embedding: list[float],
+        k: int = 4,
+        filter: Optional[dict] = None,
+        score_threshold: Optional[float] = None,
+        **kwargs: Any,
+    ) -> list[tuple[Document, float]]:
+        """
+        Async version of :meth:`similarity_search_with_score_by_vector`, run in a thread.
+
+        Scoring the whole corpus takes milliseconds (several milliseconds for MedQuAD), during
+        which the event loop would serve no other request; NumPy releases the GIL
+        in the matrix product, so concurrent searches overlap.
+        """
+        return await asyncio.to_thread(
+            self.similarity_search_with_score_by_vector,
+            embedding,
+            k,
+            filter,
+            score_threshold,
+        )
+
+    def similarity_search_by_vector(
+        self, embedding: list[float], k: int = 4, **kwargs: Any
+    ) -> list[Document]:
+        return [
+            document
+            for document, _ in self.similarity_search_with_score_by_vector(
+                embedding, k, **kwargs
+            )
+        ]
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> list[Document]:
+        return self.similarity_search_by_vector(
+            self.embedding.embed_query(query), k, **kwargs
+        )
@@ -0,0 +1,326 @@
+"""Per-stage latency histograms and counters of the API, exposed in the Prometheus text format."""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
+from medichat.config import METRICS_LATENCY_BUCKETS, SERVER_TIMING
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# The stage durations of the request being served, for the Server-Timing header
+REQUEST_TIMINGS: ContextVar[Optional[dict[str, float]]] = ContextVar(
+    "REQUEST_TIMINGS", default=None
+)
+
+
+def format_labels(labels: dict[str, str]) -> str:
+    """
+    Format the labels of a sample, escaping their values.
+
+    Args:
+        labels (dict[str, str]): The label names and values.
+
+    Returns:
+        str: The labels between braces, or an empty string without labels.
+
+    Example:
+        >>> format_labels({"stage": "embedding"})
+        '{stage="embedding"}'
+    """
+    if not labels:
+        return ""
+    values = ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\""),
+        )
+        for name, value in labels.items()
+    )
+    return "{" + values + "}"
+
+
+class Counter:
+    """
+    Monotonic counter with labels.
+
+    Example:
+        REQUESTS = Counter("medichat_requests_total", "Requests served.", ["path"])
+        REQUESTS.inc(path="/chat")
+    """
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """
+        Increment the counter of a label set.
+
+        Args:
+            amount (float, optional): The increment. Defaults to 1.
+            **labels (str): The value of each label name.
+        """
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        """
+        Render the counter in the Prometheus text format.
+
+        Returns:
+            list[str]: The lines of the metric family.
+        """
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            labels = format_labels(dict(zip(self.labelnames, key)))
+            lines.append(f"{self.name}{labels} {value:g}")
+        return lines
+
+
+class Histogram:
+    """
+    Histogram with cumulative buckets and labels.
+
+    Example:
+        STAGE_SECONDS = Histogram("medichat_stage_seconds", "Stage duration.", ["stage"])
+        STAGE_SECONDS.observe(0.012, stage="embedding")
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: list[float] = METRICS_LATENCY_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = sorted(buckets)
+        # Per label set: the count of each bucket (non-cumulative, plus +Inf), and the sum
+        self._values: dict[tuple, tuple[list[int], float]] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        Record an observation of a label set.
+
+        Args:
+            value (float): The observed value, e.g. a duration in seconds.
+            **labels (str): The value of each label name.
+        """
+        key = tuple(labels[name] for name in self.labelnames)
+        # The first bucket whose upper bound is >= value, or +Inf
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = counts, total + value
+
+    def render(self) -> list[str]:
+        """
+        Render the histogram in the Prometheus text format.
+
+        Returns:
+            list[str]: The lines of the metric family.
+        """
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            values = sorted(
+                (key, (list(counts), total))
+                for key, (counts, total) in self._values.items()
+            )
+        for key, (counts, total) in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip([*self.buckets, "+Inf"], counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else f"{bound:g}"
+                bucket_labels = format_labels({**labels, "le": le})
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {total:g}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {cumulative}")
+        return lines
+
+
+REGISTRY: list[Any] = []
+
+REQUEST_SECONDS = Histogram(
+    "medichat_request_seconds",
+    "Duration of the requests, until the response headers are sent.",
+    ["path"],
+)
+REQUESTS = Counter(
+    "medichat_requests_total", "Requests served, by status code.", ["path", "status"]
+)
+STAGE_SECONDS = Histogram(
+    "medichat_stage_seconds",
+    "Duration of the stages of the requests: embedding, search, lexical_search, "
+    "diversity, prompt, llm_first_token and llm.",
+    ["stage"],
+)
+RETRIEVED_DOCUMENTS = Histogram(
+    "medichat_retrieved_documents",
+    "Number of documents retrieved per question.",
+    buckets=[0, 1, 2, 4, 8, 16, 32],
+)
+PROMPT_TOKENS = Histogram(
+    "medichat_prompt_tokens",
+    "Estimated number of tokens of the prompts sent to the LLM.",
+    buckets=[250, 500, 1000, 2000, 4000, 8000, 16000, 32000],
+)
+
+
+def record_stage(name: str, seconds: float) -> None:
+    """
+    Record the duration of a stage in its histogram and in the timings of the current request.
+
+    Args:
+        name (str): The stage, e.g. 'embedding' or 'search'.
+        seconds (float): The duration of the stage.
+    """
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = REQUEST_TIMINGS.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Time the enclosed block as a stage of the current request.
+
+    Args:
+        name (str): The stage, e.g. 'embedding' or 'search'.
+
+    Example:
+        with stage("embedding"):
+            embedding = await embeddings.aembed_query(query)
+    """
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start_time)
+
+
+def server_timing(timings: dict[str, float]) -> str:
+    """
+    Format stage durations as a Server-Timing header value.
+
+    Args:
+        timings (dict[str, float]): The duration of each stage, in seconds.
+
+    Returns:
+        str: The header value, with durations in milliseconds.
+
+    Example:
+        >>> server_timing({"embedding": 0.0123, "total": 0.05})
+        'embedding;dur=12.3, total;dur=50.0'
+    """
+    return ", ".join(
+        f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()
+    )
+
+
+def render_metrics(cache_stats: Optional[dict[str, dict]] = None) -> str:
+    """
+    Render all the metrics of this worker in the Prometheus text format.
+
+    Args:
+        cache_stats (dict[str, dict], optional): The `stats()` of each cache, rendered as
+            `medichat_cache_lookups_total{cache, result}` counters.
+
+    Returns:
+        str: The exposition text.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    if cache_stats:
+        lines += [
+            "# HELP medichat_cache_lookups_total Cache lookups, by cache and result.",
+            "# TYPE medichat_cache_lookups_total counter",
+        ]
+        for cache, stats in cache_stats.items():
+            for key, result in [("hits", "hit"), ("misses", "miss")]:
+                labels = format_labels({"cache": cache, "result": result})
+                lines.append(f"medichat_cache_lookups_total{labels} {stats[key]}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing each HTTP request and collecting the durations of its stages.
+
+    The stages recorded with :func:`stage` while serving the request are added,
+    with the total duration, to an optional Server-Timing response header. For
+    streamed responses the header is sent before the body, so it only holds the
+    stages done by then (see the metadata frame of /chat/stream for the rest).
+
+    Example:
+        app.add_middleware(MetricsMiddleware)
+    """
+
+    def __init__(self, app, server_timing: bool = SERVER_TIMING) -> None:
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        timings: dict[str, float] = {}
+        token = REQUEST_TIMINGS.set(timings)
+        started = False
+
+        def record(status: int) -> float:
+            total = time.perf_counter() - start_time
+            # Unmatched paths share one label, so that scans do not grow the metrics
+            path = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_SECONDS.observe(total, path=path)
+            REQUESTS.inc(path=path, status=str(status))
+            return total
+
+        async def send_with_timings(message) -> None:
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+                total = record(message["status"])
+                if self.server_timing:
+                    header = server_timing({**timings, "total": total})
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (b"server-timing", header.encode("latin-1")),
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        except Exception:
+            if not started:
+                record(500)
+            raise
+        finally:
+            REQUEST_TIMINGS.reset(token)
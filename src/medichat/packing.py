@@ -0,0 +1,255 @@
+"""Token-budgeted packing of the retrieved documents into the generation prompt."""
+
+import re
+from typing import Optional
+from langchain_core.documents import Document
+from medichat.config import DOCUMENT_TOKEN_BUDGET, PACKING_MIN_DOCUMENT_TOKENS
+from medichat.context import estimate_tokens, truncate_to_tokens
+from medichat.lexical import tokenize
+from medichat.retrieve import format_relevant_documents
+
+
+def split_sentences(text: str) -> list[str]:
+    """
+    Split a text into sentences and list items.
+
+    Args:
+        text (str): The text to split.
+
+    Returns:
+        list[str]: The non-empty sentences, in order.
+
+    Example:
+        >>> split_sentences("Glaucoma damages the optic nerve. Symptoms:\\n- Eye pain")
+        ['Glaucoma damages the optic nerve.', 'Symptoms:', '- Eye pain']
+    """
+    return [
+        sentence.strip()
+        for sentence in re.split(r"(?<=[.!?:])\s+|\n+", text)
+        if sentence.strip()
+    ]
+
+
+def rank_sentences(text: str, question_terms: set[str]) -> list[tuple[int, str]]:
+    """
+    Rank the sentences of a text by relevance to the question.
+
+    Sentences are ranked by the number of distinct question terms they contain,
+    earlier sentences first on ties (MedQuAD answers open with a definition).
+
+    Args:
+        text (str): The text to rank, e.g. the answer of a document.
+        question_terms (set[str]): The terms of the question, see :func:`medichat.lexical.tokenize`.
+
+    Returns:
+        list[tuple[int, str]]: The position and text of each sentence, most relevant first.
+    """
+    sentences = list(enumerate(split_sentences(text)))
+    return sorted(
+        sentences,
+        key=lambda sentence: (
+            -len(question_terms.intersection(tokenize(sentence[1]))),
+            sentence[0],
+        ),
+    )
+
+
+def select_sentences(
+    text: str,
+    question_terms: set[str],
+    max_tokens: int,
+    ranking: Optional[list[tuple[int, str]]] = None,
+) -> str:
+    """
+    Keep the sentences of a text most relevant to the question, within a number of tokens.
+
+    Sentences are taken greedily in the order of :func:`rank_sentences` while
+    they fit. The kept sentences stay in their order, with '...' where
+    sentences were left out.
+
+    Args:
+        text (str): The text to shorten, e.g. the answer of a document.
+        question_terms (set[str]): The terms of the question, see :func:`medichat.lexical.tokenize`.
+        max_tokens (int): The maximum number of tokens of the result.
+        ranking (list[tuple[int, str]], optional): The ranked sentences of the text, if already computed.
+
+    Returns:
+        str: The text itself if it fits, else its selected sentences.
+
+    Example:
+        shortened = select_sentences(answer, set(tokenize("What causes Glaucoma ?")), 200)
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    if ranking is None:
+        ranking = rank_sentences(text, question_terms)
+    selected = []
+    used = 0
+    for position, sentence in ranking:
+        # Counted in characters like estimate_tokens, with 5 more for the separator and '...' before a gap
+        if used + len(sentence) + 5 <= max_tokens * 4:
+            selected.append((position, sentence))
+            used += len(sentence) + 5
+    if not selected:
+        return truncate_to_tokens(ranking[0][1], max_tokens) if ranking else ""
+
+    selected.sort()
+    parts = [selected[0][1]]
+    for (previous, _), (position, sentence) in zip(selected, selected[1:]):
+        parts.append(("" if position == previous + 1 else "... ") + sentence)
+    return " ".join(parts)
+
+
+def relevance_weights(documents: list[Document]) -> list[float]:
+    """
+    Weigh the documents by relevance, to share the token budget between them.
+
+    Args:
+        documents (list[Document]): The documents, most relevant first.
+
+    Returns:
+        list[float]: The 'rrf_score' of each document (hybrid retrieval), else its 'score',
+        else 1 / its rank when a document has neither.
+    """
+    for key in ["rrf_score", "score"]:
+        scores = [doc.metadata.get(key) for doc in documents]
+        if all(isinstance(score, (int, float)) for score in scores):
+            return [max(float(score), 1e-6) for score in scores]
+    return [1 / rank for rank in range(1, len(documents) + 1)]
+
+
+def allocate_tokens(
+    needs: list[int], weights: list[float], available: int
+) -> list[int]:
+    """
+    Share tokens between documents in proportion to their weights, without giving any more than it needs.
+
+    The tokens a document does not need are shared again between the others
+    (water-filling), so short answers are kept whole and long ones get the rest.
+
+    Args:
+        needs (list[int]): The number of tokens of each full answer.
+        weights (list[float]): The relevance weight of each document.
+        available (int): The number of tokens to share.
+
+    Returns:
+        list[int]: The number of tokens allocated to each answer.
+
+    Example:
+        >>> allocate_tokens([50, 400, 400], [1.0, 1.0, 1.0], 600)
+        [50, 275, 275]
+    """
+    allocation = [0] * len(needs)
+    remaining = set(range(len(needs)))
+    while remaining and available > 0:
+        total_weight = sum(weights[i] for i in remaining)
+        shares = {i: available * weights[i] / total_weight for i in remaining}
+        satisfied = [i for i in remaining if needs[i] <= shares[i]]
+        if not satisfied:
+            for i in remaining:
+                allocation[i] = int(shares[i])
+            break
+        for i in satisfied:
+            allocation[i] = needs[i]
+            available -= needs[i]
+            remaining.remove(i)
+    return allocation
+
+
+def pack_documents(
+    documents: list,
+    question: str,
+    token_budget: Optional[int] = DOCUMENT_TOKEN_BUDGET,
+    min_tokens: int = PACKING_MIN_DOCUMENT_TOKENS,
+) -> list[Document]:
+    """
+    Fit the retrieved documents in a token budget for the prompt.
+
+    The budget left after the fixed part of each document (source, question and
+    focus area) is shared between the answers by relevance, see
+    :func:`allocate_tokens`. Answers over their share are cut to their sentences
+    most relevant to the question, see :func:`select_sentences`. Documents that
+    would be left with less than `min_tokens` of answer, for lack of budget or
+    because no more of their sentences fit, are dropped one at a time, least
+    relevant first, and their share goes to the others; the most relevant
+    document is always kept.
+
+    Args:
+        documents (list): The retrieved documents (Document or DocumentResponse), most relevant first.
+        question (str): The question of the user.
+        token_budget (int, optional): The maximum number of tokens of the formatted documents, 0 or None to disable packing. Defaults to DOCUMENT_TOKEN_BUDGET.
+        min_tokens (int, optional): The minimum number of tokens of a kept answer. Defaults to PACKING_MIN_DOCUMENT_TOKENS.
+
+    Returns:
+        list[Document]: The kept documents in their order, with their answer shortened to fit.
+
+    Example:
+        formatted_docs = format_relevant_documents(pack_documents(documents, user_input.question))
+    """
+    documents = [
+        Document(page_content=doc.page_content, metadata=dict(doc.metadata))
+        for doc in documents
+    ]
+    if not token_budget or not documents:
+        return documents
+    if estimate_tokens(format_relevant_documents(documents)) <= token_budget:
+        return documents
+
+    answers = [str(doc.metadata.get("answer") or "") for doc in documents]
+    needs = [estimate_tokens(answer) for answer in answers]
+    # Tokens of a document besides its answer, including the line separating it from the next
+    overheads = [
+        estimate_tokens(
+            format_relevant_documents(
+                [
+                    Document(
+                        page_content=doc.page_content,
+                        metadata={**doc.metadata, "answer": ""},
+                    )
+                ]
+            )
+        )
+        + 1
+        for doc in documents
+    ]
+    weights = relevance_weights(documents)
+    question_terms = set(tokenize(question))
+
+    # The sentences of each answer are ranked once, when it first has to be cut
+    rankings: dict[int, list[tuple[int, str]]] = {}
+    kept = list(range(len(documents)))
+    while True:
+        available = token_budget - sum(overheads[i] for i in kept)
+        allocation = allocate_tokens(
+            [needs[i] for i in kept], [weights[i] for i in kept], available
+        )
+        if (
+            len(kept) > 1
+            and min(
+                share - min(min_tokens, needs[i]) for i, share in zip(kept, allocation)
+            )
+            < 0
+        ):
+            # Too many documents for the budget: drop the least relevant one
+            kept.remove(min(kept[1:], key=lambda i: (weights[i], -i)))
+            continue
+        selections = {}
+        for i, share in zip(kept, allocation):
+            if needs[i] > share and i not in rankings:
+                rankings[i] = rank_sentences(answers[i], question_terms)
+            selections[i] = select_sentences(
+                answers[i], question_terms, max(share, min_tokens), rankings.get(i)
+            )
+        # A near-empty leftover of a long answer is noise for the LLM: its share goes to the others
+        leftovers = [
+            i
+            for i in kept[1:]
+            if needs[i] > min_tokens and estimate_tokens(selections[i]) < min_tokens
+        ]
+        if not leftovers:
+            break
+        kept.remove(min(leftovers, key=lambda i: (weights[i], -i)))
+
+    for i in kept:
+        documents[i].metadata["answer"] = selections[i]
+    return [documents[i] for i in kept]
@@ -1,32 +1,506 @@
-from langchain_google_cloud_sql_pg import PostgresVectorStore
+import asyncio
+import sys
+from typing import Any, Awaitable, Callable, Optional
+import numpy as np
 from langchain_core.documents.base import Document
+from langchain_core.vectorstores import VectorStore
+from medichat.diversity import diversify
+from medichat.lexical import BM25Index, reciprocal_rank_fusion
+from medichat.metrics import stage
+from medichat.config import (
+    BATCH_SEARCH_CONCURRENCY,
+    CONTENT_HASH_COLUMN,
+    DIVERSITY_FETCH_FACTOR,
+    EMBEDDING_COLUMN,
+    FILTER_COLUMNS,
+    HYBRID_CANDIDATES,
+    LEXICAL_FAST_PATH_MAX_TERMS,
+)
+
+
+def similarity_filter(
+    embedding: list[float], similarity_threshold: float
+) -> Optional[str]:
+    """
+    Build the SQL condition keeping only the rows above a similarity threshold.
+
+    The vector store uses the cosine distance, whose relevance score is
+    `1 - distance`, so the threshold becomes a distance cutoff evaluated by
+    pgvector in the WHERE clause instead of on the client.
+
+    Args:
+        embedding (list[float]): The embedding of the query.
+        similarity_threshold (float): The minimum relevance score, between 0 and 1.
+
+    Returns:
+        str: The condition to pass as the `filter` of the vector store, None for a threshold of 0.
+
+    Example:
+        >>> similarity_filter([0.1, 0.2], 0.75)
+        "embedding <=> '[0.1, 0.2]' <= 0.25"
+    """
+    if similarity_threshold <= 0:
+        return None
+    return f"{EMBEDDING_COLUMN} <=> '{embedding}' <= {1 - similarity_threshold}"
+
+
+def metadata_filter(filter: Optional[dict]) -> Optional[str]:
+    """
+    Build the SQL condition keeping only the rows whose metadata columns match a filter.
+
+    Only the indexed metadata columns (FILTER_COLUMNS) can be filtered on, and
+    the values are quoted as SQL string literals.
+
+    Args:
+        filter (dict, optional): Metadata values to match, a list of values matching any of them.
+
+    Returns:
+        str: The condition to pass as the `filter` of the vector store, None without filter.
+
+    Raises:
+        ValueError: If a key of the filter is not a filterable column.
+
+    Example:
+        >>> metadata_filter({"focus_area": "Glaucoma", "source": ["NEI", "GHR"]})
+        "focus_area = 'Glaucoma' AND source IN ('NEI', 'GHR')"
+    """
+    if not filter:
+        return None
+    conditions = []
+    for key, value in filter.items():
+        if key not in FILTER_COLUMNS:
+            raise ValueError(f"Cannot filter on '{key}', only on {FILTER_COLUMNS}")
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        literals = ", ".join(
+            "'" + str(item).replace("'", "''") + "'" for item in values
+        )
+        if len(values) == 1:
+            conditions.append(f"{key} = {literals}")
+        else:
+            conditions.append(f"{key} IN ({literals or 'NULL'})")
+    return " AND ".join(conditions)
+
+
+def is_postgres_store(vector_store: VectorStore) -> bool:
+    """
+    Tell whether a vector store is a PostgresVectorStore, without importing the Cloud SQL SDK.
+
+    A PostgresVectorStore can only exist once its module is imported, so the
+    check costs nothing with the local backend, which never imports it.
+
+    Args:
+        vector_store (VectorStore): The vector store.
+
+    Returns:
+        bool: True for a Cloud SQL vector store.
+    """
+    module = sys.modules.get("langchain_google_cloud_sql_pg")
+    return module is not None and isinstance(vector_store, module.PostgresVectorStore)
+
+
+def search_kwargs(
+    vector_store: VectorStore,
+    embedding: list[float],
+    similarity_threshold: float,
+    filter: Optional[dict] = None,
+) -> dict[str, Any]:
+    """
+    Build the arguments applying the similarity threshold and the metadata filter in the search of a vector store.
+
+    Args:
+        vector_store (VectorStore): A PostgresVectorStore, or a LocalVectorStore.
+        embedding (list[float]): The embedding of the query.
+        similarity_threshold (float): The minimum relevance score, between 0 and 1.
+        filter (dict, optional): Metadata values the results must match, see :func:`metadata_filter`.
+
+    Returns:
+        dict[str, Any]: A SQL `filter` for the Cloud SQL vector store, else a `score_threshold` and a `filter`.
+    """
+    if is_postgres_store(vector_store):
+        conditions = [
+            condition
+            for condition in [
+                similarity_filter(embedding, similarity_threshold),
+                metadata_filter(filter),
+            ]
+            if condition
+        ]
+        return {"filter": " AND ".join(conditions) or None}
+    return {"score_threshold": similarity_threshold or None, "filter": filter or None}
 
 
 def get_relevant_documents(
     query: str,
-    vector_store: PostgresVectorStore,
+    vector_store: VectorStore,
     similarity_threshold: float,
-    max_sources: float,
+    max_sources: int,
+    filter: Optional[dict] = None,
 ) -> list[Document]:
     """
     Retrieve relevant documents based on a query using a vector store.
 
     Args:
         query (str): The search query string.
-        vector_store (PostgresVectorStore): An instance of PostgresVectorStore used to retrieve documents.
-        similarity_threshold (float): The similarity threshold to use for the search.
+        vector_store (VectorStore): The PostgresVectorStore (or LocalVectorStore) used to retrieve documents.
+        similarity_threshold (float): The minimum relevance score of the returned documents, applied in the search.
         max_sources (int): The maximum number of sources to return.
+        filter (dict, optional): Metadata values the documents must match, e.g. {"focus_area": "Glaucoma"}, applied in the search.
 
     Returns:
-        list[Document]: A list of documents relevant to the query.
+        list[Document]: A list of documents relevant to the query, empty if none is above the threshold.
     """
+    with stage("embedding"):
+        embedding = vector_store.embeddings.embed_query(query)
+    with stage("search"):
+        relevant_docs_distances = vector_store.similarity_search_with_score_by_vector(
+            embedding=embedding,
+            k=max_sources,
+            **search_kwargs(vector_store, embedding, similarity_threshold, filter),
+        )
+    relevance_score_fn = vector_store._select_relevance_score_fn()
+    for doc, distance in relevant_docs_distances:
+        doc.metadata["score"] = relevance_score_fn(distance)
+    relevant_docs = [doc for doc, _ in relevant_docs_distances]
+
+    return relevant_docs
+
+
+async def aget_relevant_documents(
+    query: str,
+    vector_store: VectorStore,
+    similarity_threshold: float,
+    max_sources: int,
+    filter: Optional[dict] = None,
+) -> list[Document]:
+    """
+    Async version of :func:`get_relevant_documents`.
+
+    The query is embedded with `aembed_query` and searched with the async vector
+    search, so neither call blocks the event loop.
+
+    Args:
+        query (str): The search query string.
+        vector_store (VectorStore): The PostgresVectorStore (or LocalVectorStore) used to retrieve documents.
+        similarity_threshold (float): The minimum relevance score of the returned documents, applied in the search.
+        max_sources (int): The maximum number of sources to return.
+        filter (dict, optional): Metadata values the documents must match, e.g. {"focus_area": "Glaucoma"}, applied in the search.
+
+    Returns:
+        list[Document]: A list of documents relevant to the query, empty if none is above the threshold.
+    """
+    with stage("embedding"):
+        embedding = await vector_store.embeddings.aembed_query(query)
+    with stage("search"):
+        relevant_docs_distances = (
+            await vector_store.asimilarity_search_with_score_by_vector(
+                embedding=embedding,
+                k=max_sources,
+                **search_kwargs(vector_store, embedding, similarity_threshold, filter),
+            )
+        )
+    relevance_score_fn = vector_store._select_relevance_score_fn()
+    for doc, distance in relevant_docs_distances:
+        doc.metadata["score"] = relevance_score_fn(distance)
+    relevant_docs = [doc for doc, _ in relevant_docs_distances]
+
+    return relevant_docs
+
+
+async def adiverse_relevant_documents(
+    query: str,
+    vector_store: VectorStore,
+    similarity_threshold: float,
+    max_sources: int,
+    diversity: str,
+    filter: Optional[dict] = None,
+    fetch_factor: int = DIVERSITY_FETCH_FACTOR,
+    afetch_vectors: Optional[
+        Callable[[list[str]], Awaitable[dict[str, list[float]]]]
+    ] = None,
+) -> list[Document]:
+    """
+    Retrieve relevant documents without near-duplicates, see :func:`medichat.diversity.diversify`.
+
+    `max_sources * fetch_factor` candidates are searched, then `max_sources`
+    of them are selected from their stored embeddings with maximal marginal
+    relevance ('mmr') or by dropping the near-duplicates of better ones
+    ('dedup'). A LocalVectorStore returns the embeddings of the candidates; the
+    Cloud SQL vector store does not, so they are read by `afetch_vectors`
+    (e.g. :func:`medichat.ingest.afetch_embeddings`) in one query by content
+    hash, which the results must carry in their metadata.
 
-    relevant_docs_scores = vector_store.similarity_search_with_relevance_scores(
-        query=query, k=max_sources
+    Args:
+        query (str): The search query string.
+        vector_store (VectorStore): The PostgresVectorStore (or LocalVectorStore) used to retrieve documents.
+        similarity_threshold (float): The minimum relevance score of the returned documents, applied in the search.
+        max_sources (int): The maximum number of sources to return.
+        diversity (str): 'mmr' or 'dedup'.
+        filter (dict, optional): Metadata values the documents must match, applied in the search.
+        fetch_factor (int, optional): The number of candidates per returned source. Defaults to DIVERSITY_FETCH_FACTOR.
+        afetch_vectors (Callable, optional): Reads the stored embeddings of content hashes, required by vector stores not returning them.
+
+    Returns:
+        list[Document]: The selected documents, with their relevance score, empty if none is above the threshold.
+
+    Raises:
+        ValueError: If the vector store does not return the embeddings of its results and `afetch_vectors` is not set,
+            or a result has no content hash or no stored embedding (a row stored before content hashes).
+    """
+    with stage("embedding"):
+        embedding = await vector_store.embeddings.aembed_query(query)
+    fetch_k = max_sources * fetch_factor
+    if hasattr(vector_store, "similarity_search_with_vectors_by_vector"):
+        # In a thread, as the search of the local store keeps the CPU busy for milliseconds
+        with stage("search"):
+            docs_distances, vectors = await asyncio.to_thread(
+                vector_store.similarity_search_with_vectors_by_vector,
+                embedding,
+                fetch_k,
+                similarity_threshold or None,
+                filter,
+            )
+    else:
+        if afetch_vectors is None:
+            raise ValueError(
+                f"{type(vector_store).__name__} does not return the embeddings of its results, set afetch_vectors"
+            )
+        with stage("search"):
+            docs_distances = await vector_store.asimilarity_search_with_score_by_vector(
+                embedding=embedding,
+                k=fetch_k,
+                **search_kwargs(vector_store, embedding, similarity_threshold, filter),
+            )
+            content_hashes = [
+                doc.metadata.get(CONTENT_HASH_COLUMN) for doc, _ in docs_distances
+            ]
+            stored = await afetch_vectors(
+                [content_hash for content_hash in content_hashes if content_hash]
+            )
+        missing = [
+            content_hash for content_hash in content_hashes if content_hash not in stored
+        ]
+        if missing:
+            raise ValueError(
+                f"{len(missing)} of {len(content_hashes)} results have no stored embedding by '{CONTENT_HASH_COLUMN}', "
+                "re-ingest them with --incremental"
+            )
+        vectors = np.asarray(
+            [stored[content_hash] for content_hash in content_hashes], dtype=np.float32
+        )
+    if not docs_distances:
+        return []
+
+    with stage("diversity"):
+        selected = diversify(np.asarray(embedding), vectors, max_sources, diversity)
+    relevance_score_fn = vector_store._select_relevance_score_fn()
+    relevant_docs = []
+    for i in selected:
+        doc, distance = docs_distances[i]
+        doc.metadata["score"] = relevance_score_fn(distance)
+        relevant_docs.append(doc)
+
+    return relevant_docs
+
+
+async def abatch_relevant_documents(
+    queries: list[str],
+    vector_store: VectorStore,
+    similarity_threshold: float,
+    max_sources: int,
+    filter: Optional[dict] = None,
+    concurrency: int = BATCH_SEARCH_CONCURRENCY,
+) -> list[list[Document]]:
+    """
+    Retrieve the relevant documents of many queries at once.
+
+    The distinct queries are embedded with one batched call (through
+    `aembed_queries` when the embeddings are cached, so the vectors are the same
+    as one query at a time). A LocalVectorStore then searches all of them with
+    one matrix product in a thread, while the Cloud SQL searches run
+    concurrently, at most `concurrency` at a time so that the connection pool
+    is not exhausted.
+
+    Args:
+        queries (list[str]): The search query strings.
+        vector_store (VectorStore): The PostgresVectorStore (or LocalVectorStore) used to retrieve documents.
+        similarity_threshold (float): The minimum relevance score of the returned documents, applied in the search.
+        max_sources (int): The maximum number of sources to return per query.
+        filter (dict, optional): Metadata values the documents must match, applied in the search.
+        concurrency (int, optional): The maximum number of concurrent searches. Defaults to BATCH_SEARCH_CONCURRENCY.
+
+    Returns:
+        list[list[Document]]: The relevant documents of each query, in the order of the queries.
+    """
+    distinct = list(dict.fromkeys(queries))
+    embeddings = vector_store.embeddings
+    with stage("embedding"):
+        if hasattr(embeddings, "aembed_queries"):
+            vectors = await embeddings.aembed_queries(distinct)
+        else:
+            vectors = await embeddings.aembed_documents(distinct)
+
+    if hasattr(vector_store, "batch_similarity_search_with_score_by_vectors"):
+        with stage("search"):
+            results = await asyncio.to_thread(
+                vector_store.batch_similarity_search_with_score_by_vectors,
+                vectors,
+                max_sources,
+                similarity_threshold or None,
+                filter,
+            )
+    else:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _search(embedding: list[float]) -> list[tuple[Document, float]]:
+            async with semaphore:
+                return await vector_store.asimilarity_search_with_score_by_vector(
+                    embedding=embedding,
+                    k=max_sources,
+                    **search_kwargs(
+                        vector_store, embedding, similarity_threshold, filter
+                    ),
+                )
+
+        # Timed as one stage: the wall time of the concurrent searches
+        with stage("search"):
+            results = await asyncio.gather(*[_search(vector) for vector in vectors])
+
+    relevance_score_fn = vector_store._select_relevance_score_fn()
+    documents = {}
+    for query, docs_distances in zip(distinct, results):
+        for doc, distance in docs_distances:
+            doc.metadata["score"] = relevance_score_fn(distance)
+        documents[query] = [doc for doc, _ in docs_distances]
+
+    return [documents[query] for query in queries]
+
+
+def fusion_key(document: Document) -> tuple:
+    """
+    Identify a document across retrievers, as vector and lexical results are different copies.
+
+    Args:
+        document (Document): A retrieved document.
+
+    Returns:
+        tuple: The question, answer, source and focus area of the document.
+    """
+    return (
+        document.page_content,
+        document.metadata.get("answer"),
+        document.metadata.get("source"),
+        document.metadata.get("focus_area"),
     )
-    for doc, score in relevant_docs_scores:
-        doc.metadata["score"] = score
-    relevant_docs = [doc for doc, _ in relevant_docs_scores]
+
+
+def lexical_documents(
+    docs_scores: list[tuple[Document, float]], max_sources: int
+) -> list[Document]:
+    """
+    Annotate BM25 results with their BM25 score.
+
+    The BM25 score is not comparable with the cosine relevance 'score' of the
+    vector search, nor with the similarity threshold, so it has its own key.
+
+    Args:
+        docs_scores (list[tuple[Document, float]]): The documents and BM25 scores, best first.
+        max_sources (int): The maximum number of sources to return.
+
+    Returns:
+        list[Document]: The documents, with 'bm25_score' and 'retrieval' in their metadata.
+    """
+    documents = []
+    for doc, score in docs_scores[:max_sources]:
+        doc.metadata["bm25_score"] = score
+        doc.metadata["retrieval"] = "lexical"
+        documents.append(doc)
+    return documents
+
+
+async def _alexical_search(
+    lexical_index: BM25Index, question: str, k: int, filter: Optional[dict]
+) -> list[tuple[Document, float]]:
+    """
+    Search the BM25 index in a thread, timed as the 'lexical_search' stage.
+    """
+    with stage("lexical_search"):
+        return await asyncio.to_thread(lexical_index.search, question, k, filter)
+
+
+async def ahybrid_relevant_documents(
+    query: str,
+    question: str,
+    vector_store: VectorStore,
+    lexical_index: BM25Index,
+    similarity_threshold: float,
+    max_sources: int,
+    candidates: int = HYBRID_CANDIDATES,
+    filter: Optional[dict] = None,
+) -> list[Document]:
+    """
+    Retrieve relevant documents with both the vector search and the BM25 index.
+
+    Without a similarity threshold, questions only naming a known focus area
+    (e.g. 'Glaucoma' or 'What is glaucoma ?') take a lexical fast path that
+    skips the embedding call; the threshold is a cosine relevance, which needs
+    the embedding. Otherwise both searches run concurrently, each returning
+    `candidates` documents, and their rankings are fused with reciprocal rank
+    fusion. The similarity threshold applies to the vector search only, so an
+    exact term match (a drug or disease name) is kept even when its embedding is far.
+
+    Args:
+        query (str): The search query string embedded for the vector search.
+        question (str): The question of the user, searched in the BM25 index.
+        vector_store (VectorStore): The PostgresVectorStore (or LocalVectorStore) used to retrieve documents.
+        lexical_index (BM25Index): The BM25 index over the same documents.
+        similarity_threshold (float): The minimum relevance score of the vector results.
+        max_sources (int): The maximum number of sources to return.
+        candidates (int, optional): The number of results of each retriever before fusion. Defaults to HYBRID_CANDIDATES.
+        filter (dict, optional): Metadata values the documents must match, applied by both retrievers.
+
+    Returns:
+        list[Document]: The fused documents, with 'retrieval' ('vector', 'lexical' or 'both'), 'rrf_score',
+        and the 'score' of the vector results or the 'bm25_score' of the lexical ones in their metadata.
+        The documents of the fast path have no 'rrf_score'.
+    """
+    if not similarity_threshold and lexical_index.is_entity_query(
+        question, LEXICAL_FAST_PATH_MAX_TERMS
+    ):
+        lexical_results = await _alexical_search(
+            lexical_index, question, max_sources, filter
+        )
+        if lexical_results:
+            return lexical_documents(lexical_results, max_sources)
+
+    candidates = max(candidates, max_sources)
+    vector_docs, lexical_results = await asyncio.gather(
+        aget_relevant_documents(
+            query, vector_store, similarity_threshold, candidates, filter
+        ),
+        _alexical_search(lexical_index, question, candidates, filter),
+    )
+    lexical_docs = lexical_documents(lexical_results, candidates)
+
+    # Keyed rankings, keeping the best ranked copy of duplicated rows
+    vector_ranking, lexical_ranking = {}, {}
+    for ranking, docs in [
+        (vector_ranking, vector_docs),
+        (lexical_ranking, lexical_docs),
+    ]:
+        for doc in docs:
+            ranking.setdefault(fusion_key(doc), doc)
+
+    relevant_docs = []
+    fused = reciprocal_rank_fusion([list(vector_ranking), list(lexical_ranking)])
+    for key, rrf_score in fused[:max_sources]:
+        # The vector copy is preferred, with its cosine relevance score
+        if key in vector_ranking:
+            doc = vector_ranking[key]
+            doc.metadata["retrieval"] = "both" if key in lexical_ranking else "vector"
+        else:
+            doc = lexical_ranking[key]
+        doc.metadata["rrf_score"] = rrf_score
+        relevant_docs.append(doc)
 
     return relevant_docs
 
@@ -0,0 +1,210 @@
+"""Server-side conversation sessions, so that clients only send a session id."""
+
+import json
+import threading
+import time
+from typing import Optional
+from sqlalchemy import Column, Float, MetaData, String, Table, Text, create_engine
+from sqlalchemy.dialects import postgresql, sqlite
+from medichat.cache import LRUCache
+
+
+def compact_turn(role: str, content: str, sources: Optional[list] = None) -> dict:
+    """
+    Build a stored turn, keeping only what the conversation context needs from the sources.
+
+    Args:
+        role (str): 'user' or 'assistant'.
+        content (str): The text of the turn.
+        sources (list, optional): The documents the answer is grounded on.
+
+    Returns:
+        dict: The turn with 'role', 'content' and the focus area and score of each source.
+    """
+    turn = {"role": role, "content": content}
+    if sources:
+        turn["sources"] = [
+            {
+                "metadata": {
+                    "focus_area": source["metadata"].get("focus_area"),
+                    "score": source["metadata"].get("score"),
+                }
+            }
+            for source in sources
+        ]
+    return turn
+
+
+class InMemorySessionStore:
+    """
+    Sessions kept in the memory of the worker, with LRU eviction and idle expiry.
+
+    Sessions are not shared between uvicorn workers: use :class:`SQLSessionStore`
+    when running more than one worker.
+
+    Example:
+        sessions = InMemorySessionStore(max_sessions=10000, max_turns=50, idle_ttl=7200)
+        sessions.append("session-id", [compact_turn("user", "What is Glaucoma ?")])
+        sessions.get("session-id")
+    """
+
+    def __init__(
+        self, max_sessions: int, max_turns: int, idle_ttl: Optional[float] = None
+    ) -> None:
+        self.max_turns = max_turns
+        self.sessions = LRUCache(maxsize=max_sessions, ttl=idle_ttl)
+        # Appends read and write the session, so concurrent turns of a session take turns
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> list[dict]:
+        """
+        Return the turns of a session, oldest first.
+
+        Args:
+            session_id (str): The id of the session.
+
+        Returns:
+            list[dict]: The stored turns, empty for an unknown or expired session.
+        """
+        return list(self.sessions.get(session_id) or [])
+
+    def append(self, session_id: str, turns: list[dict]) -> None:
+        """
+        Add turns to a session, keeping only its last `max_turns` turns.
+
+        Args:
+            session_id (str): The id of the session.
+            turns (list[dict]): The turns to add.
+        """
+        with self._lock:
+            self.sessions.set(
+                session_id, (self.get(session_id) + turns)[-self.max_turns :]
+            )
+
+    def clear(self, session_id: str) -> None:
+        """
+        Forget a session.
+
+        Args:
+            session_id (str): The id of the session.
+        """
+        with self._lock:
+            self.sessions.set(session_id, [])
+
+
+class SQLSessionStore:
+    """
+    Sessions stored in a SQL database (SQLite or PostgreSQL), shared by every worker.
+
+    Expired sessions read as empty; call :meth:`purge_expired` periodically to
+    delete them.
+
+    Example:
+        sessions = SQLSessionStore("sqlite:///sessions.db", max_turns=50, idle_ttl=7200)
+        sessions.append("session-id", [compact_turn("user", "What is Glaucoma ?")])
+        sessions.get("session-id")
+    """
+
+    def __init__(
+        self, url: str, max_turns: int, idle_ttl: Optional[float] = None
+    ) -> None:
+        self.max_turns = max_turns
+        self.idle_ttl = idle_ttl
+        self.engine = create_engine(url, pool_pre_ping=True)
+        metadata = MetaData()
+        self.table = Table(
+            "medichat_sessions",
+            metadata,
+            Column("session_id", String(64), primary_key=True),
+            Column("turns", Text, nullable=False),
+            Column("updated_at", Float, nullable=False, index=True),
+        )
+        metadata.create_all(self.engine)
+
+    def get(self, session_id: str) -> list[dict]:
+        """
+        Return the turns of a session, oldest first.
+
+        Args:
+            session_id (str): The id of the session.
+
+        Returns:
+            list[dict]: The stored turns, empty for an unknown or expired session.
+        """
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                self.table.select().where(self.table.c.session_id == session_id)
+            ).first()
+        if row is None:
+            return []
+        if self.idle_ttl and row.updated_at + self.idle_ttl < time.time():
+            return []
+        return json.loads(row.turns)
+
+    def append(self, session_id: str, turns: list[dict]) -> None:
+        """
+        Add turns to a session, keeping only its last `max_turns` turns.
+
+        The read and the write are one transaction: the row is created if
+        missing, then locked (``SELECT ... FOR UPDATE`` on PostgreSQL, the
+        database write lock taken by the insert on SQLite), so that concurrent
+        appends to a session, new or not, are applied one after the other
+        instead of overwriting each other.
+
+        Args:
+            session_id (str): The id of the session.
+            turns (list[dict]): The turns to add.
+        """
+        dialect = postgresql if self.engine.dialect.name == "postgresql" else sqlite
+        now = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(
+                dialect.insert(self.table)
+                .values(session_id=session_id, turns="[]", updated_at=now)
+                .on_conflict_do_nothing(index_elements=["session_id"])
+            )
+            row = conn.execute(
+                self.table.select()
+                .where(self.table.c.session_id == session_id)
+                .with_for_update()
+            ).one()
+            previous = json.loads(row.turns)
+            if self.idle_ttl and row.updated_at + self.idle_ttl < now:
+                previous = []
+            conn.execute(
+                self.table.update()
+                .where(self.table.c.session_id == session_id)
+                .values(
+                    turns=json.dumps((previous + turns)[-self.max_turns :]),
+                    updated_at=now,
+                )
+            )
+
+    def clear(self, session_id: str) -> None:
+        """
+        Forget a session.
+
+        Args:
+            session_id (str): The id of the session.
+        """
+        with self.engine.begin() as conn:
+            conn.execute(
+                self.table.delete().where(self.table.c.session_id == session_id)
+            )
+
+    def purge_expired(self) -> int:
+        """
+        Delete the sessions idle for longer than `idle_ttl`.
+
+        Returns:
+            int: The number of deleted sessions.
+        """
+        if not self.idle_ttl:
+            return 0
+        with self.engine.begin() as conn:
+            deleted = conn.execute(
+                self.table.delete().where(
+                    self.table.c.updated_at < time.time() - self.idle_ttl
+                )
+            )
+        return deleted.rowcount
@@ -0,0 +1,106 @@
+"""Fixtures running the API on the offline backends of the load test, see `benchmarks/loadtest/fakes.py`."""
+
+import asyncio
+import gc
+import httpx
+import pytest
+from langchain_core.runnables import RunnableLambda
+import medichat.api as api
+from benchmarks.loadtest.fakes import (
+    FakeChatModel,
+    FakeEmbeddings,
+    build_local_store,
+    load_fixture,
+)
+from benchmarks.loadtest.server import FIXTURE_PATH
+from medichat.cache import AnswerCache
+
+
+def payload(question: str, **fields) -> dict:
+    """
+    Build the body of a request to the API, with the settings of the Streamlit app.
+    """
+    return {
+        "question": question,
+        "temperature": 0.2,
+        "similarity_threshold": 0.0,
+        "max_sources": 4,
+        "language": "English",
+        **fields,
+    }
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def embeddings() -> FakeEmbeddings:
+    """
+    The embeddings of the API, without latency; override the fixture in a module to slow them down.
+    """
+    return FakeEmbeddings(dim=64)
+
+
+@pytest.fixture
+def llm() -> FakeChatModel:
+    """
+    The LLM of the API, without latency; override the fixture in a module to slow it down.
+    """
+    return FakeChatModel(latency=0.0, tokens_per_second=10_000, answer_tokens=8)
+
+
+@pytest.fixture
+def prompts() -> list:
+    """
+    The prompts sent to the LLM, one per generated answer.
+    """
+    return []
+
+
+@pytest.fixture
+def chain(llm: FakeChatModel, prompts: list):
+    """
+    The generation chain of the API, recording its prompts in `prompts`.
+    """
+    return (
+        api.PROMPT
+        | RunnableLambda(lambda prompt: prompts.append(prompt) or prompt)
+        | llm
+    )
+
+
+@pytest.fixture
+async def client(tmp_path, monkeypatch, embeddings, chain):
+    """
+    Run the API with the 'local' vector backend on the MedQuAD fixture and the fake clients, as the load test does.
+
+    Yields:
+        httpx.AsyncClient: A client sending its requests to the API in-process.
+    """
+    build_local_store(str(tmp_path), load_fixture(FIXTURE_PATH), embeddings)
+    monkeypatch.setattr(api, "VECTOR_BACKEND", "local")
+    monkeypatch.setattr(api, "LOCAL_STORE_PATH", str(tmp_path))
+    monkeypatch.setattr(api, "SESSION_DB_URL", None)
+    monkeypatch.setattr(api, "EMBEDDING_CACHE_PATH", None)
+    monkeypatch.setattr(api, "get_embeddings", lambda: embeddings)
+    monkeypatch.setattr(api, "get_chain", lambda model, temperature: chain)
+    monkeypatch.setattr(
+        api, "ANSWERS", AnswerCache(maxsize=100, similarity_threshold=0.97)
+    )
+    monkeypatch.setattr(api, "LEXICAL_INDEX", None)
+    monkeypatch.setattr(api, "LEXICAL_INDEX_LOCK", asyncio.Lock())
+    async with api.lifespan(api.app):
+        await api.STARTUP
+        # A full collection over the heap of the whole session takes longer than the
+        # latency budgets of the timing tests: start each test with a clean, frozen heap
+        gc.collect()
+        gc.freeze()
+        # Unhandled errors are answered with a 500, as uvicorn does
+        transport = httpx.ASGITransport(app=api.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://medichat"
+        ) as client:
+            yield client
+    gc.unfreeze()
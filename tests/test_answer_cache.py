@@ -0,0 +1,117 @@
+"""Answers are only reused for the same question, sources and prompt context."""
+
+import pytest
+import medichat.api as api
+from medichat.cache import AnswerCache
+from tests.conftest import payload
+
+QUESTION = "What causes it ?"
+SOURCE_IDS = ["source-1", "source-2"]
+
+
+def test_prompt_context_is_part_of_the_key():
+    cache = AnswerCache(maxsize=10, similarity_threshold=0.9)
+    cache.set(
+        QUESTION,
+        "English",
+        SOURCE_IDS,
+        0.2,
+        answer="Glaucoma is caused by...",
+        generation_time=1.0,
+        question_embedding=[1.0, 0.0],
+        prompt_context="user: What is Glaucoma ?",
+    )
+
+    assert (
+        cache.get(
+            QUESTION,
+            "English",
+            SOURCE_IDS,
+            0.2,
+            prompt_context="user: What is Glaucoma ?",
+        )
+        == "Glaucoma is caused by..."
+    )
+    assert (
+        cache.get(
+            QUESTION,
+            "English",
+            SOURCE_IDS,
+            0.2,
+            prompt_context="user: What is Asthma ?",
+        )
+        is None
+    )
+    # Nor is a near-duplicate question of another conversation answered from the cache
+    assert (
+        cache.get(
+            "what causes it?",
+            "English",
+            SOURCE_IDS,
+            0.2,
+            question_embedding=[1.0, 0.01],
+            prompt_context="user: What is Asthma ?",
+        )
+        is None
+    )
+
+
+@pytest.mark.anyio
+async def test_follow_up_questions_of_other_conversations(client, prompts):
+    sources = (
+        await client.post(
+            "/get_sources", json=payload("What is (are) Synthetic condition 01 ?")
+        )
+    ).json()
+    conversations = [
+        [{"role": "user", "content": "What is (are) Synthetic condition 01 ?"}],
+        [{"role": "user", "content": "What is (are) Synthetic condition 02 ?"}],
+        [{"role": "user", "content": "What is (are) Synthetic condition 01 ?"}],
+    ]
+    for previous_context in conversations:
+        response = await client.post(
+            "/answer",
+            json=payload(
+                QUESTION, documents=sources, previous_context=previous_context
+            ),
+        )
+        assert response.status_code == 200
+
+    # The third conversation is the first one again: its answer comes from the cache
+    assert len(prompts) == 2
+
+
+@pytest.mark.anyio
+async def test_document_token_budget_is_part_of_the_key(client, prompts):
+    sources = (
+        await client.post(
+            "/get_sources", json=payload("What is (are) Synthetic condition 01 ?")
+        )
+    ).json()
+    for budget in [0, 200, 0]:
+        response = await client.post(
+            "/answer",
+            json=payload(
+                "What is (are) Synthetic condition 01 ?",
+                documents=sources,
+                document_token_budget=budget,
+            ),
+        )
+        assert response.status_code == 200
+
+    assert len(prompts) == 2
+    # Packed under 200 tokens, the documents of the second prompt are shorter
+    assert len(prompts[1].to_string()) < len(prompts[0].to_string())
+
+
+@pytest.mark.anyio
+async def test_answer_without_documents(client, prompts, monkeypatch):
+    async def aembed_query(self, text):
+        raise AssertionError("the question was embedded")
+
+    monkeypatch.setattr(type(api.EMBEDDING), "aembed_query", aembed_query)
+    response = await client.post("/answer", json=payload(QUESTION, documents=[]))
+
+    assert response.status_code == 200
+    assert response.json()["message"] == api.NO_SOURCES_MESSAGES["English"]
+    assert prompts == []
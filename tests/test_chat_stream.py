@@ -0,0 +1,52 @@
+"""/chat/stream sends the sources, the tokens and the timings, or an error status when retrieval fails."""
+
+import asyncio
+import json
+import pytest
+import medichat.api as api
+from tests.conftest import payload
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_frames(client):
+    response = await client.post(
+        "/chat/stream", json=payload("What is (are) Synthetic condition 03 ?")
+    )
+
+    assert response.status_code == 200
+    frames = [json.loads(line) for line in response.text.splitlines()]
+    assert frames[0]["type"] == "sources"
+    assert len(frames[0]["sources"]) == 4
+    assert {frame["type"] for frame in frames[1:-1]} == {"token"}
+    assert frames[-1]["type"] == "metadata"
+    assert frames[-1]["timings"]["total"] >= frames[-1]["timings"]["retrieval"]
+
+
+async def test_not_ready(client, monkeypatch):
+    startup = asyncio.get_running_loop().create_future()
+    startup.set_exception(RuntimeError("Cloud SQL is unreachable"))
+    monkeypatch.setattr(api, "STARTUP", startup)
+
+    response = await client.post(
+        "/chat/stream", json=payload("What is (are) Synthetic condition 03 ?")
+    )
+
+    assert response.status_code == 503
+    assert "Cloud SQL is unreachable" in response.json()["detail"]
+
+
+async def test_retrieval_error(client, monkeypatch):
+    async def search(*args, **kwargs):
+        raise ConnectionError("The vector store is unreachable")
+
+    monkeypatch.setattr(
+        api.LOCAL_STORE, "asimilarity_search_with_score_by_vector", search
+    )
+
+    response = await client.post(
+        "/chat/stream", json=payload("What is (are) Synthetic condition 03 ?")
+    )
+
+    assert response.status_code == 500
+    assert "sources" not in response.text
@@ -0,0 +1,132 @@
+"""The request path is async: slow embedding and LLM calls overlap instead of queueing behind each other."""
+
+import asyncio
+import time
+import pytest
+import medichat.api as api
+from benchmarks.loadtest.fakes import FakeChatModel, FakeEmbeddings
+from tests.conftest import payload
+
+pytestmark = pytest.mark.anyio
+
+EMBEDDING_LATENCY = 0.2
+LLM_LATENCY = 0.2
+REQUESTS = 10
+SEARCH_DURATION = 0.4
+
+
+@pytest.fixture
+def embeddings() -> FakeEmbeddings:
+    return FakeEmbeddings(dim=64, latency=EMBEDDING_LATENCY)
+
+
+@pytest.fixture
+def llm() -> FakeChatModel:
+    return FakeChatModel(latency=LLM_LATENCY, tokens_per_second=10_000, answer_tokens=8)
+
+
+async def test_get_sources_concurrently(client):
+    questions = [
+        f"What causes Synthetic condition {i + 1:02d} ?" for i in range(REQUESTS)
+    ]
+    start_time = time.perf_counter()
+    responses = await asyncio.gather(
+        *[client.post("/get_sources", json=payload(question)) for question in questions]
+    )
+    elapsed = time.perf_counter() - start_time
+
+    assert [response.status_code for response in responses] == [200] * REQUESTS
+    # One after the other, the embedding calls alone would take REQUESTS * EMBEDDING_LATENCY
+    assert elapsed < REQUESTS * EMBEDDING_LATENCY / 2
+    # Each request got its own sources, the same as when asked alone
+    for question, response in zip(questions, responses):
+        alone = await client.post("/get_sources", json=payload(question))
+        assert len(response.json()) == 4
+        assert response.json() == alone.json()
+
+
+async def test_answer_concurrently(client):
+    sources = (
+        await client.post(
+            "/get_sources", json=payload("What is (are) Synthetic condition 01 ?")
+        )
+    ).json()
+    start_time = time.perf_counter()
+    responses = await asyncio.gather(
+        *[
+            client.post(
+                "/answer",
+                json=payload(
+                    f"Question {i} about Synthetic condition 01", documents=sources
+                ),
+                headers={"Cache-Control": "no-cache"},
+            )
+            for i in range(REQUESTS)
+        ]
+    )
+    elapsed = time.perf_counter() - start_time
+
+    assert [response.status_code for response in responses] == [200] * REQUESTS
+    assert all(
+        response.json()["message"].startswith("token0") for response in responses
+    )
+    # One after the other, the answers would take REQUESTS * (EMBEDDING_LATENCY + LLM_LATENCY)
+    assert elapsed < REQUESTS * (EMBEDDING_LATENCY + LLM_LATENCY) / 2
+
+
+async def test_health_during_generation(client):
+    sources = (
+        await client.post(
+            "/get_sources", json=payload("What is (are) Synthetic condition 02 ?")
+        )
+    ).json()
+    generation = asyncio.create_task(
+        client.post(
+            "/answer",
+            json=payload("What is (are) Synthetic condition 02 ?", documents=sources),
+        )
+    )
+    await asyncio.sleep(LLM_LATENCY / 4)
+
+    start_time = time.perf_counter()
+    response = await client.get("/healthz")
+    elapsed = time.perf_counter() - start_time
+
+    assert response.status_code == 200
+    assert not generation.done()
+    assert elapsed < LLM_LATENCY / 4
+    assert (await generation).status_code == 200
+
+
+@pytest.mark.parametrize("diversity", ["none", "mmr"])
+async def test_health_during_local_search(client, monkeypatch, diversity):
+    # A local search over a large corpus keeps the CPU busy: it must not hold the event loop
+    store = type(api.LOCAL_STORE)
+    for name in [
+        "similarity_search_with_score_by_vector",
+        "similarity_search_with_vectors_by_vector",
+    ]:
+        search = getattr(store, name)
+        monkeypatch.setattr(
+            store,
+            name,
+            lambda *args, search=search, **kwargs: (
+                time.sleep(SEARCH_DURATION) or search(*args, **kwargs)
+            ),
+        )
+    retrieval = asyncio.create_task(
+        client.post(
+            "/get_sources",
+            json=payload("What is (are) Synthetic condition 03 ?", diversity=diversity),
+        )
+    )
+    await asyncio.sleep(EMBEDDING_LATENCY + SEARCH_DURATION / 4)
+
+    start_time = time.perf_counter()
+    response = await client.get("/healthz")
+    elapsed = time.perf_counter() - start_time
+
+    assert response.status_code == 200
+    assert not retrieval.done()
+    assert elapsed < SEARCH_DURATION / 4
+    assert (await retrieval).status_code == 200
@@ -0,0 +1,104 @@
+"""The conversation context sent to the LLM stays within its token budget however long the conversation is."""
+
+import pytest
+from benchmarks.loadtest.fakes import FakeChatModel
+from medichat.config import CONTEXT_TOKEN_BUDGET
+from medichat.context import build_context, estimate_tokens
+from medichat.session import compact_turn
+from tests.conftest import payload
+
+LONG_ANSWER = "Synthetic conditions damage the synthetic nerve over the years. " * 100
+
+
+def source(focus_area: str, answer: str = LONG_ANSWER) -> dict:
+    return {
+        "page_content": f"What is (are) {focus_area} ?",
+        "metadata": {
+            "answer": answer,
+            "source": "GARD",
+            "focus_area": focus_area,
+            "score": 0.9,
+        },
+    }
+
+
+def conversation(turns: int) -> list[dict]:
+    """
+    Alternate long questions and long answers, each grounded on a source.
+    """
+    messages = []
+    for i in range(turns):
+        focus_area = f"Synthetic condition {i // 2 % 10 + 1:02d}"
+        if i % 2 == 0:
+            messages.append(
+                compact_turn(
+                    "user", f"What is (are) {focus_area} ? " + "Please detail. " * 50
+                )
+            )
+        else:
+            messages.append(
+                compact_turn("assistant", LONG_ANSWER, [source(focus_area)])
+            )
+    return messages
+
+
+@pytest.mark.parametrize("turns", [1, 2, 6, 7, 20, 100])
+@pytest.mark.parametrize("token_budget", [200, CONTEXT_TOKEN_BUDGET])
+def test_context_within_budget(turns, token_budget):
+    context, _ = build_context(conversation(turns), "What causes it ?", token_budget)
+
+    assert 0 < estimate_tokens(context) <= token_budget
+
+
+def test_long_conversation():
+    messages = conversation(100)
+    context, last_entity = build_context(messages, "What causes it ?")
+
+    assert last_entity == "Synthetic condition 10"
+    assert context.startswith("SUMMARY OF EARLIER TURNS:\n")
+    assert "RECENT TURNS:\n" in context
+    # The last question is kept verbatim, as far as its share of the budget goes
+    assert f"user: {messages[-2]['content'][:100]}" in context
+
+
+def test_compact_turn_drops_the_source_answers():
+    short = compact_turn(
+        "assistant", "It is...", [source("Glaucoma", answer="Short answer.")]
+    )
+    long = compact_turn("assistant", "It is...", [source("Glaucoma")])
+
+    assert long == short
+    assert long["sources"] == [{"metadata": {"focus_area": "Glaucoma", "score": 0.9}}]
+
+
+@pytest.fixture
+def llm() -> FakeChatModel:
+    # About 700 tokens per answer, so that the whole transcript would outgrow the budget in a few turns
+    return FakeChatModel(latency=0.0, tokens_per_second=1e6, answer_tokens=300)
+
+
+@pytest.mark.anyio
+async def test_prompt_bounded_over_100_turns(client, prompts):
+    sources = (
+        await client.post(
+            "/get_sources", json=payload("What is (are) Synthetic condition 01 ?")
+        )
+    ).json()
+    for i in range(100):
+        response = await client.post(
+            "/answer",
+            json=payload(
+                f"What causes it ? (question {i})",
+                documents=sources,
+                session_id="100-turns",
+            ),
+        )
+        assert response.status_code == 200
+
+    sizes = [estimate_tokens(prompt.to_string()) for prompt in prompts]
+    assert len(sizes) == 100
+    # The first prompt has no conversation: later ones add at most the context and the last entity
+    last_entity = sources[0]["metadata"]["focus_area"]
+    assert (
+        max(sizes) <= sizes[0] + CONTEXT_TOKEN_BUDGET + estimate_tokens(last_entity) + 1
+    )
@@ -0,0 +1,143 @@
+"""The diversity selection works on the stored embeddings of the candidates, whichever the vector store."""
+
+import json
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+import medichat.api as api
+from benchmarks.loadtest.fakes import FakeEmbeddings
+from benchmarks.loadtest.server import FIXTURE_PATH
+from medichat.config import METADATA_COLUMNS
+from medichat.ingest import (
+    PostgresBatchWriter,
+    document_uuid,
+    read_medquad_chunks,
+    row_to_document,
+)
+from medichat.local_store import LocalVectorStore
+from medichat.retrieve import adiverse_relevant_documents
+
+pytestmark = pytest.mark.anyio
+
+QUERY = "What are the symptoms of Synthetic condition 05 ?"
+
+
+class CountingEmbeddings(FakeEmbeddings):
+    texts = 0
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.texts += len(texts)
+        return await super().aembed_documents(texts)
+
+
+class CloudSQLStore:
+    """
+    The Cloud SQL vector store over the rows written by PostgresBatchWriter.
+
+    As PostgresVectorStore does, the results carry the JSON metadata of their
+    row and its `metadata_columns`, and not their embeddings.
+    """
+
+    def __init__(
+        self, store: LocalVectorStore, rows: list[dict], metadata_columns: list[str]
+    ) -> None:
+        self.store = store
+        self.rows = rows
+        self.metadata_columns = metadata_columns
+        self.embeddings = store.embeddings
+
+    async def asimilarity_search_with_score_by_vector(self, embedding, k, **kwargs):
+        results = []
+        for index, score in self.store.search(np.asarray([embedding]), k)[0]:
+            row = self.rows[index]
+            metadata = json.loads(row["metadata"])
+            for column in self.metadata_columns:
+                metadata[column] = row[column]
+            results.append(
+                (Document(page_content=row["content"], metadata=metadata), 1 - score)
+            )
+        return results
+
+    async def afetch_vectors(self, content_hashes: list[str]) -> dict[str, list]:
+        # As medichat.ingest.afetch_embeddings reads them
+        return {
+            row["content_hash"]: json.loads(row["embedding"])
+            for row in self.rows
+            if row["content_hash"] in content_hashes
+        }
+
+    def _select_relevance_score_fn(self):
+        return self.store._select_relevance_score_fn()
+
+
+@pytest.fixture
+def store(tmp_path) -> LocalVectorStore:
+    # The documents of the ingestion, with their content hash in the metadata
+    documents = [
+        row_to_document(row)
+        for chunk in read_medquad_chunks(FIXTURE_PATH, 100)
+        for _, row in chunk.iterrows()
+    ]
+    embeddings = CountingEmbeddings(dim=64)
+    vectors = np.array([embeddings._embed(doc.page_content) for doc in documents])
+    LocalVectorStore.build(str(tmp_path), documents, vectors)
+    return LocalVectorStore.load(str(tmp_path), embeddings)
+
+
+def cloud_sql_store(store: LocalVectorStore, metadata_columns: list[str]):
+    documents = store.documents
+    return CloudSQLStore(
+        store,
+        PostgresBatchWriter.rows(
+            [document_uuid(doc.metadata["content_hash"]) for doc in documents],
+            documents,
+            store.vectors.tolist(),
+        ),
+        metadata_columns,
+    )
+
+
+@pytest.mark.parametrize("diversity", ["mmr", "dedup"])
+async def test_stored_vectors(store, diversity):
+    cloud_sql = cloud_sql_store(store, METADATA_COLUMNS)
+    fetched = []
+
+    async def afetch_vectors(content_hashes: list[str]) -> dict[str, list]:
+        fetched.append(content_hashes)
+        return await cloud_sql.afetch_vectors(content_hashes)
+
+    expected = await adiverse_relevant_documents(QUERY, store, 0.0, 4, diversity)
+    documents = await adiverse_relevant_documents(
+        QUERY, cloud_sql, 0.0, 4, diversity, afetch_vectors=afetch_vectors
+    )
+
+    assert len(documents) == 4
+    assert [doc.page_content for doc in documents] == [
+        doc.page_content for doc in expected
+    ]
+    # Only the queries were embedded, and the candidates were read in one call
+    assert store.embeddings.texts == 2
+    assert len(fetched) == 1 and len(fetched[0]) == 16
+
+
+async def test_results_without_content_hash(store):
+    # The JSON metadata alone does not hold the content hash
+    cloud_sql = cloud_sql_store(store, [])
+    with pytest.raises(ValueError, match="no stored embedding"):
+        await adiverse_relevant_documents(
+            QUERY, cloud_sql, 0.0, 4, "mmr", afetch_vectors=cloud_sql.afetch_vectors
+        )
+
+
+async def test_without_stored_vectors(store):
+    with pytest.raises(ValueError, match="afetch_vectors"):
+        await adiverse_relevant_documents(
+            QUERY, cloud_sql_store(store, METADATA_COLUMNS), 0.0, 4, "mmr"
+        )
+
+
+async def test_unknown_diversity_mode(monkeypatch):
+    monkeypatch.setattr(api, "DIVERSITY_MODE", "fastest")
+    with pytest.raises(ValueError, match="MEDICHAT_DIVERSITY_MODE"):
+        async with api.lifespan(api.app):
+            pass
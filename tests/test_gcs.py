@@ -0,0 +1,54 @@
+"""The bucket sync downloads each blob to its own path, once, and only keeps files matching their checksums."""
+
+import sys
+import pytest
+from benchmarks.gcs_sync import FakeBlob, FakeBucket, FakeClient
+from medichat.gcs import download_blob, file_checksums, sync_bucket
+
+
+def client(*blobs: FakeBlob) -> FakeClient:
+    return FakeClient(FakeBucket(list(blobs), latency=0.0))
+
+
+def test_same_name_in_subdirectories(tmp_path):
+    bucket = client(
+        FakeBlob("data/medquad.csv", b"questions", latency=0.0),
+        FakeBlob("data/2024/medquad.csv", b"other questions", latency=0.0),
+    )
+    report = sync_bucket(bucket, "bucket", str(tmp_path))
+
+    assert sorted(report["downloaded"]) == ["data/2024/medquad.csv", "data/medquad.csv"]
+    assert (tmp_path / "medquad.csv").read_bytes() == b"questions"
+    assert (tmp_path / "2024" / "medquad.csv").read_bytes() == b"other questions"
+    assert not list(tmp_path.rglob("*.part"))
+
+    report = sync_bucket(bucket, "bucket", str(tmp_path))
+    assert sorted(report["skipped"]) == ["data/2024/medquad.csv", "data/medquad.csv"]
+
+
+def test_checksum_mismatch(tmp_path):
+    blob = FakeBlob("data/medquad.csv", b"questions", latency=0.0)
+    blob.data = b"truncated"
+    report = sync_bucket(client(blob), "bucket", str(tmp_path))
+
+    assert report["failed"] == ["data/medquad.csv"]
+    assert not (tmp_path / "medquad.csv").exists()
+    assert not (tmp_path / "medquad.csv.part").exists()
+
+
+def test_outside_of_the_directory(tmp_path):
+    blob = FakeBlob("data/medquad.csv", b"questions", latency=0.0)
+    with pytest.raises(ValueError, match="outside of the directory"):
+        download_blob(blob, str(tmp_path / "data"), local_name="../medquad.csv")
+    assert not (tmp_path / "medquad.csv").exists()
+
+
+def test_md5_only_without_google_crc32c(tmp_path, monkeypatch):
+    path = tmp_path / "medquad.csv"
+    path.write_bytes(b"questions")
+    expected = FakeBlob("data/medquad.csv", b"questions", latency=0.0)
+    monkeypatch.setitem(sys.modules, "google_crc32c", None)
+
+    assert file_checksums(str(path)) == {"md5_hash": expected.md5_hash, "crc32c": None}
+    _, downloaded = download_blob(expected, str(tmp_path / "copy"))
+    assert downloaded
@@ -0,0 +1,88 @@
+"""The hybrid retrieval keeps BM25 scores apart from the relevance scores, and honours the similarity threshold."""
+
+import asyncio
+import time
+import pytest
+from benchmarks.loadtest.fakes import FakeEmbeddings
+from medichat.lexical import BM25Index
+from tests.conftest import payload
+
+pytestmark = pytest.mark.anyio
+
+SEARCH_DURATION = 0.4
+
+
+class CountingEmbeddings(FakeEmbeddings):
+    calls = 0
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.calls += 1
+        return await super().aembed_documents(texts)
+
+
+@pytest.fixture
+def embeddings() -> CountingEmbeddings:
+    return CountingEmbeddings(dim=64)
+
+
+async def test_fast_path_without_threshold(client, embeddings):
+    response = await client.post(
+        "/get_sources",
+        json=payload("Synthetic condition 04", retrieval_mode="hybrid"),
+    )
+
+    assert response.status_code == 200
+    assert embeddings.calls == 0
+    sources = response.json()
+    assert len(sources) == 4
+    for source in sources:
+        assert source["metadata"]["focus_area"] == "Synthetic condition 04"
+        assert source["metadata"]["retrieval"] == "lexical"
+        assert source["metadata"]["bm25_score"] > 0
+        assert "score" not in source["metadata"]
+
+
+async def test_threshold_applies_to_entity_questions(client, embeddings):
+    response = await client.post(
+        "/get_sources",
+        json=payload(
+            "Synthetic condition 04", retrieval_mode="hybrid", similarity_threshold=0.5
+        ),
+    )
+
+    assert response.status_code == 200
+    assert embeddings.calls == 1
+    sources = response.json()
+    assert sources
+    for source in sources:
+        metadata = source["metadata"]
+        if metadata["retrieval"] == "lexical":
+            assert "score" not in metadata and metadata["bm25_score"] > 0
+        else:
+            assert metadata["score"] >= 0.5
+
+
+async def test_health_during_fast_path(client, monkeypatch):
+    # BM25 scores the whole corpus: the fast path must not hold the event loop meanwhile
+    search = BM25Index.search
+    monkeypatch.setattr(
+        BM25Index,
+        "search",
+        lambda *args, **kwargs: time.sleep(SEARCH_DURATION) or search(*args, **kwargs),
+    )
+    retrieval = asyncio.create_task(
+        client.post(
+            "/get_sources",
+            json=payload("Synthetic condition 04", retrieval_mode="hybrid"),
+        )
+    )
+    await asyncio.sleep(SEARCH_DURATION / 4)
+
+    start_time = time.perf_counter()
+    response = await client.get("/healthz")
+    elapsed = time.perf_counter() - start_time
+
+    assert response.status_code == 200
+    assert not retrieval.done()
+    assert elapsed < SEARCH_DURATION / 4
+    assert (await retrieval).status_code == 200
@@ -0,0 +1,66 @@
+"""The CSV ingestion writes every batch once, resumes from its checkpoint and stops at the first failure."""
+
+import asyncio
+import pytest
+from benchmarks.loadtest.fakes import FakeEmbeddings
+from benchmarks.loadtest.server import FIXTURE_PATH
+from medichat.ingest import aingest_csv
+
+pytestmark = pytest.mark.anyio
+
+
+class RecordingWriter:
+    """
+    Records the written documents, and fails at the `fail_at`-th batch.
+    """
+
+    def __init__(self, fail_at: int = 0) -> None:
+        self.fail_at = fail_at
+        self.calls = 0
+        self.ids = []
+
+    async def __call__(self, ids, documents, embeddings) -> None:
+        self.calls += 1
+        if self.calls == self.fail_at:
+            raise ConnectionError("The database is gone")
+        await asyncio.sleep(0)
+        self.ids.extend(ids)
+
+
+async def test_ingest_every_row(tmp_path):
+    writer = RecordingWriter()
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    stats = await aingest_csv(
+        FIXTURE_PATH,
+        FakeEmbeddings(dim=8),
+        writer,
+        batch_size=7,
+        concurrency=3,
+        checkpoint_path=checkpoint_path,
+    )
+
+    assert stats["rows"] == len(writer.ids) == len(set(writer.ids)) == 60
+    # Run again, every batch is in the checkpoint
+    again = RecordingWriter()
+    stats = await aingest_csv(
+        FIXTURE_PATH,
+        FakeEmbeddings(dim=8),
+        again,
+        batch_size=7,
+        concurrency=3,
+        checkpoint_path=checkpoint_path,
+    )
+    assert stats["rows"] == again.calls == 0
+
+
+async def test_first_failure_stops_the_ingestion():
+    # The queue holds 2 batches: the reader would wait on it forever once the workers are gone
+    writer = RecordingWriter(fail_at=1)
+    with pytest.raises(ConnectionError, match="The database is gone"):
+        await asyncio.wait_for(
+            aingest_csv(
+                FIXTURE_PATH, FakeEmbeddings(dim=8), writer, batch_size=5, concurrency=1
+            ),
+            timeout=5,
+        )
+    assert writer.calls == 1
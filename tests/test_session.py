@@ -0,0 +1,104 @@
+"""Sessions keep their last turns, and the least recently used or idle sessions are evicted."""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from medichat.session import InMemorySessionStore, SQLSessionStore, compact_turn
+from tests.conftest import payload
+
+
+def turns(count: int, start: int = 0) -> list[dict]:
+    return [compact_turn("user", f"Question {i}") for i in range(start, start + count)]
+
+
+def test_max_turns():
+    sessions = InMemorySessionStore(max_sessions=10, max_turns=50)
+    for i in range(0, 120, 2):
+        sessions.append("session", turns(2, i))
+
+    assert sessions.get("session") == turns(50, 70)
+
+
+def test_least_recently_used_eviction():
+    sessions = InMemorySessionStore(max_sessions=2, max_turns=50)
+    sessions.append("a", turns(1))
+    sessions.append("b", turns(1))
+    sessions.get("a")
+    sessions.append("c", turns(1))
+
+    assert sessions.get("a") == turns(1)
+    assert sessions.get("b") == []
+    assert sessions.get("c") == turns(1)
+
+
+def test_idle_expiry():
+    sessions = InMemorySessionStore(max_sessions=10, max_turns=50, idle_ttl=0.05)
+    sessions.append("session", turns(1))
+    assert sessions.get("session") == turns(1)
+
+    time.sleep(0.1)
+    assert sessions.get("session") == []
+
+
+def test_clear():
+    sessions = InMemorySessionStore(max_sessions=10, max_turns=50)
+    sessions.append("session", turns(4))
+    sessions.clear("session")
+
+    assert sessions.get("session") == []
+
+
+def test_sql_concurrent_appends(tmp_path):
+    sessions = SQLSessionStore(f"sqlite:///{tmp_path}/sessions.db", max_turns=1000)
+    # Every worker appends to the same new session at once: none of them may fail or be lost
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda i: sessions.append("new", turns(1, i)), range(40)))
+
+    assert sorted(turn["content"] for turn in sessions.get("new")) == sorted(
+        turn["content"] for turn in turns(40)
+    )
+
+
+def test_sql_max_turns_and_expiry(tmp_path):
+    sessions = SQLSessionStore(
+        f"sqlite:///{tmp_path}/sessions.db", max_turns=50, idle_ttl=0.05
+    )
+    for i in range(0, 120, 2):
+        sessions.append("session", turns(2, i))
+    assert sessions.get("session") == turns(50, 70)
+
+    time.sleep(0.1)
+    assert sessions.get("session") == []
+    # An expired session starts over, and is purged once idle again
+    sessions.append("session", turns(1))
+    assert sessions.get("session") == turns(1)
+    time.sleep(0.1)
+    assert sessions.purge_expired() == 1
+
+
+@pytest.mark.anyio
+async def test_session_id_length(client):
+    response = await client.post(
+        "/answer", json=payload("What is (are) Glaucoma ?", session_id="x" * 65)
+    )
+
+    assert response.status_code == 422
+
+
+def test_concurrent_appends(monkeypatch):
+    sessions = InMemorySessionStore(max_sessions=10, max_turns=1000)
+    # Widen the gap between reading and writing the session, as a busy worker would
+    get = sessions.get
+
+    def slow_get(session_id: str) -> list[dict]:
+        session = get(session_id)
+        time.sleep(0.001)
+        return session
+
+    monkeypatch.setattr(sessions, "get", slow_get)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda i: sessions.append("session", turns(1, i)), range(40)))
+
+    assert sorted(turn["content"] for turn in get("session")) == sorted(
+        turn["content"] for turn in turns(40)
+    )